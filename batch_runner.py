@@ -0,0 +1,359 @@
+import json
+import logging
+import os
+import time
+import uuid
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
+from llm_question_handler import SYSTEM_PROMPT, _invalid_answer_error, _prepare_request, _validate_answer
+from openai_clients import get_openai_client
+from supabase_handler import SupabaseHandler
+from convert_to_json import question_shown
+from token_usage import BATCH_DISCOUNT, TokenUsage, count_usage, usage_from_response
+
+if TYPE_CHECKING:
+    import openai
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Batch states after which polling stops
+BATCH_FINAL_STATES = ('completed', 'failed', 'expired', 'cancelled')
+# Batch API limits per batch: request lines and input file size
+MAX_BATCH_REQUESTS = 50_000
+MAX_BATCH_FILE_BYTES = 200 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def build_batch_requests(questions: List[Dict[str, Any]], personas: List[Dict[str, Any]], model: str = "gpt-4o-mini") -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """
+    Builds one Batch API request line per (persona, question) pair.
+
+    Args:
+        questions: Question objects as returned by convert_yaml_to_json_objects
+        personas: One dictionary per simulated respondent. An optional 'session_id' is
+            used as-is (a UUID is generated otherwise) and an optional 'system_prompt'
+            replaces the default respondent system prompt.
+        model: OpenAI model to use (default: gpt-4o-mini)
+
+    Returns:
+        tuple: (request lines for the JSONL file, index mapping each custom_id to its
+            'session_id', 'question', 'options' and 'has_options')
+    """
+    lines = []
+    index = {}
+    for persona in personas:
+        session_id = persona.get('session_id') or str(uuid.uuid4())
+        system_prompt = persona.get('system_prompt', SYSTEM_PROMPT)
+        for position, question in enumerate(questions):
+            request, options, has_options = _prepare_request(question, model, system_prompt)
+            # The position keeps ids unique even if a questionnaire repeats a key
+            custom_id = f"{session_id}|{position}|{question.get('key')}"
+            lines.append({
+                'custom_id': custom_id,
+                'method': 'POST',
+                'url': BATCH_ENDPOINT,
+                'body': request
+            })
+            index[custom_id] = {
+                'session_id': session_id,
+                'question': question,
+                'options': options,
+                'has_options': has_options
+            }
+    return lines, index
+
+
+def split_batch_requests(lines: List[Dict[str, Any]], max_requests: int = MAX_BATCH_REQUESTS, max_bytes: int = MAX_BATCH_FILE_BYTES) -> List[List[Dict[str, Any]]]:
+    """
+    Split request lines into groups that each fit in one batch
+
+    Args:
+        lines: Request lines as returned by build_batch_requests
+        max_requests: Most request lines per batch
+        max_bytes: Largest JSONL input file per batch, as written by write_batch_file
+
+    Returns:
+        list: Groups of request lines, in their original order
+
+    Raises:
+        ValueError: If a single request line is larger than max_bytes
+    """
+    groups: List[List[Dict[str, Any]]] = []
+    group: List[Dict[str, Any]] = []
+    group_bytes = 0
+    for line in lines:
+        size = len(json.dumps(line, ensure_ascii=False).encode('utf-8')) + 1
+        if size > max_bytes:
+            raise ValueError(f"request {line['custom_id']} is {size} bytes, over the {max_bytes} byte batch file limit")
+        if group and (len(group) >= max_requests or group_bytes + size > max_bytes):
+            groups.append(group)
+            group, group_bytes = [], 0
+        group.append(line)
+        group_bytes += size
+    if group:
+        groups.append(group)
+    return groups
+
+
+def write_batch_file(lines: List[Dict[str, Any]], path: str) -> str:
+    """Write request lines to a JSONL file and return its path"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False))
+            f.write('\n')
+    return path
+
+
+def submit_batch(path: str, client: Optional["openai.OpenAI"] = None, completion_window: str = "24h", metadata: Optional[Dict[str, str]] = None) -> str:
+    """
+    Upload a JSONL request file and start a batch job
+
+    Returns:
+        str: The batch id
+    """
+    if client is None:
+        client = get_openai_client()
+    with open(path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose='batch')
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=completion_window,
+        metadata=metadata
+    )
+    logger.info("Submitted batch", extra={'batch_id': batch.id, 'input_file_id': input_file.id})
+    return batch.id
+
+
+def wait_for_batch(batch_id: str, client: Optional["openai.OpenAI"] = None, poll_interval: float = 30.0, timeout: Optional[float] = None):
+    """
+    Poll a batch until it reaches a final state
+
+    Returns:
+        The final Batch object
+
+    Raises:
+        TimeoutError: If the batch is still running after timeout seconds
+    """
+    if client is None:
+        client = get_openai_client()
+    started = time.monotonic()
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in BATCH_FINAL_STATES:
+            return batch
+        if timeout is not None and time.monotonic() - started > timeout:
+            raise TimeoutError(f"Batch {batch_id} still '{batch.status}' after {timeout} seconds")
+        time.sleep(poll_interval)
+
+
+def parse_batch_results(output_text: str, index: Dict[str, Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Map Batch API output lines back to sessions and questions
+
+    Successful answers go through the same option validation as
+    ask_question_result. Failed requests and answers that match none of the
+    options are returned separately instead of being replaced with a fallback
+    answer, so they can be retried.
+
+    Returns:
+        tuple: (responses with 'custom_id', 'session_id', 'question', 'answer' and 'usage' keys,
+            failures with 'custom_id', 'session_id', 'question', 'error' and 'usage' keys;
+            usage is None when the line reports none, see token_usage.usage_from_response)
+    """
+    responses = []
+    failures = []
+    for line in output_text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        entry = index.get(result.get('custom_id'))
+        if entry is None:
+            continue
+        response = result.get('response') or {}
+        body = response.get('body') or {}
+        error = result.get('error') or body.get('error')
+        if error is None and response.get('status_code') != 200:
+            error = {'message': f"status code {response.get('status_code')}"}
+        usage = usage_from_response(body.get('usage'), body.get('model'), BATCH_DISCOUNT)
+        if error is None:
+            try:
+                answer = body['choices'][0]['message']['content'].strip()
+            except (KeyError, IndexError, TypeError, AttributeError) as e:
+                error = {'message': f"malformed response body: {e}"}
+        if error is None:
+            match = _validate_answer(entry['question'], answer)
+            if not match.valid:
+                error = {'message': _invalid_answer_error(entry['question'], answer, match), 'type': 'invalid_answer'}
+        if error is not None:
+            failures.append({
+                'custom_id': result.get('custom_id'),
+                'session_id': entry['session_id'],
+                'question': entry['question'],
+                'error': error,
+                'usage': usage
+            })
+            continue
+        responses.append({
+            'custom_id': result.get('custom_id'),
+            'session_id': entry['session_id'],
+            'question': entry['question'],
+            'answer': match.value,
+            'usage': usage
+        })
+    return responses, failures
+
+
+def drop_unreachable(responses: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Removes answers whose display condition does not hold for their session's other answers
+
+    A batch asks every question in one round, so gated questions are always
+    answered; this keeps them out of the stored data when they would not have
+    been shown. Conditions on dropped answers are re-checked until stable.
+
+    Returns:
+        tuple: (kept responses, dropped responses)
+    """
+    kept = responses
+    while True:
+        answers: Dict[str, Dict[str, Any]] = {}
+        for response in kept:
+            answers.setdefault(response['session_id'], {})[response['question']['key']] = response['answer']
+        still_shown = [response for response in kept if question_shown(response['question'], answers[response['session_id']])]
+        if len(still_shown) == len(kept):
+            break
+        kept = still_shown
+    kept_ids = {id(response) for response in kept}
+    return kept, [response for response in responses if id(response) not in kept_ids]
+
+
+def run_batch_survey(questions: List[Dict[str, Any]], personas: List[Dict[str, Any]], handler: Optional[SupabaseHandler] = None, client: Optional["openai.OpenAI"] = None, model: str = "gpt-4o-mini", workdir: str = ".", poll_interval: float = 30.0, timeout: Optional[float] = None, max_requests: int = MAX_BATCH_REQUESTS, max_bytes: int = MAX_BATCH_FILE_BYTES) -> Dict[str, Any]:
+    """
+    Answer a questionnaire for many personas through the OpenAI Batch API
+
+    Builds the request lines, splits them into as many batches as the Batch
+    API limits require (see split_batch_requests), submits them all, waits
+    for each, validates the answers and, if a handler is given, writes them
+    with one bulk insert. A batch still running when timeout runs out is
+    reported in 'unfinished_batch_ids' and its requests are left out, while
+    the results of the batches that finished are kept and stored. Its output
+    can be fetched later with wait_for_batch and parse_batch_results, using
+    the index from build_batch_requests. Answers to questions whose display condition
+    ('show_if') does not hold are left out (see drop_unreachable). Token
+    counts and cost (at the Batch API discount) are added to each session
+    and to one survey_runs row per batch, named after the batch id.
+
+    Args:
+        questions: Question objects as returned by convert_yaml_to_json_objects
+        personas: Respondent dictionaries (see build_batch_requests)
+        handler: Optional SupabaseHandler that receives the answers
+        client: Optional OpenAI client (defaults to the shared client)
+        model: OpenAI model to use (default: gpt-4o-mini)
+        workdir: Directory the request JSONL files are written to; each is deleted once uploaded
+        poll_interval: Seconds between status checks
+        timeout: Optional limit in seconds on how long to wait for all batches
+        max_requests: Most request lines per batch
+        max_bytes: Largest input file per batch
+
+    Returns:
+        Dictionary with 'batch_ids', 'unfinished_batch_ids', 'status' ('completed' when
+        every batch completed, otherwise the first other final state, or 'timed_out' for a
+        batch still running), 'responses', 'failures', 'unreachable', 'usage' (see
+        TokenUsage.as_dict) and 'stored'
+    """
+    if client is None:
+        client = get_openai_client()
+
+    lines, index = build_batch_requests(questions, personas, model)
+    # Submit every batch before waiting so they run side by side
+    submitted = []
+    for group in split_batch_requests(lines, max_requests, max_bytes):
+        path = write_batch_file(group, os.path.join(workdir, f"batch_{uuid.uuid4().hex}.jsonl"))
+        try:
+            submitted.append((submit_batch(path, client), group))
+        finally:
+            os.remove(path)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    responses, failures = [], []
+    statuses = []
+    unfinished = []
+    batch_usage: Dict[str, TokenUsage] = {}
+    session_usage: Dict[str, TokenUsage] = {}
+    for batch_id, group in submitted:
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+        try:
+            batch = wait_for_batch(batch_id, client, poll_interval, remaining)
+        except TimeoutError:
+            logger.warning("Batch still running at the timeout", extra={'batch_id': batch_id, 'requests': len(group)})
+            statuses.append('timed_out')
+            unfinished.append(batch_id)
+            continue
+        statuses.append(batch.status)
+        batch_index = {line['custom_id']: index[line['custom_id']] for line in group}
+
+        batch_responses, batch_failures = [], []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                file_responses, file_failures = parse_batch_results(client.files.content(file_id).text, batch_index)
+                batch_responses.extend(file_responses)
+                batch_failures.extend(file_failures)
+
+        # Requests missing from both files (e.g. an expired batch) count as failures too
+        seen = {item['custom_id'] for item in batch_responses + batch_failures}
+        for custom_id, entry in batch_index.items():
+            if custom_id not in seen:
+                batch_failures.append({
+                    'custom_id': custom_id,
+                    'session_id': entry['session_id'],
+                    'question': entry['question'],
+                    'error': {'message': f"no result (batch status '{batch.status}')"}
+                })
+
+        # Every completed request is billed, including answers dropped below
+        for item in batch_responses + batch_failures:
+            if item.get('usage') is not None:
+                session_usage.setdefault(item['session_id'], TokenUsage()).add(item['usage'])
+                batch_usage.setdefault(batch_id, TokenUsage()).add(item['usage'])
+                count_usage(item['usage'])
+        responses.extend(batch_responses)
+        failures.extend(batch_failures)
+
+    usage = TokenUsage()
+    for totals in batch_usage.values():
+        usage.merge(totals)
+    status = next((status for status in statuses if status != 'completed'), 'completed')
+
+    responses, unreachable = drop_unreachable(responses)
+
+    stored = False
+    if handler is not None and responses:
+        stored = handler.bulk_insert_responses(responses)
+    if handler is not None and usage:
+        handler.add_session_usage(session_usage)
+        for batch_id, totals in batch_usage.items():
+            handler.add_run_usage(batch_id, model, totals)
+
+    batch_ids = [batch_id for batch_id, _ in submitted]
+    logger.info("Batch finished", extra={'batch_ids': batch_ids, 'unfinished_batch_ids': unfinished, 'status': status, 'answers': len(responses), 'failures': len(failures), 'tokens': usage.prompt_tokens + usage.completion_tokens, 'cost_usd': round(usage.cost_usd, 6)})
+    return {
+        'batch_ids': batch_ids,
+        'unfinished_batch_ids': unfinished,
+        'status': status,
+        'responses': responses,
+        'failures': failures,
+        'unreachable': unreachable,
+        'usage': usage.as_dict(),
+        'stored': stored
+    }
+
+
+# Example usage:
+# from convert_to_json import convert_yaml_to_json_objects
+# from supabase_handler import SupabaseHandler
+# from batch_runner import run_batch_survey
+#
+# questions = convert_yaml_to_json_objects('sample_q.yml')
+# personas = [{} for _ in range(1000)]   # 1000 respondents with the default system prompt
+# result = run_batch_survey(questions, personas, handler=SupabaseHandler(), poll_interval=60)
+# print(result['status'], len(result['responses']), len(result['failures']))
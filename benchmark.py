@@ -0,0 +1,419 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, List, Optional, Sequence
+try:
+    import resource
+except ImportError:
+    # Windows: peak RSS is not reported
+    resource = None
+import yaml
+from fake_openai_server import FakeOpenAIServer, default_answer
+from fake_supabase_handler import FakeSupabaseHandler
+from llm_question_handler import _prepare_request
+from question_plan import QuestionPlan
+from rate_limiter import LLMResult, LLMScheduler, RateLimiter
+from response_writer import ResponseWriter
+from supabase_handler import SupabaseHandler
+from survey_runner import answer_questions_async
+
+SESSION_COUNTS = (1, 100, 10_000)
+STAGES = ('yaml_parse', 'prompt', 'llm', 'validate', 'db_write')
+PERCENTILES = (50, 95, 99)
+
+# Relative change a metric may show against its baseline before it counts as a regression
+DEFAULT_TOLERANCE = 0.25
+# Stage latencies below this many milliseconds are too noisy to compare
+MIN_COMPARED_MS = 1.0
+# Settings that must match for two runs to be comparable
+COMPARED_SETTINGS = ('questions_path', 'conditions_path', 'latency', 'error_rate', 'rate_limit_rate', 'db', 'db_latency', 'max_concurrency', 'sessions_in_flight', 'store_batch_size')
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """q-th percentile of already sorted values, interpolating between neighbours"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class StageTimer:
+    """Latency samples of the pipeline stages, in seconds"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    @contextmanager
+    def measure(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, mean and percentiles (in milliseconds) of every stage"""
+        result = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            result[stage] = {'count': len(ordered), 'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0}
+            for q in PERCENTILES:
+                result[stage][f'p{q}_ms'] = round(percentile(ordered, q) * 1000, 3)
+        return result
+
+
+class TimedScheduler(LLMScheduler):
+    """
+    LLMScheduler that times every call as the 'llm' stage (limiter waits and
+    retries included) and keeps the raw content of successful single-question
+    calls, keyed by their prompt, so validation can be replayed on it.
+    """
+
+    def __init__(self, client, timer: StageTimer, **kwargs):
+        super().__init__(client, **kwargs)
+        self.timer = timer
+        # (user prompt, raw completion content)
+        self.completions: List[tuple] = []
+
+    async def complete_async(self, request: Dict[str, Any]) -> LLMResult:
+        started = time.perf_counter()
+        result = await super().complete_async(request)
+        self.timer.record('llm', time.perf_counter() - started)
+        if result.ok and 'response_format' not in request:
+            self.completions.append((request['messages'][-1]['content'], result.content))
+        return result
+
+
+class TimedHandler:
+    """Database handler wrapper that times each bulk insert as the 'db_write' stage"""
+
+    def __init__(self, handler, timer: StageTimer):
+        self.handler = handler
+        self.timer = timer
+
+    def bulk_insert_responses(self, responses: List[Dict[str, Any]]) -> bool:
+        with self.timer.measure('db_write'):
+            return self.handler.bulk_insert_responses(responses)
+
+    def __getattr__(self, name):
+        return getattr(self.handler, name)
+
+
+def varied_answer(seed: int = 0) -> Callable[[Dict[str, Any]], str]:
+    """
+    Answer function for FakeOpenAIServer that picks a random option and words
+    it the way models do ('Yes', 'yes.', 'My answer: Yes'), so validation
+    sees more than exact matches
+    """
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    forms = (str, str, str.lower, lambda option: f"{option}.", lambda option: f"My answer: {option}", lambda option: f'"{option}"')
+
+    def answer(body: Dict[str, Any]) -> str:
+        prompt = body['messages'][-1]['content']
+        if body.get('response_format') or not prompt.startswith('Available options: '):
+            return default_answer(body)
+        options = prompt.split('\n', 1)[0][len('Available options: '):].split(', ')
+        with lock:
+            option, form = rng.choice(options), rng.choice(forms)
+        return form(option)
+
+    return answer
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+async def _answer_sessions(plan: QuestionPlan, session_ids: List[str], scheduler: LLMScheduler, writer: ResponseWriter, model: str, max_concurrency: int, sessions_in_flight: int) -> Counter:
+    semaphore = asyncio.Semaphore(sessions_in_flight)
+    statuses = Counter()
+
+    async def run_session(session_id: str):
+        async with semaphore:
+            results = await answer_questions_async(plan, model=model, max_concurrency=max_concurrency, writer=writer, session_id=session_id, scheduler=scheduler)
+        statuses.update(result['status'] for result in results)
+
+    await asyncio.gather(*(run_session(session_id) for session_id in session_ids))
+    return statuses
+
+
+def run_scenario(questions_path: str, sessions: int, base_url: str, handler, model: str = "gpt-4o-mini", max_concurrency: int = 4, sessions_in_flight: int = 64, store_batch_size: int = 1000, requests_per_minute: Optional[float] = None, yaml_repeats: int = 20, trace_memory: bool = False, conditions: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Answers the questionnaire for a number of sessions and measures every stage
+
+    yaml_parse, prompt and validate are timed in isolation on this run's
+    inputs (the questionnaire, every session's requests and the raw answers
+    the server returned); llm and db_write are timed live while the sessions
+    run through answer_questions_async and a ResponseWriter. prompt builds
+    each request from the question object, formatting the options and the
+    prompt text as an uncompiled questionnaire would, rather than reusing the
+    plan's prebuilt prompts.
+
+    Args:
+        questions_path: Questionnaire YAML file
+        sessions: Number of sessions to answer
+        base_url: OpenAI-compatible endpoint, e.g. a FakeOpenAIServer
+        handler: Database handler the answers are written to
+        model: Model name sent with each request
+        max_concurrency: Simultaneous API calls per session
+        sessions_in_flight: Sessions answered concurrently
+        store_batch_size: Responses per bulk insert
+        requests_per_minute: Client-side request limit (None: unlimited)
+        yaml_repeats: Number of times the questionnaire is parsed for yaml_parse
+        trace_memory: Also report the peak of Python allocations (slows the run down)
+        conditions: Display conditions for the questionnaire (see convert_yaml_to_json_objects);
+            None asks every question
+
+    Returns:
+        Dictionary with throughput, per-stage latency percentiles and memory
+    """
+    timer = StageTimer()
+    for _ in range(max(yaml_repeats, 1)):
+        with timer.measure('yaml_parse'):
+            plan = QuestionPlan.compile(questions_path, conditions)
+
+    session_ids = [str(uuid.uuid4()) for _ in range(sessions)]
+    for _ in session_ids:
+        for index in range(len(plan)):
+            with timer.measure('prompt'):
+                _prepare_request(plan.questions[index], model)
+
+    if trace_memory:
+        tracemalloc.start()
+    limiter = RateLimiter(requests_per_minute or 1e9, 1e12)
+    started = time.perf_counter()
+
+    async def run():
+        import openai
+        client = openai.AsyncOpenAI(api_key='benchmark', base_url=base_url)
+        try:
+            scheduler = TimedScheduler(client, timer, limiter=limiter, base_delay=0.01)
+            with ResponseWriter(TimedHandler(handler, timer), max_batch_size=store_batch_size, flush_interval=0.5) as writer:
+                statuses = await _answer_sessions(plan, session_ids, scheduler, writer, model, max_concurrency, sessions_in_flight)
+            return statuses, scheduler, writer
+        finally:
+            await client.close()
+
+    statuses, scheduler, writer = asyncio.run(run())
+    seconds = time.perf_counter() - started
+    traced_peak = None
+    if trace_memory:
+        traced_peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        tracemalloc.stop()
+
+    index_by_prompt = {prompt: index for index, prompt in enumerate(plan.prompts)}
+    invalid = 0
+    for prompt, content in scheduler.completions:
+        index = index_by_prompt.get(prompt)
+        if index is None:
+            continue
+        with timer.measure('validate'):
+            valid, _ = plan.validate(index, content)
+        invalid += not valid
+
+    answered = statuses['ok']
+    return {
+        'sessions': sessions,
+        'questions': answered,
+        'skipped': statuses['skipped'],
+        'failed': sum(count for status, count in statuses.items() if status not in ('ok', 'skipped')),
+        'invalid_answers': invalid,
+        'stored': writer.written_count,
+        'seconds': round(seconds, 3),
+        'questions_per_second': round(answered / seconds, 1) if seconds > 0 else 0.0,
+        'stages': timer.summary(),
+        'llm': scheduler.stats(),
+        'peak_rss_mb': _peak_rss_mb(),
+        'traced_peak_mb': traced_peak
+    }
+
+
+def run_benchmark(questions_path: str = 'sample_q.yml', session_counts: Sequence[int] = SESSION_COUNTS, latency: float = 0.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0, handler_factory: Optional[Callable[[], Any]] = None, db_latency: float = 0.0, model: str = "gpt-4o-mini", max_concurrency: int = 4, sessions_in_flight: int = 64, store_batch_size: int = 1000, requests_per_minute: Optional[float] = None, yaml_repeats: int = 20, trace_memory: bool = False, seed: int = 0, conditions_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Runs the end-to-end pipeline offline against a FakeOpenAIServer for each session count
+
+    Args:
+        questions_path: Questionnaire YAML file
+        session_counts: Scenarios to run, smallest first (peak RSS only grows)
+        latency: Seconds the fake server takes per request
+        error_rate: Share of requests the fake server answers with a 500
+        rate_limit_rate: Share of requests the fake server answers with a 429
+        handler_factory: Builds the database handler (default: a FakeSupabaseHandler
+            with db_latency per write; pass SupabaseHandler for a local Postgres)
+        db_latency: Simulated seconds per write of the default handler
+        model, max_concurrency, sessions_in_flight, store_batch_size, requests_per_minute,
+            yaml_repeats, trace_memory: See run_scenario
+        seed: Seed of the fake server's errors and answers
+        conditions_path: Optional YAML/JSON display conditions file, e.g. sample_q.conditions.yml;
+            without it every question is asked
+
+    Returns:
+        Dictionary with the 'settings' and one result per session count under 'scenarios'
+    """
+    db = 'fake' if handler_factory is None else getattr(handler_factory, '__name__', 'custom')
+    if handler_factory is None:
+        handler_factory = lambda: FakeSupabaseHandler(write_latency=db_latency, keep_rows=False)
+    settings = {
+        'questions_path': questions_path,
+        'conditions_path': conditions_path,
+        'latency': latency,
+        'error_rate': error_rate,
+        'rate_limit_rate': rate_limit_rate,
+        'db': db,
+        'db_latency': db_latency,
+        'model': model,
+        'max_concurrency': max_concurrency,
+        'sessions_in_flight': sessions_in_flight,
+        'store_batch_size': store_batch_size,
+        'requests_per_minute': requests_per_minute
+    }
+    conditions = None
+    if conditions_path is not None:
+        with open(conditions_path, 'r', encoding='utf-8') as f:
+            conditions = yaml.safe_load(f)
+    scenarios = {}
+    with FakeOpenAIServer(answer=varied_answer(seed), latency=latency, error_rate=error_rate, rate_limit_rate=rate_limit_rate, retry_after=0.01, seed=seed, keep_requests=False) as server:
+        for sessions in sorted(session_counts):
+            handler = handler_factory()
+            try:
+                scenarios[str(sessions)] = run_scenario(questions_path, sessions, server.base_url, handler, model, max_concurrency, sessions_in_flight, store_batch_size, requests_per_minute, yaml_repeats, trace_memory, conditions)
+            finally:
+                handler.close()
+    return {'settings': settings, 'scenarios': scenarios}
+
+
+def compare_to_baseline(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    Regressions of a benchmark run against a stored baseline
+
+    Throughput may drop, and p95/p99 stage latencies and peak memory may
+    grow, by at most tolerance (relative) per scenario. Scenarios missing
+    from either run are not compared.
+
+    Args:
+        results: Output of run_benchmark
+        baseline: Earlier output of run_benchmark, e.g. loaded from a JSON file
+        tolerance: Allowed relative change, e.g. 0.25 for 25%
+
+    Returns:
+        One message per regressed metric (empty if there are none)
+    """
+    differing = [name for name in COMPARED_SETTINGS if results['settings'].get(name) != baseline['settings'].get(name)]
+    if differing:
+        raise ValueError(f"Baseline was recorded with different settings: {', '.join(differing)}")
+
+    regressions = []
+    for sessions, current in results['scenarios'].items():
+        base = baseline['scenarios'].get(sessions)
+        if base is None:
+            continue
+        if current['questions_per_second'] < base['questions_per_second'] * (1 - tolerance):
+            regressions.append(f"{sessions} sessions: throughput {current['questions_per_second']} questions/s, baseline {base['questions_per_second']}")
+        for stage in STAGES:
+            for metric in ('p95_ms', 'p99_ms'):
+                now, before = current['stages'][stage][metric], base['stages'].get(stage, {}).get(metric)
+                if before is not None and now >= MIN_COMPARED_MS and now > before * (1 + tolerance):
+                    regressions.append(f"{sessions} sessions: {stage} {metric} {now}, baseline {before}")
+        for metric in ('peak_rss_mb', 'traced_peak_mb'):
+            now, before = current.get(metric), base.get(metric)
+            if now is not None and before is not None and now > before * (1 + tolerance):
+                regressions.append(f"{sessions} sessions: {metric} {now}, baseline {before}")
+    return regressions
+
+
+def print_results(results: Dict[str, Any]):
+    for sessions, scenario in results['scenarios'].items():
+        print(f"{sessions} sessions: {scenario['questions']} answers in {scenario['seconds']}s ({scenario['questions_per_second']} questions/s), "
+              f"{scenario['failed']} failed, {scenario['skipped']} skipped, {scenario['invalid_answers']} invalid, peak RSS {scenario['peak_rss_mb']} MB"
+              + (f", traced peak {scenario['traced_peak_mb']} MB" if scenario['traced_peak_mb'] is not None else ""))
+        for stage, stats in scenario['stages'].items():
+            print(f"  {stage:<10} n={stats['count']:<7} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms  p99 {stats['p99_ms']:>9.3f} ms")
+
+
+def main(argv: Optional[List[str]] = None, prog: Optional[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog=prog, description="Offline end-to-end throughput benchmark against a fake OpenAI server")
+    parser.add_argument('--questions', default='sample_q.yml', help="Questionnaire YAML file")
+    parser.add_argument('--conditions', help="Display conditions file, e.g. sample_q.conditions.yml; without it every question is asked")
+    parser.add_argument('--sessions', type=int, nargs='+', default=list(SESSION_COUNTS), help="Session counts to run, one scenario each")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds the fake server takes per request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with a 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Share of requests answered with a 429")
+    parser.add_argument('--db', action='store_true', help="Write to the database configured for SupabaseHandler (e.g. a local Postgres) instead of the in-process stand-in")
+    parser.add_argument('--db-latency', type=float, default=0.0, help="Simulated seconds per write of the in-process stand-in")
+    parser.add_argument('--max-concurrency', type=int, default=4, help="Simultaneous API calls per session")
+    parser.add_argument('--sessions-in-flight', type=int, default=64, help="Concurrent sessions")
+    parser.add_argument('--store-batch-size', type=int, default=1000)
+    parser.add_argument('--requests-per-minute', type=float, help="Client-side request limit")
+    parser.add_argument('--trace-memory', action='store_true', help="Also measure the peak of Python allocations (slower)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', help="Baseline JSON file to compare against; exits with 1 on regressions")
+    parser.add_argument('--save-baseline', help="Write the results as the new baseline JSON file")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="Allowed relative change against the baseline")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(
+        args.questions,
+        args.sessions,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        handler_factory=SupabaseHandler if args.db else None,
+        db_latency=args.db_latency,
+        max_concurrency=args.max_concurrency,
+        sessions_in_flight=args.sessions_in_flight,
+        store_batch_size=args.store_batch_size,
+        requests_per_minute=args.requests_per_minute,
+        trace_memory=args.trace_memory,
+        seed=args.seed,
+        conditions_path=args.conditions
+    )
+    print_results(results)
+    for path in (args.output, args.save_baseline):
+        if path is not None:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+# Example usage:
+# python benchmark.py --sessions 1 100 10000 --latency 0.05 --error-rate 0.01 --rate-limit-rate 0.02 --save-baseline bench_baseline.json
+# # After a change, fail if throughput, stage p95/p99 or memory regressed by more than 25%
+# python benchmark.py --sessions 1 100 10000 --latency 0.05 --error-rate 0.01 --rate-limit-rate 0.02 --baseline bench_baseline.json
+#
+# # Against a local Postgres (SUPABASE_* environment variables) instead of the in-process stand-in
+# python benchmark.py --sessions 100 --db
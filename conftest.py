@@ -0,0 +1,38 @@
+import os
+import uuid
+import pytest
+import supabase_handler
+from supabase_handler import SupabaseHandler
+
+
+@pytest.fixture
+def pg_handler(monkeypatch):
+    """
+    SupabaseHandler on a freshly migrated scratch database, dropped afterwards
+
+    Needs a Postgres server named by TEST_POSTGRES_HOST (and optionally
+    TEST_POSTGRES_PORT, TEST_POSTGRES_USER, TEST_POSTGRES_PASSWORD); skipped otherwise.
+    """
+    host = os.getenv('TEST_POSTGRES_HOST')
+    if not host:
+        pytest.skip("TEST_POSTGRES_HOST is not set")
+    port = os.getenv('TEST_POSTGRES_PORT', '5432')
+    user = os.getenv('TEST_POSTGRES_USER', 'postgres')
+    password = os.getenv('TEST_POSTGRES_PASSWORD', 'postgres')
+    psycopg2 = supabase_handler._import_psycopg2()
+    database = f"surveybot_test_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(host=host, port=port, user=user, password=password, dbname='postgres')
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f"CREATE DATABASE {database}")
+    for name, value in (('SUPABASE_HOST', host), ('SUPABASE_PORT', port), ('SUPABASE_USER', user), ('SUPABASE_PASSWORD', password), ('SUPABASE_DATABASE', database)):
+        monkeypatch.setenv(name, value)
+    handler = SupabaseHandler(max_connections=4)
+    try:
+        handler.migrate()
+        yield handler
+    finally:
+        handler.close()
+        with admin.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE {database}")
+        admin.close()
@@ -1,11 +1,37 @@
 import yaml
 import json
+import logging
 
+logger = logging.getLogger(__name__)
 
-def convert_yaml_to_json_objects(yaml_path):
+
+def convert_yaml_to_json_objects(yaml_path, dedupe=True, conditions=None):
+    """
+    Converts a questionnaire YAML file into a list of question objects.
+
+    A question is asked only if its display condition holds. Conditions come
+    from a 'show_if' field on the question (or its matrix, for every row) or
+    from the conditions argument, which maps question (or matrix) keys to the
+    same structure and takes precedence, e.g. {'continuance': {'future': 'no'}}.
+    Each condition maps prerequisite question keys to an allowed value or list
+    of values (option labels or values); all prerequisites must match. They are
+    normalized to question['show_if'] = {key: [allowed option values]}.
+
+    Options given as a label -> value mapping become question['options'] (the
+    values) and question['option_labels'] (the mapping), so answers can be
+    matched by label too.
+    """
     with open(yaml_path, 'r', encoding='utf-8') as f:
         data = yaml.safe_load(f)
 
+    # Expanded row keys of every matrix mapped to (matrix key, row name), built
+    # once instead of rescanning a row map for every standalone row entry
+    matrix_rows = {}
+    for key, value in data.items():
+        if value.get('type') == 'matrix':
+            for row_label, row_key in (value.get('row') or {}).items():
+                matrix_rows[f'{key}_{row_key}'] = (key, row_label)
+
     result = []
     for key, value in data.items():
         q_type = value.get('type')
@@ -22,11 +48,16 @@ def convert_yaml_to_json_objects(yaml_path):
                 opt_list = options
             for row_label, row_key in rows.items():
                 obj = {
-                    'key': f'rankings_{row_key}',
+                    'key': f'{key}_{row_key}',
                     'type': 'mc',
                     'label': f"{matrix_label} {row_label}",
-                    'options': opt_list
+                    'options': opt_list,
+                    'matrix_key': key
                 }
+                if isinstance(options, dict):
+                    obj['option_labels'] = {str(k): v for k, v in options.items()}
+                if value.get('show_if'):
+                    obj['show_if'] = value['show_if']
                 result.append(obj)
         else:
             # Normalize options to list of values if present
@@ -36,18 +67,14 @@ def convert_yaml_to_json_objects(yaml_path):
                 opt_list = options
             else:
                 opt_list = None
+            matrix_key = matrix_rows.get(key, (None, None))[0]
             # If label is a list (as in rankings_og_tril), use the parent matrix label
-            if isinstance(label, list) and key.startswith('rankings_'):
+            if isinstance(label, list) and (matrix_key or key.startswith('rankings_')):
                 # Find the parent matrix label
-                parent_matrix = data.get('rankings', {})
+                parent_matrix = data.get(matrix_key or 'rankings', {})
                 matrix_label = parent_matrix.get('label', '')
                 # Find the row name from the key
-                row_map = parent_matrix.get('row', {})
-                row_name = None
-                for k, v in row_map.items():
-                    if f'rankings_{v}' == key:
-                        row_name = k
-                        break
+                row_name = matrix_rows.get(key, (None, None))[1]
                 if row_name:
                     label = f"{matrix_label} {row_name}"
                 else:
@@ -59,10 +86,103 @@ def convert_yaml_to_json_objects(yaml_path):
             }
             if opt_list is not None:
                 obj['options'] = opt_list
+            if isinstance(options, dict):
+                obj['option_labels'] = {str(k): v for k, v in options.items()}
+            if matrix_key:
+                obj['matrix_key'] = matrix_key
+            if value.get('show_if') or (matrix_key and data[matrix_key].get('show_if')):
+                obj['show_if'] = value.get('show_if') or data[matrix_key]['show_if']
             result.append(obj)
+
+    _apply_conditions(result, data, conditions or {})
+
+    if dedupe:
+        result, merges = dedupe_questions(result)
+        if merges:
+            logger.info("Merged duplicate questions", extra={'merged': [m['key'] for m in merges]})
     return result
 
 
+def _apply_conditions(questions, data, conditions):
+    """Normalizes show_if of every question in place, validating the prerequisite keys"""
+    # Option label -> value per question key, so conditions may use either
+    option_values = {}
+    for key, value in data.items():
+        options = value.get('options')
+        labels = options if isinstance(options, dict) else {}
+        option_values[key] = labels
+        for row_key in (value.get('row') or {}).values():
+            option_values[f'{key}_{row_key}'] = labels
+
+    for question in questions:
+        spec = conditions.get(question['key'], conditions.get(question.get('matrix_key'), question.get('show_if')))
+        if not spec:
+            question.pop('show_if', None)
+            continue
+        if not isinstance(spec, dict):
+            raise ValueError(f"show_if of question '{question['key']}' must map question keys to allowed answers")
+        show_if = {}
+        for dependency, allowed in spec.items():
+            if dependency not in option_values:
+                raise ValueError(f"show_if of question '{question['key']}' refers to unknown question '{dependency}'")
+            labels = option_values[dependency]
+            allowed = allowed if isinstance(allowed, list) else [allowed]
+            show_if[dependency] = [labels.get(value, value) if isinstance(value, str) else value for value in allowed]
+        question['show_if'] = show_if
+
+
+def question_shown(question, answers):
+    """Whether a question's display condition holds for the answers given so far (key -> answer)"""
+    for key, allowed in (question.get('show_if') or {}).items():
+        if key not in answers:
+            return False
+        answer = answers[key]
+        if answer not in allowed and str(answer).strip().lower() not in {str(value).lower() for value in allowed}:
+            return False
+    return True
+
+def dedupe_questions(questions):
+    """
+    Merge question objects that share a key, such as a matrix row and the
+    standalone entry for the same row.
+
+    The first occurrence keeps its position; fields it lacks are filled in
+    from later duplicates.
+
+    Returns:
+        tuple: (de-duplicated questions, one merge record per dropped duplicate
+            with 'key', 'kept_index', 'dropped_index' and 'conflicts' (fields whose
+            values differed; the first occurrence's value was kept))
+    """
+    result = []
+    position_by_key = {}
+    merges = []
+    for index, question in enumerate(questions):
+        key = question.get('key')
+        if key not in position_by_key:
+            position_by_key[key] = (len(result), index)
+            result.append(dict(question))
+            continue
+        position, kept_index = position_by_key[key]
+        kept = result[position]
+        conflicts = []
+        for field, value in question.items():
+            if kept.get(field) in (None, [], ''):
+                kept[field] = value
+            elif value not in (None, [], '') and kept[field] != value:
+                conflicts.append(field)
+        merges.append({
+            'key': key,
+            'kept_index': kept_index,
+            'dropped_index': index,
+            'conflicts': conflicts
+        })
+    return result, merges
+
+
 # Example usage:
 # objs = convert_yaml_to_json_objects('sample_q.yml')
-# print(json.dumps(objs, indent=2)) 
\ No newline at end of file
+# print(json.dumps(objs, indent=2))
+#
+# # Only ask 'continuance' to respondents who answered 'No' to 'future'
+# objs = convert_yaml_to_json_objects('sample_q.yml', conditions={'continuance': {'future': 'No'}}) 
\ No newline at end of file
@@ -0,0 +1,31 @@
+import threading
+
+_loaded = False
+_lock = threading.Lock()
+
+
+def load_env():
+    """
+    Load the .env file into os.environ, once per process
+
+    Called where settings are first read (API keys, database credentials)
+    rather than at import, so processes that never need them skip
+    python-dotenv and the file lookup. Variables already set in the
+    environment win over the file.
+    """
+    global _loaded
+    if _loaded:
+        return
+    with _lock:
+        if not _loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _loaded = True
+
+
+# Example usage:
+# import os
+# from env import load_env
+#
+# load_env()
+# api_key = os.getenv('OPENAI_API_KEY')
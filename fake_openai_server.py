@@ -0,0 +1,209 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Any, List, Optional
+
+
+def default_answer(body: Dict[str, Any]) -> str:
+    """First listed option for multiple choice prompts, a short sentence otherwise"""
+    response_format = body.get('response_format') or {}
+    if response_format.get('type') == 'json_schema':
+        properties = response_format['json_schema']['schema']['properties']
+        return json.dumps({key: prop['enum'][0] if 'enum' in prop else 'No strong opinion.' for key, prop in properties.items()})
+    prompt = body['messages'][-1]['content']
+    for line in prompt.splitlines():
+        if line.startswith('Available options: '):
+            return line[len('Available options: '):].split(', ')[0]
+    return 'No strong opinion.'
+
+
+class FakeOpenAIServer:
+    """
+    A local stand-in for the OpenAI chat completions endpoint.
+
+    Serves /v1/chat/completions on 127.0.0.1 from a background thread with
+    configurable latency, rate limiting and errors, and reports x-ratelimit-*
+    headers like the real API. Point a client at .base_url.
+
+    Prompt caching is emulated for the system message: once a system message
+    has been seen, later requests starting with it report its tokens (in
+    128-token steps, from cache_min_tokens on) as cached.
+    """
+
+    def __init__(self, answer: Callable[[Dict[str, Any]], str] = default_answer, latency: float = 0.0, statuses: Optional[List[int]] = None, requests_per_minute: Optional[int] = None, error_rate: float = 0.0, retry_after: float = 0.05, seed: Optional[int] = None, cache_min_tokens: int = 1024, rate_limit_rate: float = 0.0, keep_requests: bool = True):
+        """
+        Args:
+            answer: Returns the message content for a request body
+            latency: Seconds each request takes before it is answered
+            statuses: HTTP statuses for the first len(statuses) requests, in order
+                (e.g. [429, 429] rate-limits the first two); later requests succeed
+            requests_per_minute: Answer 429 once this many requests arrived in the
+                current minute window (reported as x-ratelimit-limit-requests)
+            error_rate: Probability of answering a request with a 500
+            rate_limit_rate: Probability of answering a request with a 429
+            retry_after: Seconds sent in retry-after-ms with every 429
+            seed: Seed for the error_rate draws
+            cache_min_tokens: Shortest system message, in tokens, that is cached
+            keep_requests: Record every request body in .received (off for long
+                benchmark runs; .request_count is kept either way)
+        """
+        self.answer = answer
+        self.latency = latency
+        self.statuses = list(statuses or [])
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.cache_min_tokens = cache_min_tokens
+        self._cached_prefixes = set()
+        self.keep_requests = keep_requests
+        self.received: List[Dict[str, Any]] = []
+        self.request_count = 0
+        self.responses: List[int] = []
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are separate writes; without TCP_NODELAY each response stalls on delayed ACKs
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                status, headers, payload = fake._handle(self.path, body)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # The default listen backlog of 5 resets connections under concurrent load
+            request_queue_size = 1024
+
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='FakeOpenAIServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _rate_limit_headers(self) -> Dict[str, str]:
+        if self.requests_per_minute is None:
+            return {}
+        reset = max(60.0 - (time.monotonic() - self._window_start), 0.0)
+        return {
+            'x-ratelimit-limit-requests': str(self.requests_per_minute),
+            'x-ratelimit-remaining-requests': str(max(self.requests_per_minute - self._window_count, 0)),
+            'x-ratelimit-reset-requests': f"{reset:.3f}s"
+        }
+
+    def _next_status(self) -> int:
+        now = time.monotonic()
+        if now - self._window_start >= 60.0:
+            self._window_start, self._window_count = now, 0
+        if self.statuses:
+            return self.statuses.pop(0)
+        if self.requests_per_minute is not None and self._window_count >= self.requests_per_minute:
+            return 429
+        if self.rate_limit_rate and self.random.random() < self.rate_limit_rate:
+            return 429
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 500
+        return 200
+
+    def _handle(self, path: str, body: Dict[str, Any]):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.request_count += 1
+            request_id = self.request_count
+            if self.keep_requests:
+                self.received.append(body)
+            status = self._next_status()
+            if status == 200:
+                self._window_count += 1
+            headers = self._rate_limit_headers()
+            if self.keep_requests:
+                self.responses.append(status)
+
+        if not path.rstrip('/').endswith('/chat/completions'):
+            return 404, {}, {'error': {'message': f"Unknown path {path}", 'type': 'invalid_request_error', 'code': None}}
+        if status == 429:
+            headers['retry-after-ms'] = str(int(self.retry_after * 1000))
+            return 429, headers, {'error': {'message': 'Rate limit reached for requests', 'type': 'requests', 'code': 'rate_limit_exceeded'}}
+        if status != 200:
+            return status, headers, {'error': {'message': f"Simulated error {status}", 'type': 'server_error', 'code': None}}
+        if not body.get('messages'):
+            return 400, headers, {'error': {'message': "'messages' is a required property", 'type': 'invalid_request_error', 'code': None}}
+
+        content = self.answer(body)
+        prompt_tokens = sum(len(str(m.get('content', ''))) for m in body.get('messages', [])) // 4
+        completion_tokens = len(content) // 4 + 1
+        cached_tokens = self._cached_tokens(body['messages'][0])
+        return 200, headers, {
+            'id': f"chatcmpl-fake-{request_id}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+                'prompt_tokens_details': {'cached_tokens': cached_tokens}
+            }
+        }
+
+    def _cached_tokens(self, first_message: Dict[str, Any]) -> int:
+        if first_message.get('role') != 'system':
+            return 0
+        text = str(first_message.get('content', ''))
+        tokens = len(text) // 4
+        if tokens < self.cache_min_tokens:
+            return 0
+        with self._lock:
+            seen = text in self._cached_prefixes
+            self._cached_prefixes.add(text)
+        return tokens - tokens % 128 if seen else 0
+
+
+# Example usage:
+# import openai
+# from fake_openai_server import FakeOpenAIServer
+#
+# with FakeOpenAIServer(latency=0.2, statuses=[429]) as server:
+#     client = openai.OpenAI(api_key='test', base_url=server.base_url)
+#     ...
@@ -0,0 +1,149 @@
+import random
+import threading
+import time
+from collections import Counter
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+from supabase_handler import SupabaseHandler
+from token_usage import TokenUsage
+
+
+class FakeSupabaseHandler:
+    """
+    An in-process stand-in for SupabaseHandler's write path.
+
+    Implements the methods the pipeline writes through (bulk_insert_responses,
+    add_session_usage, add_run_usage, store_population) on in-memory tables,
+    building the same survey_responses rows as SupabaseHandler. Like the
+    database, an answer to a question the session already answered replaces
+    the stored one and is not counted again (when keep_rows is on). Every write
+    can be given a simulated round-trip latency and a failure rate, so the
+    writer and farm can be exercised and benchmarked without a database.
+    Safe to share between threads.
+    """
+
+    def __init__(self, write_latency: float = 0.0, row_latency: float = 0.0, failure_rate: float = 0.0, seed: Optional[int] = None, keep_rows: bool = True):
+        """
+        Args:
+            write_latency: Seconds each write call takes (one round trip)
+            row_latency: Additional seconds per response row written
+            failure_rate: Probability of a write failing (and returning False)
+            seed: Seed for the failure_rate draws
+            keep_rows: Keep the survey_responses rows (False only counts them)
+        """
+        self.write_latency = write_latency
+        self.row_latency = row_latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.keep_rows = keep_rows
+        # survey_responses rows in RESPONSE_COLUMNS order
+        self.responses: List[Tuple] = []
+        # (session_id, question_key) -> index into responses
+        self._response_index: Dict[Tuple[str, str], int] = {}
+        self.response_count = 0
+        # session_id -> survey_sessions columns
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        # run_id -> (model, TokenUsage)
+        self.runs: Dict[str, Tuple[str, TokenUsage]] = {}
+        # run_id -> (seed, size, config), session_id -> (run_id, persona_index, attributes JSON)
+        self.populations: Dict[str, Tuple[int, int, Dict[str, Any]]] = {}
+        self.personas: Dict[str, Tuple[str, int, str]] = {}
+        self.writes = 0
+        self.failed_writes = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write(self, rows: int = 0) -> bool:
+        """Waits out the simulated latency and decides whether the write fails"""
+        delay = self.write_latency + rows * self.row_latency
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.writes += 1
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                self.failed_writes += 1
+                return False
+        return True
+
+    def _session(self, session_id: str) -> Dict[str, Any]:
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = {'total_questions': 0, 'completed_questions': 0, 'status': 'in_progress', 'usage': TokenUsage()}
+        return session
+
+    def bulk_insert_responses(self, responses: List[Dict[str, Any]]) -> bool:
+        """Same contract as SupabaseHandler.bulk_insert_responses"""
+        if not responses:
+            return True
+        rows = [SupabaseHandler._response_row(response['session_id'], response['question'], response['answer']) for response in responses]
+        if not self._write(len(rows)):
+            return False
+        counts = Counter(row[0] for row in rows)
+        with self._lock:
+            for session_id, count in counts.items():
+                if session_id not in self.sessions:
+                    self._session(session_id)['total_questions'] = count
+            for row in rows:
+                if self.keep_rows:
+                    index = self._response_index.get(row[:2])
+                    if index is not None:
+                        self.responses[index] = row
+                        continue
+                    self._response_index[row[:2]] = len(self.responses)
+                    self.responses.append(row)
+                self.response_count += 1
+                self.sessions[row[0]]['completed_questions'] += 1
+        return True
+
+    def insert_multiple_responses(self, session_id: str, responses: List[Dict[str, Any]]) -> bool:
+        """Same contract as SupabaseHandler.insert_multiple_responses"""
+        return self.bulk_insert_responses([dict(response, session_id=session_id) for response in responses])
+
+    def add_session_usage(self, usage: Dict[str, TokenUsage]) -> bool:
+        """Same contract as SupabaseHandler.add_session_usage"""
+        if not usage:
+            return True
+        if not self._write():
+            return False
+        with self._lock:
+            for session_id, session_usage in usage.items():
+                self._session(session_id)['usage'].merge(session_usage)
+        return True
+
+    def add_run_usage(self, run_id: str, model: str, usage: TokenUsage) -> bool:
+        """Same contract as SupabaseHandler.add_run_usage"""
+        if not self._write():
+            return False
+        with self._lock:
+            _, total = self.runs.get(run_id, (model, TokenUsage()))
+            total.merge(usage)
+            self.runs[run_id] = (model, total)
+        return True
+
+    def store_population(self, run_id: str, population, session_ids: Sequence[str]) -> bool:
+        """Same contract as SupabaseHandler.store_population"""
+        rows = population.to_rows(session_ids)
+        if not self._write():
+            return False
+        with self._lock:
+            self.populations.setdefault(run_id, (population.seed, len(population), population.config))
+            for session_id, index, attributes in rows:
+                self.personas.setdefault(session_id, (run_id, index, attributes))
+        return True
+
+    def close(self):
+        pass
+
+
+# Example usage:
+# from fake_supabase_handler import FakeSupabaseHandler
+# from response_writer import ResponseWriter
+#
+# handler = FakeSupabaseHandler(write_latency=0.005)
+# with ResponseWriter(handler) as writer:
+#     answers = answer_questions(questions, writer=writer, session_id='s1')
+# print(handler.sessions['s1'])
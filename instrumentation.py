@@ -0,0 +1,318 @@
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Any, Iterator, List, Tuple
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Prefix of every exported metric name
+PREFIX = 'surveybot_'
+
+# Libraries that log every HTTP request at INFO; kept at WARNING unless DEBUG is asked for
+CHATTY_LOGGERS = ('httpx', 'httpcore', 'openai')
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Every metric the pipeline records: name -> (type, help text)
+METRICS: Dict[str, Tuple[str, str]] = {
+    'db_connection_acquire_seconds': ('histogram', "Time to check a healthy connection out of the pool"),
+    'db_query_seconds': ('histogram', "Duration of database operations, by operation"),
+    'db_rows_written_total': ('counter', "Rows written, by table"),
+    'db_errors_total': ('counter', "Failed database operations, by operation"),
+    'llm_attempt_seconds': ('histogram', "Latency of chat completion attempts, by status"),
+    'llm_requests_total': ('counter', "Scheduled chat completion requests, by final status"),
+    'llm_retries_total': ('counter', "Retried attempts, by the status that caused the retry"),
+    'llm_tokens_total': ('counter', "Tokens used, by how they are billed: input (uncached prompt), cached_input and output"),
+    'llm_cost_usd_total': ('counter', "Cost of the chat completions in USD"),
+    'answer_validations_total': ('counter', "Validated answers, by match method and outcome"),
+    'answer_fallbacks_total': ('counter', "Questions given the fallback answer after a failed call, by status"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value).lower() if isinstance(value, bool) else str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _series(name: str, labels: Labels, extra: Labels = ()) -> str:
+    """Prometheus series name such as db_query_seconds_sum{operation="bulk_insert"}"""
+    pairs = labels + extra
+    if not pairs:
+        return name
+    escaped = ",".join(f'{label}="{_escape(value)}"' for label, value in pairs)
+    return f"{name}{{{escaped}}}"
+
+
+class Metrics:
+    """
+    Thread-safe counters and latency histograms for one process.
+
+    Metrics are identified by name (see METRICS) and labels. The registry
+    can be rendered in the Prometheus text format, written to a file (for
+    node_exporter's textfile collector, or as JSON), served over HTTP, and
+    snapshotted so worker processes can hand their numbers to the parent.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        # (name, labels) -> [count per bucket (last is +Inf), sum, count]
+        self._histograms: Dict[Tuple[str, Labels], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        """Add amount to a counter"""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Record one duration in a histogram"""
+        key = (name, _labels(labels))
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bucket] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[Dict[str, Any]]:
+        """
+        Time a with block into a histogram
+
+        Yields the labels dictionary, so the block can add labels known only at
+        the end (e.g. labels['status'] = 'error').
+        """
+        started = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def value(self, name: str, **labels) -> float:
+        """Current value of a counter, or the observation count of a histogram"""
+        key = (name, _labels(labels))
+        with self._lock:
+            if key in self._histograms:
+                return self._histograms[key][2]
+            return self._counters.get(key, 0.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-serializable copy of every metric"""
+        with self._lock:
+            return {
+                'counters': [[name, list(map(list, labels)), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(map(list, labels)), list(h[0]), h[1], h[2]] for (name, labels), h in self._histograms.items()]
+            }
+
+    def merge(self, snapshot: Dict[str, Any]):
+        """Add a snapshot (e.g. from a worker process) to this registry"""
+        with self._lock:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                self._counters[key] = self._counters.get(key, 0.0) + value
+            for name, labels, counts, total, count in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                histogram[1] += total
+                histogram[2] += count
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self._histograms.items())
+        lines = []
+        described = set()
+
+        def describe(name: str, kind: str):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {PREFIX}{name} {METRICS.get(name, (kind, name))[1]}")
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name, 'counter')
+            lines.append(f"{_series(PREFIX + name, labels)} {float(value)!r}")
+        for (name, labels), (counts, total, count) in histograms:
+            describe(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                lines.append(f"{_series(PREFIX + name + '_bucket', labels, (('le', le),))} {cumulative}")
+            lines.append(f"{_series(PREFIX + name + '_sum', labels)} {total:.6f}")
+            lines.append(f"{_series(PREFIX + name + '_count', labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Atomically write the metrics to path: JSON for *.json, Prometheus text otherwise"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            if path.endswith('.json'):
+                json.dump(self.snapshot(), f)
+            else:
+                f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port: int = 9464, host: str = '127.0.0.1') -> "ThreadingHTTPServer":
+        """Serve GET /metrics in the Prometheus text format from a daemon thread; shut down the returned server to stop"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                data = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        return server
+
+
+# The process-wide registry every module records into
+metrics = Metrics()
+
+
+# Attributes every LogRecord has; everything else was passed through extra=
+_STANDARD_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime', 'sample'}
+
+
+def log_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    """The structured fields a record was logged with (extra=...)"""
+    return {key: value for key, value in record.__dict__.items() if key not in _STANDARD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the time, level, logger, message and the record's fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update(log_fields(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines: time, level, logger and message, followed by the record's fields as key=value"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = log_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one in every round(1 / rate) high-volume records.
+
+    Only records logged with extra={'sample': True} are sampled, per logger
+    and message template; everything else passes.
+    """
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._seen: Dict[Tuple[str, Any], int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'sample', False):
+            return True
+        if self.every == 0:
+            return False
+        key = (record.name, record.msg)
+        with self._lock:
+            seen = self._seen.get(key, 0)
+            self._seen[key] = seen + 1
+        if seen % self.every:
+            return False
+        if self.every > 1:
+            record.sampled_1_in = self.every
+        return True
+
+
+def configure_logging(level: str = 'INFO', json_format: bool = True, sample_rate: float = 1.0, stream=None) -> logging.Handler:
+    """
+    Route the pipeline's logs to stream (stderr by default)
+
+    Without this call only warnings and errors are shown, through Python's
+    default handler.
+
+    Args:
+        level: Lowest level to show ('DEBUG', 'INFO', 'WARNING', ...)
+        json_format: One JSON object per line instead of plain text
+        sample_rate: Share of high-volume records (per-batch successes) to keep
+        stream: Stream to write to
+
+    Returns:
+        logging.Handler: The installed handler
+    """
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if json_format else TextFormatter())
+    handler.addFilter(SamplingFilter(sample_rate))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if getattr(existing, '_surveybot', False):
+            root.removeHandler(existing)
+    handler._surveybot = True
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    for name in CHATTY_LOGGERS:
+        logging.getLogger(name).setLevel(logging.NOTSET if root.level <= logging.DEBUG else logging.WARNING)
+    return handler
+
+
+# Example usage:
+# from instrumentation import configure_logging, metrics
+#
+# configure_logging('INFO', sample_rate=0.01)   # JSON lines on stderr, 1% of per-batch successes
+# server = metrics.serve(9464)                   # scrape http://127.0.0.1:9464/metrics
+# ... run a survey ...
+# metrics.write('/var/lib/node_exporter/textfile/surveybot.prom')
+# print(metrics.value('llm_requests_total', status='ok'))
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+# "use" returns cached answers when present, "refresh" always calls the API
+# and overwrites the cache, "bypass" neither reads nor writes it.
+CACHE_MODES = ('use', 'refresh', 'bypass')
+
+
+class LLMCache:
+    """
+    Two-tier cache of raw LLM answers keyed by model, messages, temperature and max_tokens.
+
+    Lookups go to an in-memory LRU first and then to an optional SQLite file,
+    so reruns of an unchanged questionnaire can skip the API entirely.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_memory_entries: int = 1024, max_disk_entries: int = 100_000, ttl: Optional[float] = 7 * 24 * 3600):
+        """
+        Args:
+            path: SQLite file for the persistent tier (None keeps the cache in memory only)
+            max_memory_entries: Size of the in-memory LRU tier
+            max_disk_entries: Entries kept on disk before the least recently used are evicted
+            ttl: Seconds an entry stays valid (None never expires)
+        """
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._disk_count = 0
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+            self._db.commit()
+            self._disk_count = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def make_key(request: Dict[str, Any]) -> str:
+        """Hash the parts of a chat completion request that determine its answer"""
+        relevant = {
+            'model': request.get('model'),
+            'messages': request.get('messages'),
+            'temperature': request.get('temperature'),
+            'max_tokens': request.get('max_tokens'),
+            'response_format': request.get('response_format'),
+        }
+        encoded = json.dumps(relevant, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def _remember(self, key: str, answer: str, created_at: float):
+        """Insert into the memory tier, evicting the least recently used entry if full"""
+        self._memory[key] = (answer, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached answer for a key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT answer, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    if not self._expired(row[1], now):
+                        self._db.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._remember(key, row[0], row[1])
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return row[0]
+                    self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._db.commit()
+                    self._disk_count -= 1
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, answer: str):
+        """Store an answer in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, answer, now)
+            if self._db is None:
+                return
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO llm_cache (key, answer, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, answer, now, now)
+            )
+            if cursor.rowcount:
+                self._disk_count += 1
+            else:
+                self._db.execute(
+                    "UPDATE llm_cache SET answer = ?, created_at = ?, last_access = ? WHERE key = ?",
+                    (answer, now, now, key)
+                )
+            if self._disk_count > self.max_disk_entries:
+                self._evict_disk()
+            self._db.commit()
+
+    def _evict_disk(self):
+        """Drop expired entries, then least recently used ones down to 90% of the size bound"""
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        self._disk_count = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        excess = self._disk_count - int(self.max_disk_entries * 0.9)
+        if excess > 0:
+            self._db.execute("""
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY last_access LIMIT ?
+                )
+            """, (excess,))
+            self._disk_count -= excess
+
+    def lookup(self, request: Dict[str, Any], mode: str = 'use') -> Optional[str]:
+        """Return the cached answer for a chat completion request if the mode allows reading"""
+        if mode not in CACHE_MODES:
+            raise ValueError(f"cache mode must be one of {CACHE_MODES}, got {mode!r}")
+        if mode == 'use':
+            return self.get(self.make_key(request))
+        if mode == 'refresh':
+            with self._lock:
+                self.refreshes += 1
+        return None
+
+    def store(self, request: Dict[str, Any], answer: str, mode: str = 'use'):
+        """Cache the answer to a chat completion request unless the mode is 'bypass'"""
+        if mode not in CACHE_MODES:
+            raise ValueError(f"cache mode must be one of {CACHE_MODES}, got {mode!r}")
+        if mode != 'bypass':
+            self.set(self.make_key(request), answer)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters plus the current size of each tier"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'memory_entries': len(self._memory),
+                'disk_entries': self._disk_count,
+            }
+
+    def clear(self):
+        """Remove every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+                self._disk_count = 0
+
+    def close(self):
+        """Close the SQLite tier"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# Example usage:
+# from llm_cache import LLMCache
+# from llm_question_handler import ask_question_with_llm
+#
+# cache = LLMCache('llm_cache.sqlite3')
+# answer = ask_question_with_llm(questions[0], cache=cache)                        # calls the API
+# answer = ask_question_with_llm(questions[0], cache=cache)                        # served from cache
+# answer = ask_question_with_llm(questions[0], cache=cache, cache_mode='refresh')  # calls again, overwrites
+# print(cache.stats())
@@ -1,98 +1,420 @@
-import openai
-import os
-from typing import Dict, Any, Optional
-from dotenv import load_dotenv
+import asyncio
+import json
+import logging
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
+from openai_clients import get_openai_client, get_async_openai_client
+from instrumentation import metrics
+from llm_cache import LLMCache
+from rate_limiter import LLMResult, LLMScheduler, get_scheduler
+from option_matcher import CONSTRAINED_TYPES, OptionMatch, format_option, matcher_for
+from token_usage import TokenUsage
 
-# Load environment variables from .env file
-load_dotenv()
+# openai (with pydantic and httpx) is only imported once a client is created
+if TYPE_CHECKING:
+    import openai
+
+logger = logging.getLogger(__name__)
+
+# Prompt layout: everything that stays the same across a respondent's questions
+# (persona, survey context, answering instructions) goes into the system message,
+# so consecutive requests share a prefix the provider can cache; only the
+# question-specific text follows, with the question itself last.
+
+SYSTEM_PROMPT = "You are a helpful survey respondent who provides honest and thoughtful answers."
+
+RESPONDENT_INSTRUCTIONS = """You will be asked survey questions one at a time.
+
+When a question lists available options, respond with ONLY one of the available options. Do not include any additional text, explanations, or formatting. Just provide the exact text of your chosen option.
+
+When a question lists no options, provide a clear response to the question. Be concise but thorough in your answer."""
+
+def compose_system_prompt(system_prompt: str = SYSTEM_PROMPT) -> str:
+    """
+    Builds the stable system message: the persona (and any survey context
+    the caller appended to it), then the answering instructions
+    """
+    return f"{system_prompt.strip()}\n\n{RESPONDENT_INSTRUCTIONS}" if system_prompt else RESPONDENT_INSTRUCTIONS
 
 def create_prompt(question_label: str, options_text: Optional[str] = None) -> str:
-    """Creates the appropriate prompt based on whether options are provided"""
+    """Creates the question-specific user message, ending with the question text"""
     if options_text:
-        return f"""You are a helpful survey respondent. Please answer the following question.
+        return f"""Available options: {options_text}
+
+Question: {question_label}"""
+    else:
+        return f"""Question: {question_label}"""
+
+def _prepare_request(question_obj: Dict[str, Any], model: str, system_prompt: str = SYSTEM_PROMPT, prompt: Optional[str] = None) -> Tuple[Dict[str, Any], List[Any], bool]:
+    """
+    Builds the chat completion arguments for a question object.
+    
+    The system message comes from compose_system_prompt(system_prompt), so it
+    is identical for every question of a respondent. A prebuilt prompt (e.g.
+    from a QuestionPlan) skips formatting the options and prompt text again.
+    
+    Returns:
+        tuple: (request keyword arguments, options list, whether the question is multiple choice)
+    """
+    # Extract question information
+    question_type = question_obj.get('type', '')
+    question_label = question_obj.get('label', '')
+    options = question_obj.get('options', [])
+    
+    # Determine if this is a multiple choice (or slider) question
+    has_options = bool(options) and question_type in CONSTRAINED_TYPES
+    
+    # Create the prompt following HHH guidelines
+    if prompt is None:
+        options_text = ", ".join(format_option(option) for option in options) if has_options else None
+        prompt = create_prompt(question_label, options_text)
+    
+    request = {
+        'model': model,
+        'messages': [
+            {"role": "system", "content": compose_system_prompt(system_prompt)},
+            {"role": "user", "content": prompt}
+        ],
+        'max_tokens': 150 if has_options else 300,
+        'temperature': 0.7
+    }
+    return request, options, has_options
 
-Question: {question_label}
+def _validate_answer(question_obj: Dict[str, Any], answer: Any) -> OptionMatch:
+    """Maps a raw LLM answer onto one of the question's options (see option_matcher)"""
+    match = matcher_for(question_obj).match(answer)
+    metrics.inc('answer_validations_total', method=match.method, valid=match.valid)
+    return match
 
-Available options: {options_text}
+def _invalid_answer_error(question_obj: Dict[str, Any], answer: Any, match: OptionMatch) -> str:
+    if match.value is None:
+        return f"Answer {answer!r} to '{question_obj.get('key')}' matches none of the options"
+    return f"Answer {answer!r} to '{question_obj.get('key')}' matches none of the options (closest: {match.value!r}, confidence {match.confidence:.2f})"
 
-Please respond with ONLY one of the available options listed above. Do not include any additional text, explanations, or formatting. Just provide the exact text of your chosen option."""
+def _fallback_answer(options: List[Any], has_options: bool) -> str:
+    """Answer recorded when the API call fails"""
+    if has_options:
+        return options[0] if options else "Error occurred"
     else:
-        return f"""You are a helpful survey respondent. Please answer the following question.
+        return "Error occurred while processing the question"
+
+def _answered_result(result: LLMResult, request: Dict[str, Any], question_obj: Dict[str, Any], cache: Optional[LLMCache], cache_mode: str) -> LLMResult:
+    """Validates a successful completion and stores it in the cache"""
+    if not result.ok:
+        return result
+    if result.content is None:
+        return LLMResult('error', attempts=result.attempts, error="Response contained no message content")
+    content = result.content.strip()
+    match = _validate_answer(question_obj, content)
+    if not match.valid:
+        # Reported instead of replaced with a fallback option, and kept out of the cache
+        return LLMResult('invalid_answer', content, result.attempts, _invalid_answer_error(question_obj, content, match), usage=result.usage)
+    if cache is not None:
+        cache.store(request, content, cache_mode)
+    return result._replace(content=content, answer=match.value)
+
+def _cached_result(request: Dict[str, Any], question_obj: Dict[str, Any], cache: Optional[LLMCache], cache_mode: str) -> Optional[LLMResult]:
+    answer = cache.lookup(request, cache_mode) if cache is not None else None
+    if answer is None:
+        return None
+    match = _validate_answer(question_obj, answer)
+    if not match.valid:
+        return None
+    return LLMResult('ok', answer, attempts=0, answer=match.value)
+
+def ask_question_result(question_obj: Dict[str, Any], api_key: Optional[str] = None, model: str = "gpt-4o-mini", base_url: Optional[str] = None, client: Optional["openai.OpenAI"] = None, cache: Optional[LLMCache] = None, cache_mode: str = 'use', prompt: Optional[str] = None, scheduler: Optional[LLMScheduler] = None, system_prompt: str = SYSTEM_PROMPT) -> LLMResult:
+    """
+    Answers a question through the rate-limited scheduler, reporting failures as a typed result.
+    
+    Rate limits, timeouts and server errors are retried with backoff; if the
+    call still fails, the returned LLMResult carries the failure status and
+    error instead of a placeholder answer. Answers are mapped onto the
+    question's options by its OptionMatcher; one that matches none of them
+    comes back with status 'invalid_answer'.
+    
+    Args:
+        question_obj: Dictionary containing question information (key, type, label, options)
+        api_key: OpenAI API key (if None, will try to get from OPENAI_API_KEY environment variable)
+        model: OpenAI model to use (default: gpt-4o-mini)
+        base_url: Optional API base URL for OpenAI-compatible endpoints
+        client: Optional OpenAI client to use instead of the shared one from openai_clients
+        cache: Optional LLMCache consulted before calling the API
+        cache_mode: 'use' (read and write the cache), 'refresh' (call the API and overwrite) or 'bypass'
+        prompt: Optional prebuilt prompt text, e.g. QuestionPlan.prompts[i]
+        scheduler: Optional LLMScheduler (defaults to the shared one for the client)
+        system_prompt: System message, e.g. a persona description
+    
+    Returns:
+        LLMResult: status 'ok' with the validated answer in .answer, or the failure
+    """
+    if scheduler is None:
+        # Reuse the process-wide client (and its connection pool) for this key
+        if client is None:
+            client = get_openai_client(api_key, base_url)
+        scheduler = get_scheduler(client)
+    
+    request, _, _ = _prepare_request(question_obj, model, system_prompt, prompt)
+    cached = _cached_result(request, question_obj, cache, cache_mode)
+    if cached is not None:
+        return cached
+    return _answered_result(scheduler.complete(request), request, question_obj, cache, cache_mode)
 
-Question: {question_label}
+async def ask_question_result_async(question_obj: Dict[str, Any], api_key: Optional[str] = None, model: str = "gpt-4o-mini", base_url: Optional[str] = None, client: Optional["openai.AsyncOpenAI"] = None, cache: Optional[LLMCache] = None, cache_mode: str = 'use', prompt: Optional[str] = None, scheduler: Optional[LLMScheduler] = None, system_prompt: str = SYSTEM_PROMPT) -> LLMResult:
+    """
+    Async variant of ask_question_result built on openai.AsyncOpenAI.
+    """
+    if scheduler is None:
+        if client is None:
+            client = get_async_openai_client(api_key, base_url)
+        scheduler = get_scheduler(client)
+    
+    request, _, _ = _prepare_request(question_obj, model, system_prompt, prompt)
+    cached = _cached_result(request, question_obj, cache, cache_mode)
+    if cached is not None:
+        return cached
+    return _answered_result(await scheduler.complete_async(request), request, question_obj, cache, cache_mode)
 
-Please provide a clear response to this question. Be concise but thorough in your answer."""
+def _answer_or_fallback(question_obj: Dict[str, Any], result: LLMResult) -> str:
+    if result.ok:
+        return result.answer
+    metrics.inc('answer_fallbacks_total', status=result.status)
+    logger.warning("Question answered with the fallback answer", extra={'question_key': question_obj.get('key'), 'status': result.status, 'attempts': result.attempts, 'error': result.error})
+    options = question_obj.get('options', [])
+    return _fallback_answer(options, bool(options) and question_obj.get('type', '') in CONSTRAINED_TYPES)
 
-def ask_question_with_llm(question_obj: Dict[str, Any], api_key: Optional[str] = None, model: str = "gpt-4o-mini") -> str:
+def ask_question_with_llm(question_obj: Dict[str, Any], api_key: Optional[str] = None, model: str = "gpt-4o-mini", base_url: Optional[str] = None, client: Optional["openai.OpenAI"] = None, cache: Optional[LLMCache] = None, cache_mode: str = 'use', prompt: Optional[str] = None, scheduler: Optional[LLMScheduler] = None, system_prompt: str = SYSTEM_PROMPT) -> str:
     """
     Takes a question object and makes an OpenAI call to get an answer.
     
+    Calls go through the rate-limited scheduler (see ask_question_result);
+    only when every retry failed, or the answer matched none of the options,
+    is the old placeholder answer returned.
+    
     Args:
         question_obj: Dictionary containing question information (key, type, label, options)
         api_key: OpenAI API key (if None, will try to get from OPENAI_API_KEY environment variable)
         model: OpenAI model to use (default: gpt-4o-mini)
+        base_url: Optional API base URL for OpenAI-compatible endpoints
+        client: Optional OpenAI client to use instead of the shared one from openai_clients
+        cache: Optional LLMCache consulted before calling the API
+        cache_mode: 'use' (read and write the cache), 'refresh' (call the API and overwrite) or 'bypass'
+        prompt: Optional prebuilt prompt text, e.g. QuestionPlan.prompts[i]
+        scheduler: Optional LLMScheduler (defaults to the shared one for the client)
+        system_prompt: Persona description, e.g. PersonaPopulation.personas()[i]['system_prompt']
     
     Returns:
         str: The answer from the LLM
     """
-    # Get API key from parameter or environment variable
-    if api_key is None:
-        api_key = os.getenv('OPENAI_API_KEY')
-        if api_key is None:
-            raise ValueError("OpenAI API key not provided and OPENAI_API_KEY environment variable not set")
+    result = ask_question_result(question_obj, api_key, model, base_url, client, cache, cache_mode, prompt, scheduler, system_prompt)
+    return _answer_or_fallback(question_obj, result)
+
+async def ask_question_with_llm_async(question_obj: Dict[str, Any], api_key: Optional[str] = None, model: str = "gpt-4o-mini", base_url: Optional[str] = None, client: Optional["openai.AsyncOpenAI"] = None, cache: Optional[LLMCache] = None, cache_mode: str = 'use', prompt: Optional[str] = None, scheduler: Optional[LLMScheduler] = None, system_prompt: str = SYSTEM_PROMPT) -> str:
+    """
+    Async variant of ask_question_with_llm built on openai.AsyncOpenAI.
+    """
+    result = await ask_question_result_async(question_obj, api_key, model, base_url, client, cache, cache_mode, prompt, scheduler, system_prompt)
+    return _answer_or_fallback(question_obj, result)
 
-    # Set up OpenAI client
-    client = openai.OpenAI(api_key=api_key)
+
+def build_survey_schema(questions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Builds a strict JSON schema with one property per question key.
     
-    # Extract question information
-    question_type = question_obj.get('type', '')
-    question_label = question_obj.get('label', '')
-    options = question_obj.get('options', [])
+    Option-based questions are restricted to an enum of their options;
+    everything else is a free-text string.
+    """
+    properties = {}
+    for question in questions:
+        options = question.get('options') or []
+        prop = {'description': str(question.get('label', ''))}
+        if options and question.get('type') in CONSTRAINED_TYPES:
+            enum = list(dict.fromkeys(options))
+            numeric = all(isinstance(o, (int, float)) and not isinstance(o, bool) for o in enum)
+            prop['type'] = 'number' if numeric else 'string'
+            prop['enum'] = enum if numeric else [str(o) for o in enum]
+        else:
+            prop['type'] = 'string'
+        properties[question['key']] = prop
+    return {
+        'type': 'object',
+        'properties': properties,
+        'required': list(properties),
+        'additionalProperties': False
+    }
+
+def _prepare_survey_request(questions: List[Dict[str, Any]], model: str, system_prompt: str = SYSTEM_PROMPT) -> Dict[str, Any]:
+    """Builds one chat completion request that asks every question at once"""
+    lines = []
+    max_tokens = 0
+    for key, question in {q['key']: q for q in questions}.items():
+        options = question.get('options') or []
+        lines.append(f"{key}: {question.get('label', '')}")
+        if options and question.get('type') in CONSTRAINED_TYPES:
+            lines.append(f"Available options: {', '.join(format_option(o) for o in options)}")
+            max_tokens += 20
+        else:
+            max_tokens += 300
+        lines.append("")
     
-    # Determine if this is a multiple choice question
-    has_options = bool(options) and question_type in ['mc', 'matrix']
+    # Instructions first and the questions last, as in create_prompt
+    prompt = f"""Please answer every question in the following survey at once. Respond with a JSON object that maps each question key to your answer. For questions with available options, answer with exactly one of the options listed.
+
+{chr(10).join(lines).rstrip()}"""
     
-    # Create the prompt following HHH guidelines
-    if has_options:
-        # For multiple choice questions
-        options_text = ", ".join(options)
-        
+    return {
+        'model': model,
+        'messages': [
+            {"role": "system", "content": compose_system_prompt(system_prompt)},
+            {"role": "user", "content": prompt}
+        ],
+        'max_tokens': max_tokens,
+        'temperature': 0.7,
+        'response_format': {
+            'type': 'json_schema',
+            'json_schema': {
+                'name': 'survey_answers',
+                'strict': True,
+                'schema': build_survey_schema(questions)
+            }
+        }
+    }
+
+def _match_survey_answer(question_obj: Dict[str, Any], answer: Any) -> Tuple[bool, Any]:
+    """Checks one structured answer, returning (valid, normalized answer)"""
+    match = _validate_answer(question_obj, answer)
+    return match.valid, match.value
+
+def _collect_survey_answers(questions: List[Dict[str, Any]], content: Optional[str]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Validates a structured survey response.
     
+    Returns:
+        tuple: (valid answers by question key, questions that need a per-question retry)
+    """
     try:
-        # Make the API call
-        prompt = create_prompt(question_label, options_text if has_options else None)
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful survey respondent who provides honest and thoughtful answers."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=150 if has_options else 300,
-            temperature=0.7
-        )
-        
-        # Extract the answer
-        answer = response.choices[0].message.content.strip()
-        
-        # For multiple choice questions, validate that the answer is one of the options
-        if has_options and answer not in options:
-            # If the answer doesn't match exactly, try to find the closest match
-            answer_lower = answer.lower()
-            for option in options:
-                if option.lower() == answer_lower:
-                    return option
-            # If no match found, return the first option as fallback
-            return options[0]
-        
-        return answer
-        
-    except Exception as e:
-        print(f"Error making OpenAI API call: {e}")
-        if has_options:
-            return options[0] if options else "Error occurred"
+        parsed = json.loads(content) if content else {}
+    except json.JSONDecodeError:
+        parsed = {}
+    if not isinstance(parsed, dict):
+        parsed = {}
+    
+    answers = {}
+    failed = []
+    for question in {q['key']: q for q in questions}.values():
+        valid, answer = _match_survey_answer(question, parsed.get(question['key']))
+        if valid:
+            answers[question['key']] = answer
+        else:
+            failed.append(question)
+    return answers, failed
+
+def _survey_results(questions: List[Dict[str, Any]], request: Dict[str, Any], content: Optional[str], attempts: int, cache: Optional[LLMCache], cache_mode: str) -> Tuple[Dict[str, LLMResult], List[Dict[str, Any]]]:
+    """
+    Splits a structured survey response into per-key results and questions to re-ask.
+    
+    The per-key results carry no usage: the survey call is billed once, to the
+    caller's TokenUsage, even when none of its answers are valid.
+    """
+    answers, failed = _collect_survey_answers(questions, content)
+    if cache is not None and content is not None and not failed:
+        cache.store(request, content, cache_mode)
+    if failed:
+        logger.info("Retrying survey questions individually", extra={'failed': len(failed), 'questions': len(answers) + len(failed)})
+    return {key: LLMResult('ok', content, attempts, answer=answer) for key, answer in answers.items()}, failed
+
+def ask_survey_results(questions: List[Dict[str, Any]], api_key: Optional[str] = None, model: str = "gpt-4o-mini", base_url: Optional[str] = None, client: Optional["openai.OpenAI"] = None, cache: Optional[LLMCache] = None, cache_mode: str = 'use', scheduler: Optional[LLMScheduler] = None, system_prompt: str = SYSTEM_PROMPT, usage: Optional[TokenUsage] = None) -> Dict[str, LLMResult]:
+    """
+    Answers a whole questionnaire with a single structured-output OpenAI call.
+    
+    The response format is a JSON schema with one property per question key,
+    restricting option-based questions to their options. Keys that are missing
+    or fail validation are re-asked one at a time with ask_question_result.
+    
+    Args:
+        questions: Question objects as returned by convert_yaml_to_json_objects
+        api_key: OpenAI API key (if None, will try to get from OPENAI_API_KEY environment variable)
+        model: OpenAI model to use (default: gpt-4o-mini); must support json_schema response formats
+        base_url: Optional API base URL for OpenAI-compatible endpoints
+        client: Optional OpenAI client to use instead of the shared one from openai_clients
+        cache: Optional LLMCache consulted before calling the API
+        cache_mode: 'use' (read and write the cache), 'refresh' (call the API and overwrite) or 'bypass'
+        scheduler: Optional LLMScheduler (defaults to the shared one for the client)
+        system_prompt: System message, e.g. a persona description
+        usage: Optional TokenUsage the survey call's tokens and cost are added to;
+            results of per-question retries carry their own usage instead
+    
+    Returns:
+        Dictionary mapping each question key to its LLMResult
+    """
+    if scheduler is None:
+        if client is None:
+            client = get_openai_client(api_key, base_url)
+        scheduler = get_scheduler(client)
+    
+    request = _prepare_survey_request(questions, model, system_prompt)
+    content = cache.lookup(request, cache_mode) if cache is not None else None
+    attempts = 0
+    if content is None:
+        result = scheduler.complete(request)
+        attempts = result.attempts
+        if usage is not None:
+            usage.add(result.usage)
+        if result.ok:
+            content = result.content
+        else:
+            logger.warning("Survey request failed", extra={'status': result.status, 'attempts': result.attempts, 'error': result.error})
+    
+    results, failed = _survey_results(questions, request, content, attempts, cache, cache_mode)
+    for question in failed:
+        results[question['key']] = ask_question_result(question, model=model, cache=cache, cache_mode=cache_mode, scheduler=scheduler, system_prompt=system_prompt)
+    return results
+
+async def ask_survey_results_async(questions: List[Dict[str, Any]], api_key: Optional[str] = None, model: str = "gpt-4o-mini", base_url: Optional[str] = None, client: Optional["openai.AsyncOpenAI"] = None, cache: Optional[LLMCache] = None, cache_mode: str = 'use', scheduler: Optional[LLMScheduler] = None, system_prompt: str = SYSTEM_PROMPT, usage: Optional[TokenUsage] = None) -> Dict[str, LLMResult]:
+    """
+    Async variant of ask_survey_results; per-question retries run concurrently.
+    """
+    if scheduler is None:
+        if client is None:
+            client = get_async_openai_client(api_key, base_url)
+        scheduler = get_scheduler(client)
+    
+    request = _prepare_survey_request(questions, model, system_prompt)
+    content = cache.lookup(request, cache_mode) if cache is not None else None
+    attempts = 0
+    if content is None:
+        result = await scheduler.complete_async(request)
+        attempts = result.attempts
+        if usage is not None:
+            usage.add(result.usage)
+        if result.ok:
+            content = result.content
         else:
-            return "Error occurred while processing the question"
+            logger.warning("Survey request failed", extra={'status': result.status, 'attempts': result.attempts, 'error': result.error})
+    
+    results, failed = _survey_results(questions, request, content, attempts, cache, cache_mode)
+    retried = await asyncio.gather(*(
+        ask_question_result_async(question, model=model, cache=cache, cache_mode=cache_mode, scheduler=scheduler, system_prompt=system_prompt)
+        for question in failed
+    ))
+    results.update(zip((question['key'] for question in failed), retried))
+    return results
+
+def ask_survey_with_llm(questions: List[Dict[str, Any]], api_key: Optional[str] = None, model: str = "gpt-4o-mini", base_url: Optional[str] = None, client: Optional["openai.OpenAI"] = None, cache: Optional[LLMCache] = None, cache_mode: str = 'use', scheduler: Optional[LLMScheduler] = None, system_prompt: str = SYSTEM_PROMPT) -> List[Dict[str, Any]]:
+    """
+    Answers a whole questionnaire with one structured-output call (see ask_survey_results).
+    
+    Returns:
+        List of dictionaries with 'key' and 'answer', in the same order as questions;
+        questions that still failed after retries get the placeholder answer
+    """
+    results = ask_survey_results(questions, api_key, model, base_url, client, cache, cache_mode, scheduler, system_prompt)
+    return [{'key': question['key'], 'answer': _answer_or_fallback(question, results[question['key']])} for question in questions]
 
+async def ask_survey_with_llm_async(questions: List[Dict[str, Any]], api_key: Optional[str] = None, model: str = "gpt-4o-mini", base_url: Optional[str] = None, client: Optional["openai.AsyncOpenAI"] = None, cache: Optional[LLMCache] = None, cache_mode: str = 'use', scheduler: Optional[LLMScheduler] = None, system_prompt: str = SYSTEM_PROMPT) -> List[Dict[str, Any]]:
+    """
+    Async variant of ask_survey_with_llm.
+    """
+    results = await ask_survey_results_async(questions, api_key, model, base_url, client, cache, cache_mode, scheduler, system_prompt)
+    return [{'key': question['key'], 'answer': _answer_or_fallback(question, results[question['key']])} for question in questions]
 
 # Example usage:
 # from convert_to_json import convert_yaml_to_json_objects
@@ -0,0 +1,100 @@
+import asyncio
+import atexit
+import os
+import threading
+import weakref
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from env import load_env
+
+if TYPE_CHECKING:
+    import openai
+
+# Process-wide client registry. Each OpenAI client owns an httpx connection
+# pool, so reusing one client per (api_key, base_url) keeps TLS connections
+# alive across calls instead of handshaking for every question.
+_clients: "Dict[Tuple[str, Optional[str]], openai.OpenAI]" = {}
+# Async clients are bound to the event loop their connections were opened on,
+# so they are additionally keyed by loop and dropped when the loop goes away.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, Optional[str]], openai.AsyncOpenAI]]" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _client_key(api_key: Optional[str], base_url: Optional[str]) -> Tuple[str, Optional[str]]:
+    """Resolves the API key and base URL that identify a pooled client"""
+    load_env()
+    if api_key is None:
+        api_key = os.getenv('OPENAI_API_KEY')
+        if api_key is None:
+            raise ValueError("OpenAI API key not provided and OPENAI_API_KEY environment variable not set")
+    if base_url is None:
+        base_url = os.getenv('OPENAI_BASE_URL')
+    return api_key, base_url
+
+
+def get_openai_client(api_key: Optional[str] = None, base_url: Optional[str] = None) -> "openai.OpenAI":
+    """
+    Returns the shared OpenAI client for an API key and base URL, creating it on first use
+
+    Args:
+        api_key: OpenAI API key (if None, will try to get from OPENAI_API_KEY environment variable)
+        base_url: Optional API base URL (if None, uses OPENAI_BASE_URL or the OpenAI default)
+
+    Returns:
+        openai.OpenAI: A client that lives until close_openai_clients() is called
+    """
+    key = _client_key(api_key, base_url)
+    with _lock:
+        client = _clients.get(key)
+        if client is None or client.is_closed():
+            import openai
+            client = openai.OpenAI(api_key=key[0], base_url=key[1])
+            _clients[key] = client
+        return client
+
+
+def get_async_openai_client(api_key: Optional[str] = None, base_url: Optional[str] = None) -> "openai.AsyncOpenAI":
+    """
+    Returns the shared AsyncOpenAI client for an API key and base URL on the running event loop
+
+    Must be called from inside a running event loop. Clients are cached per
+    loop because async connection pools cannot be shared between loops.
+    """
+    key = _client_key(api_key, base_url)
+    loop = asyncio.get_running_loop()
+    with _lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        client = loop_clients.get(key)
+        if client is None or client.is_closed():
+            import openai
+            client = openai.AsyncOpenAI(api_key=key[0], base_url=key[1])
+            loop_clients[key] = client
+        return client
+
+
+def close_openai_clients():
+    """Closes every shared synchronous client and its connection pool"""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+async def aclose_openai_clients():
+    """Closes the shared async clients that belong to the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = list(_async_clients.pop(loop, {}).values())
+    for client in clients:
+        await client.close()
+
+
+atexit.register(close_openai_clients)
+
+
+# Example usage:
+# from openai_clients import get_openai_client, close_openai_clients
+#
+# client = get_openai_client()   # same object for every call with the same key/base URL
+# ...
+# close_openai_clients()         # optional, also runs at interpreter exit
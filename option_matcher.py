@@ -0,0 +1,213 @@
+import difflib
+import math
+import re
+import unicodedata
+from functools import lru_cache
+from typing import AbstractSet, Dict, Any, Iterable, List, NamedTuple, Optional, Tuple
+
+# Question types whose answers must be one of their options
+CONSTRAINED_TYPES = ['mc', 'matrix', 'slider_numeric']
+
+# Fuzzy matches scoring below this are reported as invalid
+MIN_CONFIDENCE = 0.8
+
+_NUMBER = re.compile(r'[-+]?\d+(?:[.,]\d+)?')
+_SEPARATORS = re.compile(r'[\s_\-/]+')
+_NON_WORD = re.compile(r'\W+')
+# Quotes, brackets and sentence punctuation LLMs wrap around an option
+_WRAPPING = '\'"`*.,;:!?()[]{}<> '
+
+
+class OptionMatch(NamedTuple):
+    """How a raw answer maps onto a question"""
+    valid: bool
+    value: Any
+    confidence: float
+    method: str  # 'exact', 'normalized', 'numeric', 'contained', 'fuzzy', 'text' or 'unmatched'
+
+
+def normalize_option_text(text: Any) -> str:
+    """Case-, accent-, whitespace- and punctuation-insensitive form of an option or answer"""
+    text = unicodedata.normalize('NFKC', str(text)).casefold().strip(_WRAPPING)
+    return _SEPARATORS.sub(' ', text).strip()
+
+
+def format_option(option: Any) -> str:
+    """Option text for prompts; whole-number floats are shown without a trailing .0"""
+    if _is_number(option):
+        return f"{option:g}"
+    return str(option)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _parse_number(answer: Any, values: AbstractSet[float] = frozenset()) -> Optional[float]:
+    """
+    The number given by an answer such as 7, '7', '7.0', 'I would say 7/10' or
+    'On a scale of 0 to 10 I'd say 7'
+
+    Scale maxima written after '/' or 'out of' are skipped. Of the other
+    numbers the last one that is in values (the option values) wins, and
+    otherwise the last one.
+    """
+    if _is_number(answer):
+        return float(answer) if math.isfinite(answer) else None
+    text = str(answer)
+    numbers, maxima = [], []
+    for found in _NUMBER.finditer(text):
+        before = text[:found.start()].rstrip().lower()
+        (maxima if before.endswith(('/', 'out of')) else numbers).append(float(found.group().replace(',', '.')))
+    numbers = numbers or maxima
+    for number in reversed(numbers):
+        if number in values:
+            return number
+    return numbers[-1] if numbers else None
+
+
+class OptionMatcher:
+    """
+    Precomputed answer validation for one question.
+
+    Built once per question: hash lookups from option values and labels (as
+    given and normalized), the sorted values of numeric option lists, and
+    the candidates for fuzzy matching. Free-text questions accept any
+    non-empty answer.
+    """
+
+    def __init__(self, question: Dict[str, Any], min_confidence: float = MIN_CONFIDENCE):
+        """
+        Args:
+            question: Question object as returned by convert_yaml_to_json_objects
+            min_confidence: Lowest fuzzy-match score accepted as a valid answer
+        """
+        self.key = question.get('key')
+        self.options: List[Any] = list(question.get('options') or [])
+        self.constrained = bool(self.options) and question.get('type') in CONSTRAINED_TYPES
+        self.min_confidence = min_confidence
+        self.numeric = self.constrained and all(_is_number(option) for option in self.options)
+
+        # Raw answer -> option, for answers that are an option value as-is
+        self._exact: Dict[Any, Any] = {}
+        # Normalized value or label -> option
+        self._normalized: Dict[str, Any] = {}
+        for option in reversed(self.options):
+            self._exact[option] = option
+            self._normalized[normalize_option_text(option)] = option
+        for label, option in reversed(list((question.get('option_labels') or {}).items())):
+            self._normalized.setdefault(normalize_option_text(label), option)
+        self._normalized.pop('', None)
+        self._candidates = list(self._normalized)
+        # Word form of each candidate -> option, for answers that lead or end with an option
+        self._words: Dict[str, Any] = {}
+        for candidate, option in self._normalized.items():
+            words = _NON_WORD.sub(' ', candidate).strip()
+            if words:
+                self._words.setdefault(words, option)
+
+        self._values: List[Tuple[float, Any]] = sorted((float(option), option) for option in self.options) if self.numeric else []
+        self._value_set = frozenset(value for value, _ in self._values)
+        gaps = [b[0] - a[0] for a, b in zip(self._values, self._values[1:]) if b[0] > a[0]]
+        self._step = min(gaps) if gaps else 1.0
+
+    def match(self, answer: Any) -> OptionMatch:
+        """Map a raw answer onto an option (or accept it as free text)"""
+        if not self.constrained:
+            if isinstance(answer, str) and answer.strip():
+                return OptionMatch(True, answer.strip(), 1.0, 'text')
+            if _is_number(answer):
+                return OptionMatch(True, answer, 1.0, 'text')
+            return OptionMatch(False, None, 0.0, 'unmatched')
+
+        try:
+            if answer in self._exact:
+                return OptionMatch(True, self._exact[answer], 1.0, 'exact')
+        except TypeError:
+            # Unhashable answers (e.g. a list from a malformed JSON response)
+            return OptionMatch(False, None, 0.0, 'unmatched')
+        if answer is None:
+            return OptionMatch(False, None, 0.0, 'unmatched')
+
+        # Numbers are read before normalizing, which would turn '-3' into '3'
+        number = _parse_number(answer, self._value_set) if self.numeric else None
+        if number is not None:
+            return self._match_number(number)
+
+        text = normalize_option_text(answer)
+        option = self._normalized.get(text)
+        if option is not None:
+            return OptionMatch(True, option, 1.0, 'normalized')
+        if self.numeric:
+            return OptionMatch(False, None, 0.0, 'unmatched')
+        return self._match_text(text)
+
+    def _match_number(self, number: float) -> OptionMatch:
+        # Nearest option value; answers outside the scale are not clamped onto it
+        if number < self._values[0][0] - self._step / 2 or number > self._values[-1][0] + self._step / 2:
+            return OptionMatch(False, None, 0.0, 'unmatched')
+        distance, option = min((abs(value - number), option) for value, option in self._values)
+        confidence = max(0.0, 1.0 - distance / self._step)
+        return OptionMatch(confidence >= self.min_confidence, option, confidence, 'numeric')
+
+    def _match_text(self, text: str) -> OptionMatch:
+        if not text:
+            return OptionMatch(False, None, 0.0, 'unmatched')
+
+        # Answers like 'No, I have not' or 'My answer: neutral' lead or end with exactly one option
+        words = f" {_NON_WORD.sub(' ', text).strip()} "
+        contained = {option for candidate, option in self._words.items() if words.startswith(f" {candidate} ") or words.endswith(f" {candidate} ")}
+        if len(contained) == 1:
+            return OptionMatch(True, contained.pop(), 0.9, 'contained')
+
+        close = difflib.get_close_matches(text, self._candidates, n=1, cutoff=0.0)
+        if not close:
+            return OptionMatch(False, None, 0.0, 'unmatched')
+        confidence = difflib.SequenceMatcher(None, text, close[0]).ratio()
+        return OptionMatch(confidence >= self.min_confidence, self._normalized[close[0]], confidence, 'fuzzy')
+
+    def match_many(self, answers: Iterable[Any]) -> List[OptionMatch]:
+        """Match a batch of answers, resolving each distinct answer once"""
+        answers = list(answers)
+        memo: Dict[Any, OptionMatch] = {}
+        matches = []
+        for answer in answers:
+            try:
+                result = memo.get(answer)
+                if result is None:
+                    result = memo[answer] = self.match(answer)
+            except TypeError:
+                result = self.match(answer)
+            matches.append(result)
+        return matches
+
+
+def _signature(question: Dict[str, Any]) -> Tuple:
+    options = question.get('options') or []
+    labels = question.get('option_labels') or {}
+    return (question.get('key'), question.get('type'), tuple(options), tuple(labels.items()))
+
+
+@lru_cache(maxsize=4096)
+def _cached_matcher(signature: Tuple) -> OptionMatcher:
+    key, question_type, options, labels = signature
+    return OptionMatcher({'key': key, 'type': question_type, 'options': list(options), 'option_labels': dict(labels)})
+
+
+def matcher_for(question: Dict[str, Any]) -> OptionMatcher:
+    """Shared OptionMatcher for a question object, built on first use"""
+    try:
+        return _cached_matcher(_signature(question))
+    except TypeError:
+        # Unhashable option values: build a private matcher
+        return OptionMatcher(question)
+
+
+# Example usage:
+# from convert_to_json import convert_yaml_to_json_objects
+# from option_matcher import matcher_for
+#
+# questions = convert_yaml_to_json_objects('sample_q.yml')
+# matcher = matcher_for(questions[1])
+# print(matcher.match('I would give it a 7/10'))
+# print(matcher.match_many(['Yes', 'yes.', 'yse']))
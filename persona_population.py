@@ -0,0 +1,197 @@
+import json
+import string
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+from llm_question_handler import SYSTEM_PROMPT
+
+# numpy is optional; install it with `uv sync --extra population`. It is
+# imported by _require_numpy() when a population is first built, so a farm
+# run without --population does not load it.
+np = None
+
+
+def _require_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError("numpy is required for persona populations. Install it with `uv sync --extra population`.") from None
+
+
+def _marginal(name: str, spec: Any) -> Tuple[List[str], List[float]]:
+    """Values and probabilities of one attribute from its config entry"""
+    if isinstance(spec, dict) and 'values' in spec:
+        spec = spec['values']
+    if isinstance(spec, dict):
+        values, weights = [str(value) for value in spec], [float(weight) for weight in spec.values()]
+    elif isinstance(spec, list):
+        values, weights = [str(value) for value in spec], [1.0] * len(spec)
+    else:
+        raise ValueError(f"Attribute '{name}' must map values to weights or list its values")
+    if not values:
+        raise ValueError(f"Attribute '{name}' has no values")
+    if any(weight < 0 for weight in weights) or sum(weights) <= 0:
+        raise ValueError(f"Attribute '{name}' needs non-negative weights with a positive sum")
+    total = sum(weights)
+    return values, [weight / total for weight in weights]
+
+
+class PersonaPopulation:
+    """
+    A seeded population of simulated respondents.
+
+    Each attribute (age group, region, ...) is drawn independently from its
+    configured marginal distribution in one vectorized NumPy call, and the
+    population is stored as an integer code matrix. System prompts are
+    rendered once per distinct attribute combination and shared by every
+    persona with that combination, so generating 100k personas does not
+    format 100k strings. The same config, size and seed always give the
+    same population.
+
+    Config format (e.g. loaded from YAML):
+
+        template: "You are a {age_group} {gender} from {region}. ..."   # optional
+        attributes:
+          age_group: {'18-29': 0.21, '30-44': 0.26, '45-64': 0.33, '65+': 0.20}
+          region: [north, south, east, west]                               # uniform
+    """
+
+    def __init__(self, config: Dict[str, Any], seed: int, codes: "np.ndarray"):
+        """
+        Args:
+            config: Population config (see class docstring)
+            seed: Seed the codes were drawn with
+            codes: codes[i, j] is persona i's value index for the j-th attribute
+        """
+        _require_numpy()
+        attributes = config.get('attributes') or {}
+        if not isinstance(attributes, dict) or not attributes:
+            raise ValueError("Population config needs a non-empty 'attributes' mapping")
+        self.config = config
+        self.seed = seed
+        self.codes = codes
+        self.names = list(attributes)
+        self.values: Dict[str, List[str]] = {}
+        self.probabilities: Dict[str, List[float]] = {}
+        for name, spec in attributes.items():
+            self.values[name], self.probabilities[name] = _marginal(name, spec)
+
+        self.template = config.get('template')
+        if self.template is not None:
+            fields = {field for _, field, _, _ in string.Formatter().parse(self.template) if field}
+            unknown = sorted(fields - set(self.names))
+            if unknown:
+                raise ValueError(f"Population template refers to unknown attributes: {', '.join(unknown)}")
+
+        # Distinct attribute combinations and, per persona, which one it has
+        if len(codes):
+            self.combinations, self.combination_of = np.unique(codes, axis=0, return_inverse=True)
+            self.combination_of = self.combination_of.reshape(-1)
+        else:
+            self.combinations = np.empty((0, len(self.names)), dtype=codes.dtype)
+            self.combination_of = np.empty(0, dtype=np.intp)
+        self._prompts: Optional[List[str]] = None
+        self._attributes: Optional[List[Dict[str, str]]] = None
+
+    @classmethod
+    def sample(cls, config: Dict[str, Any], size: int, seed: int = 0) -> "PersonaPopulation":
+        """
+        Draw a population of size personas
+
+        Args:
+            config: Population config (see class docstring)
+            size: Number of personas
+            seed: Seed of the random generator; reuse it to reproduce the population
+
+        Returns:
+            PersonaPopulation: The sampled population
+        """
+        _require_numpy()
+        if size < 0:
+            raise ValueError("size must not be negative")
+        attributes = config.get('attributes') or {}
+        if not isinstance(attributes, dict) or not attributes:
+            raise ValueError("Population config needs a non-empty 'attributes' mapping")
+        rng = np.random.default_rng(seed)
+        codes = np.empty((size, len(attributes)), dtype=np.int32)
+        for j, (name, spec) in enumerate(attributes.items()):
+            values, probabilities = _marginal(name, spec)
+            codes[:, j] = rng.choice(len(values), size=size, p=probabilities)
+        return cls(config, seed, codes)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def render(self, attributes: Dict[str, str]) -> str:
+        """System prompt for one attribute combination"""
+        if self.template is not None:
+            return self.template.format(**attributes)
+        profile = "; ".join(f"{name.replace('_', ' ')}: {value}" for name, value in attributes.items())
+        return f"{SYSTEM_PROMPT} Answer as a respondent with this profile: {profile}."
+
+    def _render_combinations(self):
+        if self._prompts is None:
+            self._attributes = [
+                {name: self.values[name][code] for name, code in zip(self.names, combination)}
+                for combination in self.combinations.tolist()
+            ]
+            self._prompts = [self.render(attributes) for attributes in self._attributes]
+
+    @property
+    def prompts(self) -> List[str]:
+        """System prompt of each distinct attribute combination (see combination_of)"""
+        self._render_combinations()
+        return self._prompts
+
+    def attributes(self, index: int) -> Dict[str, str]:
+        """Attribute values of persona index"""
+        self._render_combinations()
+        return dict(self._attributes[self.combination_of[index]])
+
+    def personas(self, session_ids: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Persona dictionaries with 'system_prompt' and 'attributes', as run_farm
+        and build_batch_requests take them
+
+        Personas with the same attributes share the prompt string and the
+        attributes dictionary (treat them as read-only).
+
+        Args:
+            session_ids: Optional session id per persona, added as 'session_id'
+        """
+        self._render_combinations()
+        shared = [{'system_prompt': prompt, 'attributes': attributes} for prompt, attributes in zip(self._prompts, self._attributes)]
+        if session_ids is None:
+            return [shared[combination] for combination in self.combination_of.tolist()]
+        if len(session_ids) != len(self):
+            raise ValueError(f"Got {len(session_ids)} session ids for {len(self)} personas")
+        return [dict(shared[combination], session_id=session_id) for combination, session_id in zip(self.combination_of.tolist(), session_ids)]
+
+    def frequencies(self) -> Dict[str, Dict[str, float]]:
+        """Observed share of each value per attribute, to compare with the configured marginals"""
+        result = {}
+        for j, name in enumerate(self.names):
+            counts = np.bincount(self.codes[:, j], minlength=len(self.values[name]))
+            total = max(len(self), 1)
+            result[name] = {value: count / total for value, count in zip(self.values[name], counts.tolist())}
+        return result
+
+    def to_rows(self, session_ids: Sequence[str]) -> List[Tuple]:
+        """(session_id, persona_index, attributes JSON) rows for survey_personas"""
+        self._render_combinations()
+        encoded = [json.dumps(attributes, ensure_ascii=False) for attributes in self._attributes]
+        return [
+            (session_id, index, encoded[combination])
+            for index, (session_id, combination) in enumerate(zip(session_ids, self.combination_of.tolist()))
+        ]
+
+
+# Example usage:
+# import yaml
+# from persona_population import PersonaPopulation
+#
+# with open('population.yml') as f:
+#     population = PersonaPopulation.sample(yaml.safe_load(f), size=100_000, seed=42)
+# print(population.frequencies())
+# personas = population.personas()  # pass to run_farm or build_batch_requests
+# print(personas[0]['system_prompt'])
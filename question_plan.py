@@ -0,0 +1,175 @@
+import copy
+import json
+import logging
+import os
+import threading
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+from convert_to_json import convert_yaml_to_json_objects, dedupe_questions
+from llm_question_handler import SYSTEM_PROMPT, create_prompt, _prepare_request
+from option_matcher import CONSTRAINED_TYPES, OptionMatcher, format_option, matcher_for
+
+logger = logging.getLogger(__name__)
+
+
+class QuestionPlan:
+    """
+    A questionnaire compiled once for repeated use.
+
+    Holds the normalized question objects together with everything the
+    pipeline would otherwise rebuild per call: prompt strings, option lookup
+    tables and the validation map used to check answers.
+    """
+
+    # Bumped whenever the artifact layout changes so stale files are recompiled
+    FORMAT_VERSION = 5
+
+    def __init__(self, questions: List[Dict[str, Any]], source_path: Optional[str] = None, source_mtime_ns: Optional[int] = None, prompts: Optional[List[str]] = None, merges: Optional[List[Dict[str, Any]]] = None, conditions: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            questions: Question objects as returned by convert_yaml_to_json_objects
+            source_path: YAML file the questions came from
+            source_mtime_ns: Modification time of source_path when it was compiled
+            prompts: Prebuilt prompts (rebuilt from the questions when omitted)
+            merges: Duplicate-question merges reported by dedupe_questions
+            conditions: Display conditions the questions were compiled with
+        """
+        self.questions = questions
+        self.merges = merges or []
+        self.conditions = conditions or {}
+        self.source_path = source_path
+        self.source_mtime_ns = source_mtime_ns
+        self.keys = [question.get('key') for question in questions]
+        self.index_by_key = {key: i for i, key in reversed(list(enumerate(self.keys)))}
+
+        self.has_options = [bool(question.get('options')) and question.get('type') in CONSTRAINED_TYPES for question in questions]
+        # Validation map: one precomputed matcher per question
+        self.matchers: List[OptionMatcher] = [matcher_for(question) for question in questions]
+
+        if prompts is None:
+            prompts = [
+                create_prompt(question.get('label', ''), ", ".join(format_option(option) for option in question['options']) if has_options else None)
+                for question, has_options in zip(questions, self.has_options)
+            ]
+        self.prompts = prompts
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def subset(self, indices: Sequence[int]) -> "QuestionPlan":
+        """Plan of the questions at indices, reusing their prebuilt prompts and matchers"""
+        plan = copy.copy(self)
+        plan.questions = [self.questions[i] for i in indices]
+        plan.keys = [self.keys[i] for i in indices]
+        plan.index_by_key = {key: i for i, key in reversed(list(enumerate(plan.keys)))}
+        plan.has_options = [self.has_options[i] for i in indices]
+        plan.matchers = [self.matchers[i] for i in indices]
+        plan.prompts = [self.prompts[i] for i in indices]
+        return plan
+
+    def prepare_request(self, index: int, model: str = "gpt-4o-mini", system_prompt: str = SYSTEM_PROMPT) -> Tuple[Dict[str, Any], List[Any], bool]:
+        """Chat completion arguments for the question at index, using its prebuilt prompt"""
+        return _prepare_request(self.questions[index], model, system_prompt, self.prompts[index])
+
+    def validate(self, index: int, answer: Any) -> Tuple[bool, Any]:
+        """
+        Checks an answer against the question at index with the precomputed lookups
+
+        Returns:
+            tuple: (whether the answer matched, the matched option or the answer itself)
+        """
+        match = self.matchers[index].match(answer)
+        return match.valid, match.value if match.valid else answer
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'format_version': self.FORMAT_VERSION,
+            'source_path': self.source_path,
+            'source_mtime_ns': self.source_mtime_ns,
+            'questions': self.questions,
+            'prompts': self.prompts,
+            'merges': self.merges,
+            'conditions': self.conditions
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QuestionPlan":
+        if data.get('format_version') != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported question plan format version: {data.get('format_version')}")
+        return cls(data['questions'], data.get('source_path'), data.get('source_mtime_ns'), data.get('prompts'), data.get('merges'), data.get('conditions'))
+
+    def save(self, path: str):
+        """Write the plan to a JSON artifact that loads without parsing YAML"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "QuestionPlan":
+        """Read a plan written by save()"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def compile(cls, yaml_path: str, conditions: Optional[Dict[str, Any]] = None) -> "QuestionPlan":
+        """Parse a questionnaire YAML file into a de-duplicated plan"""
+        mtime_ns = os.stat(yaml_path).st_mtime_ns
+        questions, merges = dedupe_questions(convert_yaml_to_json_objects(yaml_path, dedupe=False, conditions=conditions))
+        return cls(questions, os.path.abspath(yaml_path), mtime_ns, merges=merges, conditions=conditions)
+
+
+# Compiled plans keyed by absolute YAML path, valid while the file's mtime is unchanged
+_plan_cache: Dict[str, QuestionPlan] = {}
+_plan_cache_lock = threading.Lock()
+
+
+def load_question_plan(yaml_path: str, artifact_path: Optional[str] = None, conditions: Optional[Dict[str, Any]] = None) -> QuestionPlan:
+    """
+    Returns the compiled plan for a questionnaire, parsing the YAML only when it changed
+
+    Plans are cached in memory on (path, mtime, conditions). With
+    artifact_path, a JSON artifact is reused across processes while its
+    recorded mtime and conditions match, and rewritten when they do not.
+
+    Args:
+        yaml_path: Questionnaire YAML file
+        artifact_path: Optional JSON file used as a persistent compiled copy
+        conditions: Display conditions passed to convert_yaml_to_json_objects
+
+    Returns:
+        QuestionPlan: The compiled questionnaire
+    """
+    source_path = os.path.abspath(yaml_path)
+    mtime_ns = os.stat(source_path).st_mtime_ns
+    conditions = conditions or {}
+
+    with _plan_cache_lock:
+        plan = _plan_cache.get(source_path)
+        if plan is not None and plan.source_mtime_ns == mtime_ns and plan.conditions == conditions:
+            return plan
+
+    plan = None
+    if artifact_path is not None and os.path.exists(artifact_path):
+        try:
+            candidate = QuestionPlan.load(artifact_path)
+            if candidate.source_path == source_path and candidate.source_mtime_ns == mtime_ns and candidate.conditions == conditions:
+                plan = candidate
+        except (ValueError, KeyError, OSError) as e:
+            logger.warning("Ignoring unreadable question plan artifact", extra={'path': artifact_path, 'error': str(e)})
+
+    if plan is None:
+        plan = QuestionPlan.compile(source_path, conditions)
+        if artifact_path is not None:
+            plan.save(artifact_path)
+
+    with _plan_cache_lock:
+        _plan_cache[source_path] = plan
+    return plan
+
+
+# Example usage:
+# from question_plan import load_question_plan
+#
+# plan = load_question_plan('sample_q.yml', artifact_path='sample_q.plan.json')
+# request, options, has_options = plan.prepare_request(0)
+# valid, answer = plan.validate(0, 'Yes')
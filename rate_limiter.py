@@ -0,0 +1,375 @@
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import weakref
+from typing import Dict, Any, NamedTuple, Optional, Tuple
+from instrumentation import metrics
+from token_usage import TokenUsage, count_usage, usage_from_response
+
+# Defaults used until the first response reports the account's real limits
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 200_000
+
+# Statuses a failed call can end with; only these are retried
+RETRYABLE_STATUSES = ('rate_limited', 'timeout', 'connection_error', 'server_error')
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in an x-ratelimit-reset-* header value such as '20ms', '1s' or '6m0s'"""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Server-requested wait from retry-after-ms / retry-after headers, if any"""
+    if headers is None:
+        return None
+    for name, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return max(float(value) * scale, 0.0)
+            except ValueError:
+                continue
+    return None
+
+
+def estimate_tokens(request: Dict[str, Any]) -> int:
+    """Upper estimate of the tokens a chat completion request counts against the TPM limit"""
+    # Roughly 4 characters per token for the prompt, plus the full completion budget
+    prompt_chars = sum(len(str(message.get('content', ''))) for message in request.get('messages', []))
+    if request.get('response_format'):
+        prompt_chars += len(json.dumps(request['response_format']))
+    return prompt_chars // 4 + int(request.get('max_tokens') or 0)
+
+
+class TokenBucket:
+    """
+    A token bucket that hands out reservations instead of blocking.
+
+    reserve() always takes the amount and returns how long the caller must
+    wait before using it. Letting the level go negative queues concurrent
+    callers in the order they reserved, so waiters are served first come,
+    first served without a separate queue.
+    """
+
+    def __init__(self, capacity: float, per_seconds: float = 60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / per_seconds
+        self.level = self.capacity
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """Takes amount from the bucket and returns the seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+            wait = max(self.blocked_until - now, 0.0)
+            if self.level < 0:
+                wait = max(wait, -self.level / self.rate)
+            return wait
+
+    def set_limit(self, capacity: float, per_seconds: float = 60.0):
+        """Adopts a new limit, keeping the current level (and any queued debt)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.capacity = float(capacity)
+            self.rate = self.capacity / per_seconds
+            self.level = min(self.level, self.capacity)
+
+    def observe_remaining(self, remaining: float):
+        """Never believe more is left than the server reported"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.level, remaining)
+
+    def pause(self, seconds: float):
+        """Blocks every reservation for the next seconds (e.g. after a 429)"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budgets for one API key.
+
+    Starts from the given limits and adapts to the x-ratelimit-* headers of
+    every response, so pacing follows the account's real limits. When several
+    processes share one key, share is the fraction of the account limits
+    (and of the remaining budget the headers report) this limiter may use.
+    """
+
+    def __init__(self, requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE, share: float = 1.0):
+        self.share = share
+        self.requests = TokenBucket(requests_per_minute * share)
+        self.tokens = TokenBucket(tokens_per_minute * share)
+
+    def set_limits(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None, share: Optional[float] = None):
+        """Sets the account limits and/or this limiter's share of them (None keeps the current value)"""
+        if share is not None:
+            scale = share / self.share
+            self.share = share
+            self.requests.set_limit(self.requests.capacity * scale)
+            self.tokens.set_limit(self.tokens.capacity * scale)
+        if requests_per_minute is not None:
+            self.requests.set_limit(requests_per_minute * self.share)
+        if tokens_per_minute is not None:
+            self.tokens.set_limit(tokens_per_minute * self.share)
+
+    def reserve(self, tokens: int) -> float:
+        """Reserves one request and tokens, returning the seconds to wait"""
+        return max(self.requests.reserve(1), self.tokens.reserve(tokens))
+
+    def acquire(self, tokens: int):
+        """Blocking reservation for synchronous callers"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int):
+        """Reservation for coroutines; waits without blocking the event loop"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        self.requests.pause(seconds)
+        self.tokens.pause(seconds)
+
+    def update_from_headers(self, headers):
+        """
+        Applies the x-ratelimit-limit-*, x-ratelimit-remaining-* and x-ratelimit-reset-* response headers
+
+        Once the server reports nothing remaining, the bucket is paused until
+        the reported reset rather than refilled at the average rate, which
+        would send requests the server still rejects.
+        """
+        if headers is None:
+            return
+        for name, bucket in (('requests', self.requests), ('tokens', self.tokens)):
+            try:
+                limit = headers.get(f'x-ratelimit-limit-{name}')
+                if limit is not None and float(limit) > 0 and float(limit) * self.share != bucket.capacity:
+                    bucket.set_limit(float(limit) * self.share)
+                remaining = headers.get(f'x-ratelimit-remaining-{name}')
+                if remaining is not None:
+                    bucket.observe_remaining(float(remaining) * self.share)
+                    reset = parse_reset_duration(headers.get(f'x-ratelimit-reset-{name}'))
+                    if float(remaining) <= 0 and reset:
+                        bucket.pause(reset)
+            except ValueError:
+                continue
+
+
+class LLMResult(NamedTuple):
+    """
+    Outcome of one scheduled chat completion.
+
+    status is 'ok' or the kind of failure: 'rate_limited', 'timeout',
+    'connection_error' and 'server_error' are retried; 'quota_exceeded',
+    'invalid_request', 'api_error' and 'error' are not.
+    """
+    status: str
+    content: Optional[str] = None
+    attempts: int = 0
+    error: Optional[str] = None
+    # Validated answer, filled in by the question handlers
+    answer: Any = None
+    # Tokens and cost of the successful attempt (see token_usage.usage_from_response);
+    # results split from a survey call carry none (see ask_survey_results)
+    usage: Optional[Dict[str, Any]] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 'ok'
+
+
+def classify_error(error: Exception) -> Tuple[str, Optional[float]]:
+    """Maps an exception from the OpenAI client to (status, server-requested wait)"""
+    import openai
+    if isinstance(error, openai.RateLimitError):
+        # A 429 for an exhausted quota will not clear by waiting
+        if getattr(error, 'code', None) == 'insufficient_quota':
+            return 'quota_exceeded', None
+        return 'rate_limited', retry_after_seconds(error.response.headers)
+    if isinstance(error, openai.APITimeoutError):
+        return 'timeout', None
+    if isinstance(error, openai.APIConnectionError):
+        return 'connection_error', None
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code >= 500 or error.status_code in (408, 409):
+            return 'server_error', retry_after_seconds(error.response.headers)
+        if error.status_code in (400, 404, 422):
+            return 'invalid_request', None
+        return 'api_error', None
+    return 'error', None
+
+
+class LLMScheduler:
+    """
+    Paces chat completion calls through a RateLimiter and retries transient failures.
+
+    The client's own retry loop is disabled so every attempt goes through the
+    limiter. Retries back off exponentially with full jitter, never sooner than
+    a server-provided retry-after, and a 429 pauses the shared limiter so
+    other in-flight callers hold off too. Failures come back as LLMResult
+    instead of exceptions. Token usage and cost of every response are
+    totalled in .usage.
+    """
+
+    def __init__(self, client, limiter: Optional[RateLimiter] = None, max_attempts: int = 6, base_delay: float = 0.5, max_delay: float = 30.0, timeout: Optional[float] = 60.0):
+        """
+        Args:
+            client: openai.OpenAI or openai.AsyncOpenAI client
+            limiter: RateLimiter to share (a new one with default limits otherwise)
+            max_attempts: Attempts per request, including the first
+            base_delay: Backoff before the first retry, doubled for each further retry
+            max_delay: Upper bound for a single backoff
+            timeout: Per-attempt request timeout in seconds
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.client = client.with_options(max_retries=0, timeout=timeout)
+        self.limiter = limiter or RateLimiter()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.usage = TokenUsage()
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _failed(self, attempt: int, error: Exception, started: float) -> Tuple[Optional[LLMResult], float]:
+        """Records a failed attempt; returns (final result or None to retry, backoff)"""
+        status, retry_after = classify_error(error)
+        metrics.observe('llm_attempt_seconds', time.perf_counter() - started, status=status)
+        if status == 'rate_limited':
+            self.rate_limited += 1
+            if retry_after is not None:
+                self.limiter.pause(retry_after)
+        if status in RETRYABLE_STATUSES and attempt < self.max_attempts:
+            self.retries += 1
+            metrics.inc('llm_retries_total', status=status)
+            return None, self._backoff(attempt, retry_after)
+        self.failures += 1
+        metrics.inc('llm_requests_total', status=status)
+        return LLMResult(status, attempts=attempt, error=str(error)), 0.0
+
+    def _succeeded(self, attempt: int, raw, model: Optional[str], started: float) -> LLMResult:
+        """Parses a 2xx response; errors raised here fail the attempt through _failed instead"""
+        self.limiter.update_from_headers(raw.headers)
+        response = raw.parse()
+        content = response.choices[0].message.content
+        usage = usage_from_response(response.usage, model)
+        metrics.observe('llm_attempt_seconds', time.perf_counter() - started, status='ok')
+        metrics.inc('llm_requests_total', status='ok')
+        self.usage.add(usage)
+        count_usage(usage)
+        return LLMResult('ok', content, attempts=attempt, usage=usage)
+
+    def complete(self, request: Dict[str, Any]) -> LLMResult:
+        """Runs a chat completion request on a synchronous client"""
+        tokens = estimate_tokens(request)
+        for attempt in range(1, self.max_attempts + 1):
+            self.limiter.acquire(tokens)
+            self.requests += 1
+            started = time.perf_counter()
+            try:
+                raw = self.client.chat.completions.with_raw_response.create(**request)
+                return self._succeeded(attempt, raw, request.get('model'), started)
+            except Exception as e:
+                result, delay = self._failed(attempt, e, started)
+                if result is not None:
+                    return result
+                time.sleep(delay)
+
+    async def complete_async(self, request: Dict[str, Any]) -> LLMResult:
+        """Runs a chat completion request on an AsyncOpenAI client"""
+        tokens = estimate_tokens(request)
+        for attempt in range(1, self.max_attempts + 1):
+            await self.limiter.acquire_async(tokens)
+            self.requests += 1
+            started = time.perf_counter()
+            try:
+                raw = await self.client.chat.completions.with_raw_response.create(**request)
+                return self._succeeded(attempt, raw, request.get('model'), started)
+            except Exception as e:
+                result, delay = self._failed(attempt, e, started)
+                if result is not None:
+                    return result
+                await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'rate_limited': self.rate_limited,
+            'failures': self.failures
+        }
+
+
+# Limits belong to the API key, so every client for the same key and base URL
+# shares one limiter; schedulers are cached per client object.
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_schedulers: "weakref.WeakKeyDictionary[Any, LLMScheduler]" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def get_rate_limiter(api_key: str, base_url: Optional[str] = None) -> RateLimiter:
+    """Returns the process-wide RateLimiter for an API key and base URL"""
+    key = (api_key, str(base_url))
+    with _lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter()
+        return limiter
+
+
+def get_scheduler(client) -> LLMScheduler:
+    """Returns the shared LLMScheduler for a client, pacing it with its key's limiter"""
+    with _lock:
+        scheduler = _schedulers.get(client)
+    if scheduler is None:
+        scheduler = LLMScheduler(client, get_rate_limiter(client.api_key, client.base_url))
+        with _lock:
+            scheduler = _schedulers.setdefault(client, scheduler)
+    return scheduler
+
+
+# Example usage:
+# from openai_clients import get_async_openai_client
+# from rate_limiter import get_scheduler
+#
+# scheduler = get_scheduler(get_async_openai_client())
+# result = await scheduler.complete_async({'model': 'gpt-4o-mini', 'messages': [...], 'max_tokens': 50})
+# if result.ok:
+#     print(result.content)
+# else:
+#     print(f"{result.status} after {result.attempts} attempts: {result.error}")
@@ -0,0 +1,318 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import uuid
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional
+from instrumentation import configure_logging
+from supabase_handler import SupabaseHandler
+
+# pyarrow and numpy are optional; install them with `uv sync --extra export`
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    np = pa = pc = pq = None
+
+logger = logging.getLogger(__name__)
+
+# Long-format columns streamed from survey_responses; session_date is the date the session started
+EXPORT_SOURCE = "survey_responses r"
+EXPORT_COLUMNS = [
+    'r.session_id',
+    'r.question_key',
+    'r.answer',
+    'r.options::text',
+    'r.created_at',
+    'r.session_date'
+]
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow and numpy are required for exports. Install them with `uv sync --extra export`.")
+
+
+def _long_schema():
+    return pa.schema([
+        ('session_id', pa.string()),
+        ('question_key', pa.string()),
+        ('answer', pa.string()),
+        ('options', pa.string()),
+        ('created_at', pa.timestamp('us')),
+        ('session_date', pa.date32())
+    ])
+
+
+def iter_response_batches(handler: SupabaseHandler, since: Optional[datetime] = None, until: Optional[datetime] = None, batch_size: int = 50_000) -> Iterator["pa.RecordBatch"]:
+    """
+    Stream survey_responses as long-format Arrow record batches
+
+    Rows arrive ordered by session_date and session_id, so each session's
+    answers are contiguous and each date's sessions follow one another.
+
+    Args:
+        handler: Database handler to read from
+        since: Only rows written or replaced strictly after this updated_at
+        until: Only rows written or replaced at or before this updated_at
+        batch_size: Rows per record batch (also the server-side cursor fetch size)
+
+    Yields:
+        pa.RecordBatch with session_id, question_key, answer, options (JSON text),
+        created_at and session_date columns
+    """
+    _require_pyarrow()
+    conditions = []
+    params = []
+    if since is not None:
+        conditions.append("r.updated_at > %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("r.updated_at <= %s")
+        params.append(until)
+
+    schema = _long_schema()
+    rows = handler.iter_table(
+        EXPORT_SOURCE,
+        EXPORT_COLUMNS,
+        where_clause=" AND ".join(conditions) or None,
+        params=params or None,
+        order_by="r.session_date, r.session_id, r.created_at, r.id",
+        itersize=batch_size,
+        row_mode='tuple',
+        convert=False
+    )
+    columns: List[List[Any]] = [[] for _ in schema]
+    for row in rows:
+        for column, value in zip(columns, row):
+            column.append(value)
+        if len(columns[0]) >= batch_size:
+            yield pa.RecordBatch.from_arrays([pa.array(c, type=f.type) for c, f in zip(columns, schema)], schema=schema)
+            columns = [[] for _ in schema]
+    if columns[0]:
+        yield pa.RecordBatch.from_arrays([pa.array(c, type=f.type) for c, f in zip(columns, schema)], schema=schema)
+
+
+def _option_dictionary(options_text: Optional[str]) -> List[str]:
+    """Option values from the stored options JSON, as the strings answers are stored as"""
+    if not options_text:
+        return []
+    try:
+        options = json.loads(options_text)
+    except json.JSONDecodeError:
+        return []
+    if not isinstance(options, list):
+        return []
+    return [option if isinstance(option, str) else str(option) for option in options]
+
+
+def pivot_responses(long_table: "pa.Table") -> "pa.Table":
+    """
+    Pivot long-format responses into one row per session and one column per question
+
+    Questions with an option list become dictionary-encoded columns whose
+    dictionary is the option list (answers outside it are appended to the
+    dictionary rather than dropped). Free-text questions stay strings. If a
+    session answered a question twice, the latest answer wins.
+
+    Args:
+        long_table: Table with the columns produced by iter_response_batches
+
+    Returns:
+        pa.Table with session_id, session_date and one column per question_key
+    """
+    _require_pyarrow()
+    # Latest answer last, so the scatter below keeps it
+    long_table = long_table.sort_by([('created_at', 'ascending')])
+    session_ids = long_table.column('session_id').combine_chunks()
+    sessions = pc.unique(session_ids)
+    row_index = pc.index_in(session_ids, value_set=sessions).to_numpy(zero_copy_only=False)
+
+    session_dates = np.empty(len(sessions), dtype='datetime64[D]')
+    session_dates[row_index] = long_table.column('session_date').to_numpy()
+
+    columns = {
+        'session_id': sessions,
+        'session_date': pa.array(session_dates, type=pa.date32())
+    }
+    question_keys = long_table.column('question_key').combine_chunks()
+    for key in pc.unique(question_keys).to_pylist():
+        mask = pc.equal(question_keys, key)
+        positions = row_index[mask.to_numpy(zero_copy_only=False)]
+        answers = pc.filter(long_table.column('answer'), mask).combine_chunks()
+        options_text = pc.filter(long_table.column('options'), mask)
+        dictionary = _option_dictionary(options_text[0].as_py() if len(options_text) else None)
+
+        if dictionary:
+            extra = [value for value in pc.unique(answers).to_pylist() if value is not None and value not in dictionary]
+            dictionary = pa.array(dictionary + extra, type=pa.string())
+            codes = np.full(len(sessions), -1, dtype=np.int32)
+            codes[positions] = pc.fill_null(pc.index_in(answers, value_set=dictionary), -1).to_numpy(zero_copy_only=False)
+            indices = pa.array(codes, mask=codes < 0, type=pa.int32())
+            columns[key] = pa.DictionaryArray.from_arrays(indices, dictionary)
+        else:
+            values = np.full(len(sessions), None, dtype=object)
+            values[positions] = answers.to_numpy(zero_copy_only=False)
+            columns[key] = pa.array(values, type=pa.string())
+
+    return pa.table(columns)
+
+
+def iter_session_groups(batches: Iterator["pa.RecordBatch"], group_rows: int = 200_000) -> Iterator["pa.Table"]:
+    """
+    Regroup an ordered response stream into tables of whole sessions from one session date
+
+    A group is cut whenever the session date changes, and at the next session
+    boundary once it holds group_rows rows, so at most about group_rows rows
+    (plus one record batch) are held at a time.
+
+    Args:
+        batches: Record batches as yielded by iter_response_batches
+        group_rows: Rows after which a group ends at the next session boundary
+
+    Yields:
+        pa.Table per group, with the columns of iter_response_batches
+    """
+    _require_pyarrow()
+    pending: List["pa.RecordBatch"] = []
+    pending_rows = 0
+    last = None
+    for batch in batches:
+        if not len(batch):
+            continue
+        dates = batch.column('session_date').to_numpy(zero_copy_only=False)
+        ids = batch.column('session_id').to_numpy(zero_copy_only=False)
+        # Rows that start a new session, including one continuing across batches or not
+        starts = (np.flatnonzero((dates[1:] != dates[:-1]) | (ids[1:] != ids[:-1])) + 1).tolist()
+        if last is not None and (dates[0], ids[0]) != last:
+            starts.insert(0, 0)
+        offset = 0
+        for start in starts:
+            previous_date = dates[start - 1] if start else last[0]
+            if dates[start] != previous_date or pending_rows + start - offset >= group_rows:
+                if start > offset:
+                    pending.append(batch.slice(offset, start - offset))
+                yield pa.Table.from_batches(pending)
+                pending, pending_rows, offset = [], 0, start
+        pending.append(batch.slice(offset))
+        pending_rows += len(batch) - offset
+        last = (dates[-1], ids[-1])
+    if pending:
+        yield pa.Table.from_batches(pending)
+
+
+def _read_state(state_path: Optional[str]) -> Dict[str, Any]:
+    if state_path is None or not os.path.exists(state_path):
+        return {}
+    with open(state_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_state(state_path: str, state: Dict[str, Any]):
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def _export_upper_bound(handler: SupabaseHandler, settle_seconds: float) -> datetime:
+    """Database-clock cut-off that leaves in-flight transactions time to commit"""
+    with handler.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT LOCALTIMESTAMP - %s * INTERVAL '1 second'", (settle_seconds,))
+            return cursor.fetchone()[0]
+
+
+def export_responses_to_parquet(handler: SupabaseHandler, output_dir: str, state_path: Optional[str] = None, settle_seconds: float = 60.0, batch_size: int = 50_000, group_rows: int = 200_000) -> Dict[str, Any]:
+    """
+    Export survey_responses as a wide Parquet dataset partitioned by session date
+
+    Responses are streamed in session order and pivoted and written one
+    group of whole sessions at a time (see iter_session_groups), so memory
+    stays bounded however many rows are exported.
+
+    With state_path, the export is incremental: only rows whose updated_at
+    is after the watermark stored there are read, and the watermark advances
+    to the cut-off of this run. An answer replaced after it was exported is
+    therefore exported again. A session whose answers straddle two runs
+    appears in both runs' files, each with the answers that were new or
+    replaced at the time.
+
+    Args:
+        handler: Database handler to read from
+        output_dir: Root directory of the Parquet dataset (session_date=YYYY-MM-DD/ subdirectories)
+        state_path: Optional JSON file holding the updated_at watermark between runs
+        settle_seconds: Rows newer than this are left for the next run, so transactions
+            still committing with an earlier updated_at are not skipped
+        batch_size: Rows per streamed record batch
+        group_rows: Long-format rows pivoted and written at a time, rounded up to whole sessions
+
+    Returns:
+        Dictionary with 'rows', 'sessions', 'files' and 'watermark'
+    """
+    _require_pyarrow()
+    state = _read_state(state_path)
+    since = datetime.fromisoformat(state['watermark']) if state.get('watermark') else None
+    until = _export_upper_bound(handler, settle_seconds)
+
+    summary = {'rows': 0, 'sessions': 0, 'files': [], 'watermark': until.isoformat()}
+    for group in iter_session_groups(iter_response_batches(handler, since, until, batch_size), group_rows):
+        wide = pivot_responses(group)
+        pq.write_to_dataset(
+            wide,
+            root_path=output_dir,
+            partition_cols=['session_date'],
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            file_visitor=lambda written: summary['files'].append(written.path)
+        )
+        summary['rows'] += group.num_rows
+        summary['sessions'] += wide.num_rows
+
+    if state_path is not None:
+        state['watermark'] = summary['watermark']
+        _write_state(state_path, state)
+
+    logger.info("Exported responses", extra={'rows': summary['rows'], 'sessions': summary['sessions'], 'files': len(summary['files'])})
+    return summary
+
+
+def main(argv: Optional[List[str]] = None, prog: Optional[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog=prog, description="Export survey_responses as a wide Parquet dataset partitioned by session date")
+    parser.add_argument('output_dir', help="Root directory of the Parquet dataset")
+    parser.add_argument('--state', help="JSON file holding the updated_at watermark; makes the export incremental")
+    parser.add_argument('--settle-seconds', type=float, default=60.0, help="Leave rows newer than this for the next run")
+    parser.add_argument('--batch-size', type=int, default=50_000, help="Rows per streamed record batch")
+    parser.add_argument('--group-rows', type=int, default=200_000, help="Rows pivoted and written at a time, rounded up to whole sessions")
+    parser.add_argument('--log-level', default='INFO')
+    parser.add_argument('--log-format', choices=['text', 'json'], default='text')
+    args = parser.parse_args(argv)
+
+    configure_logging(args.log_level, json_format=args.log_format == 'json')
+    handler = SupabaseHandler()
+    try:
+        export_responses_to_parquet(handler, args.output_dir, args.state, args.settle_seconds, args.batch_size, args.group_rows)
+    finally:
+        handler.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+# Example usage:
+# from supabase_handler import SupabaseHandler
+# from response_export import export_responses_to_parquet
+#
+# # Nightly job: only responses written or replaced since the previous run are read
+# export_responses_to_parquet(SupabaseHandler(), 'exports/survey_responses', state_path='exports/state.json')
+#
+# import pyarrow.dataset as ds
+# table = ds.dataset('exports/survey_responses', partitioning='hive').to_table()
+#
+# # The same from the command line
+# python response_export.py exports/survey_responses --state exports/state.json
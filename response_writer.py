@@ -0,0 +1,209 @@
+import logging
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from supabase_handler import SupabaseHandler
+from token_usage import TokenUsage
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseWriter:
+    """
+    Buffers survey responses from any number of sessions and writes them to
+    the database in bulk on a background thread.
+
+    A batch is flushed when it reaches max_batch_size responses or when its
+    oldest response has waited flush_interval seconds, whichever comes first.
+    Each flush is one SupabaseHandler.bulk_insert_responses call, so session
+    counters are updated once per flush instead of once per answer. Token
+    usage queued with add_usage is written with the next flush, and flush()
+    and close() wait for it as well as for the responses.
+    """
+
+    def __init__(self, handler: SupabaseHandler, max_batch_size: int = 500, flush_interval: float = 1.0, max_buffered: Optional[int] = None):
+        """
+        Args:
+            handler: Database handler used for the bulk writes
+            max_batch_size: Number of buffered responses that triggers a flush
+            flush_interval: Maximum seconds a response waits in the buffer
+            max_buffered: If set, add() blocks while this many responses are waiting
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+
+        self.written_count = 0
+        # Batches whose bulk insert failed, kept so callers can retry or inspect them
+        self.failed_batches: List[List[Dict[str, Any]]] = []
+        # Session id -> token usage whose write failed
+        self.failed_usage: Dict[str, TokenUsage] = {}
+
+        self._buffer: List[Dict[str, Any]] = []
+        # Monotonic enqueue time of each buffered response, in buffer order
+        self._added_at: List[float] = []
+        # Session id -> token usage not yet written
+        self._usage: Dict[str, TokenUsage] = {}
+        self._enqueued = 0
+        self._processed = 0
+        # add_usage calls so far, and how many of them have been written
+        self._usage_enqueued = 0
+        self._usage_processed = 0
+        self._flush_requested = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="response-writer", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, session_id: str, question_obj: Dict[str, Any], answer: Any):
+        """Queue one answer for writing"""
+        self.add_many(session_id, [{'question': question_obj, 'answer': answer}])
+
+    def add_many(self, session_id: str, responses: List[Dict[str, Any]]):
+        """
+        Queue several answers of one session for writing
+
+        Args:
+            session_id: Unique identifier for the survey session
+            responses: List of dictionaries with 'question' and 'answer' keys
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("ResponseWriter is closed")
+            while self.max_buffered is not None and len(self._buffer) >= self.max_buffered:
+                self._condition.wait()
+            self._added_at.extend([time.monotonic()] * len(responses))
+            for response in responses:
+                self._buffer.append({
+                    'session_id': session_id,
+                    'question': response['question'],
+                    'answer': response['answer']
+                })
+            self._enqueued += len(responses)
+            self._condition.notify_all()
+
+    def add_usage(self, session_id: str, usage: TokenUsage):
+        """Queue token usage to add to a session's totals"""
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("ResponseWriter is closed")
+            self._usage.setdefault(session_id, TokenUsage()).merge(usage)
+            self._usage_enqueued += 1
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Write everything queued so far, responses and token usage, and wait for it to reach the database
+
+        Returns:
+            bool: True if every write so far succeeded and the wait did not time out
+        """
+        with self._condition:
+            target, usage_target = self._enqueued, self._usage_enqueued
+            self._flush_requested = True
+            self._condition.notify_all()
+            done = self._condition.wait_for(lambda: self._processed >= target and self._usage_processed >= usage_target, timeout)
+        return done and self._succeeded()
+
+    def _succeeded(self) -> bool:
+        return not self.failed_batches and not self.failed_usage
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """Flush remaining responses and stop the background thread"""
+        with self._condition:
+            if self._closed:
+                return self._succeeded()
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        if self.failed_batches:
+            failed = sum(len(batch) for batch in self.failed_batches)
+            logger.error("ResponseWriter closed with responses that failed to write", extra={'failed': failed})
+        return not self._thread.is_alive() and self._succeeded()
+
+    def _next_batch(self) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, TokenUsage], int]]:
+        """
+        Block until a batch is due and take it and the queued usage (None once closed and drained)
+
+        Returns:
+            (responses, usage, add_usage calls covered by usage)
+        """
+        with self._condition:
+            while True:
+                if self._buffer:
+                    due = self._added_at[0] + self.flush_interval
+                    if (self._closed or self._flush_requested
+                            or len(self._buffer) >= self.max_batch_size
+                            or time.monotonic() >= due):
+                        break
+                    self._condition.wait(max(due - time.monotonic(), 0))
+                elif self._usage and (self._closed or self._flush_requested):
+                    break
+                elif self._closed:
+                    return None
+                else:
+                    self._flush_requested = False
+                    self._condition.wait()
+
+            batch = self._buffer[:self.max_batch_size]
+            del self._buffer[:self.max_batch_size]
+            # Leftovers keep their enqueue time, so they are still flushed within flush_interval
+            del self._added_at[:len(batch)]
+            if not self._buffer:
+                self._flush_requested = False
+            usage, self._usage = self._usage, {}
+            # Wake producers blocked on max_buffered
+            self._condition.notify_all()
+            return batch, usage, self._usage_enqueued
+
+    def _run(self):
+        while True:
+            due = self._next_batch()
+            if due is None:
+                return
+            batch, usage, usage_enqueued = due
+            if batch:
+                try:
+                    success = self.handler.bulk_insert_responses(batch)
+                except Exception:
+                    # A raising handler fails the batch like a False return, so the thread keeps running
+                    logger.exception("Bulk insert raised", extra={'responses': len(batch)})
+                    success = False
+                with self._condition:
+                    if success:
+                        self.written_count += len(batch)
+                    else:
+                        self.failed_batches.append(batch)
+                    self._processed += len(batch)
+                    self._condition.notify_all()
+            # After the responses, so a new session row is created by the bulk insert
+            try:
+                written = not usage or self.handler.add_session_usage(usage)
+            except Exception:
+                logger.exception("Writing token usage raised", extra={'sessions': len(usage)})
+                written = False
+            with self._condition:
+                if not written:
+                    logger.error("Token usage could not be written", extra={'sessions': len(usage)})
+                    for session_id, session_usage in usage.items():
+                        self.failed_usage.setdefault(session_id, TokenUsage()).merge(session_usage)
+                self._usage_processed = usage_enqueued
+                self._condition.notify_all()
+
+
+# Example usage:
+# from supabase_handler import SupabaseHandler
+# from response_writer import ResponseWriter
+#
+# db_handler = SupabaseHandler()
+# with ResponseWriter(db_handler, max_batch_size=1000, flush_interval=2.0) as writer:
+#     for question in questions:
+#         writer.add(session_id, question, ask_question_with_llm(question))
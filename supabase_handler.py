@@ -1,19 +1,253 @@
-import psycopg2
+import csv
+import io
+import logging
 import os
-from typing import Dict, Any, List, Optional
-from dotenv import load_dotenv
-from datetime import datetime
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Sequence, Tuple, Union
+from datetime import date, datetime
+from env import load_env
+from instrumentation import metrics
+from token_usage import TokenUsage
 import json
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Bound by _import_psycopg2() when the first connection is made, so importing
+# this module (e.g. for a CLI's --help) does not load the driver
+psycopg2 = None
+
+# Column order shared by the bulk VALUES and COPY write paths
+RESPONSE_COLUMNS = ('session_id', 'question_key', 'question_label', 'question_type', 'answer', 'options')
+# Columns returned by get_session_responses / iter_session_responses
+SESSION_RESPONSE_COLUMNS = ('question_key', 'question_label', 'question_type', 'answer', 'options', 'created_at')
+# Token accounting columns shared by survey_sessions and survey_runs, in TokenUsage field order
+USAGE_COLUMNS = ('llm_requests', 'prompt_tokens', 'cached_tokens', 'completion_tokens', 'cost_usd')
+
+ROW_MODES = ('dict', 'tuple', 'namedtuple')
+# Type OIDs of timestamp and json/jsonb columns (and their arrays) converted by read_table
+DATETIME_TYPE_OIDS = {1114, 1184}
+JSON_TYPE_OIDS = {114, 3802, 199, 3807}
+
+# Key of the advisory lock held while the schema or its partitions change
+SCHEMA_LOCK_ID = 72_413_001
+# Months of survey_responses partitions kept created ahead of the current one
+PARTITION_MONTHS_AHEAD = 2
+
+# Schema changes in the order they are applied: (version, name, statements).
+# Applied versions are recorded in schema_migrations and each migration runs
+# in its own transaction. Never edit a released migration; append a new one.
+MIGRATIONS: List[Tuple[int, str, Tuple[str, ...]]] = [
+    (1, 'initial_schema', (
+        """
+        CREATE TABLE IF NOT EXISTS survey_responses (
+            id SERIAL PRIMARY KEY,
+            session_id VARCHAR(255) NOT NULL,
+            question_key VARCHAR(255) NOT NULL,
+            question_label TEXT NOT NULL,
+            question_type VARCHAR(50) NOT NULL,
+            answer TEXT NOT NULL,
+            options JSONB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Complete survey sessions
+        """
+        CREATE TABLE IF NOT EXISTS survey_sessions (
+            id SERIAL PRIMARY KEY,
+            session_id VARCHAR(255) UNIQUE NOT NULL,
+            total_questions INTEGER DEFAULT 0,
+            completed_questions INTEGER DEFAULT 0,
+            status VARCHAR(50) DEFAULT 'in_progress',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP
+        )
+        """,
+        # Token and cost totals per session, added to tables created before they existed
+        """
+        ALTER TABLE survey_sessions
+            ADD COLUMN IF NOT EXISTS llm_requests INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS prompt_tokens BIGINT NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS cached_tokens BIGINT NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS completion_tokens BIGINT NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS cost_usd NUMERIC(14, 6) NOT NULL DEFAULT 0
+        """,
+        # Seeded respondent populations (see persona_population) and the
+        # attributes of each session's persona, so runs can be reproduced
+        """
+        CREATE TABLE IF NOT EXISTS survey_populations (
+            run_id VARCHAR(255) PRIMARY KEY,
+            seed BIGINT NOT NULL,
+            size INTEGER NOT NULL,
+            -- JSON, not JSONB: key order decides the sample, so it must survive
+            config JSON NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS survey_personas (
+            session_id VARCHAR(255) PRIMARY KEY,
+            run_id VARCHAR(255) NOT NULL,
+            persona_index INTEGER NOT NULL,
+            attributes JSONB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Token and cost totals per run (e.g. a farm run or a batch)
+        """
+        CREATE TABLE IF NOT EXISTS survey_runs (
+            run_id VARCHAR(255) PRIMARY KEY,
+            model VARCHAR(255),
+            llm_requests INTEGER NOT NULL DEFAULT 0,
+            prompt_tokens BIGINT NOT NULL DEFAULT 0,
+            cached_tokens BIGINT NOT NULL DEFAULT 0,
+            completion_tokens BIGINT NOT NULL DEFAULT 0,
+            cost_usd NUMERIC(14, 6) NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    )),
+    (2, 'session_timestamps', (
+        # The session upserts set updated_at, which survey_sessions never had
+        """
+        ALTER TABLE survey_sessions
+            ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        """,
+        "UPDATE survey_sessions SET updated_at = COALESCE(completed_at, created_at, CURRENT_TIMESTAMP)",
+        # created_at decides which survey_responses partition a session's answers live in
+        "UPDATE survey_sessions SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL",
+        "ALTER TABLE survey_sessions ALTER COLUMN created_at SET NOT NULL",
+        "CREATE INDEX IF NOT EXISTS survey_sessions_status_idx ON survey_sessions (status, created_at)",
+    )),
+    (3, 'partitioned_responses', (
+        # Responses written before sessions were tracked get a session row, so
+        # every response can be given its session's date
+        """
+        INSERT INTO survey_sessions (session_id, total_questions, completed_questions, created_at)
+        SELECT session_id, COUNT(DISTINCT question_key), COUNT(DISTINCT question_key), MIN(COALESCE(created_at, CURRENT_TIMESTAMP))
+        FROM survey_responses r
+        WHERE NOT EXISTS (SELECT 1 FROM survey_sessions s WHERE s.session_id = r.session_id)
+        GROUP BY session_id
+        """,
+        "ALTER TABLE survey_responses RENAME TO survey_responses_unpartitioned",
+        "ALTER INDEX IF EXISTS survey_responses_pkey RENAME TO survey_responses_unpartitioned_pkey",
+        "ALTER SEQUENCE IF EXISTS survey_responses_id_seq RENAME TO survey_responses_unpartitioned_id_seq",
+        # Partitioned by the date the session started, which never changes, so all
+        # answers of a session share one partition and (session_date, session_id,
+        # question_key) is as unique as (session_id, question_key)
+        """
+        CREATE TABLE survey_responses (
+            id BIGSERIAL,
+            session_id VARCHAR(255) NOT NULL,
+            question_key VARCHAR(255) NOT NULL,
+            question_label TEXT NOT NULL,
+            question_type VARCHAR(50) NOT NULL,
+            answer TEXT NOT NULL,
+            options JSONB,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            session_date DATE NOT NULL,
+            PRIMARY KEY (session_date, id),
+            CONSTRAINT survey_responses_session_question_key UNIQUE (session_date, session_id, question_key)
+        ) PARTITION BY RANGE (session_date)
+        """,
+        # Catches rows for months whose partition was not created in time
+        "CREATE TABLE survey_responses_default PARTITION OF survey_responses DEFAULT",
+        # A session's answers in order, answer counts per question, and export watermarks
+        "CREATE INDEX survey_responses_session_idx ON survey_responses (session_id, created_at)",
+        "CREATE INDEX survey_responses_question_idx ON survey_responses (question_key, answer)",
+        "CREATE INDEX survey_responses_created_idx ON survey_responses (created_at, id)",
+        # Creates the monthly partition holding month, moving its rows out of the
+        # default partition first (attaching would fail while they are there)
+        """
+        CREATE OR REPLACE FUNCTION survey_responses_ensure_partition(month DATE) RETURNS TEXT AS $$
+        DECLARE
+            first_day DATE := date_trunc('month', month)::date;
+            next_month DATE := (date_trunc('month', month) + INTERVAL '1 month')::date;
+            partition TEXT := 'survey_responses_' || to_char(first_day, '"y"YYYY"m"MM');
+        BEGIN
+            IF to_regclass(partition) IS NOT NULL THEN
+                RETURN partition;
+            END IF;
+            CREATE TEMPORARY TABLE survey_responses_moved ON COMMIT DROP AS
+                SELECT * FROM survey_responses_default WHERE session_date >= first_day AND session_date < next_month;
+            DELETE FROM survey_responses_default WHERE session_date >= first_day AND session_date < next_month;
+            EXECUTE format('CREATE TABLE %I PARTITION OF survey_responses FOR VALUES FROM (%L) TO (%L)', partition, first_day, next_month);
+            INSERT INTO survey_responses SELECT * FROM survey_responses_moved;
+            DROP TABLE survey_responses_moved;
+            RETURN partition;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        SELECT survey_responses_ensure_partition(month::date)
+        FROM (
+            SELECT DISTINCT date_trunc('month', s.created_at) AS month
+            FROM survey_responses_unpartitioned r JOIN survey_sessions s ON s.session_id = r.session_id
+        ) months
+        """,
+        # Duplicate answers to a question keep the latest
+        """
+        INSERT INTO survey_responses (id, session_id, question_key, question_label, question_type, answer, options, created_at, updated_at, session_date)
+        SELECT DISTINCT ON (r.session_id, r.question_key)
+            r.id, r.session_id, r.question_key, r.question_label, r.question_type, r.answer, r.options,
+            COALESCE(r.created_at, s.created_at), COALESCE(r.updated_at, r.created_at, s.created_at), s.created_at::date
+        FROM survey_responses_unpartitioned r JOIN survey_sessions s ON s.session_id = r.session_id
+        ORDER BY r.session_id, r.question_key, r.id DESC
+        """,
+        "SELECT setval(pg_get_serial_sequence('survey_responses', 'id'), COALESCE((SELECT MAX(id) FROM survey_responses), 0) + 1, false)",
+        "DROP TABLE survey_responses_unpartitioned",
+    )),
+    (4, 'responses_updated_index', (
+        # Replaced answers keep their created_at, so the incremental export reads
+        # rows by updated_at (set by every insert and replacement) instead
+        "DROP INDEX IF EXISTS survey_responses_created_idx",
+        "CREATE INDEX IF NOT EXISTS survey_responses_updated_idx ON survey_responses (updated_at, id)",
+    )),
+]
+
+
+def _import_psycopg2():
+    """Import psycopg2 and the submodules this module uses into the module namespace"""
+    global psycopg2
+    if psycopg2 is None:
+        import psycopg2.extensions
+        import psycopg2.extras
+        import psycopg2.pool
+    return psycopg2
+
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _json_text(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value) if value else None
+    return value
 
 
 class SupabaseHandler:
     """Handler for Supabase database operations"""
     
-    def __init__(self):
-        """Initialize database connection parameters from environment variables"""
+    def __init__(self, min_connections: int = 1, max_connections: int = 10, health_check_interval: Optional[float] = 30.0, copy_threshold: int = 5000):
+        """
+        Initialize database connection parameters from environment variables
+        
+        Args:
+            min_connections: Connections the pool keeps open once created
+            max_connections: Upper bound on simultaneously borrowed connections
+            health_check_interval: Seconds a pooled connection may sit idle before it is
+                pinged with SELECT 1 on checkout (None disables the ping)
+            copy_threshold: Batches with at least this many rows are written with
+                COPY FROM STDIN instead of a multi-row INSERT
+        """
+        load_env()
         self.host = os.getenv('SUPABASE_HOST')
         self.port = os.getenv('SUPABASE_PORT', '6543')
         self.database = os.getenv('SUPABASE_DATABASE', 'postgres')
@@ -23,10 +257,131 @@ class SupabaseHandler:
         # Validate required environment variables
         if not all([self.host, self.user, self.password]):
             raise ValueError("Missing required Supabase environment variables. Please check your .env file.")
+        
+        if min_connections < 0 or max_connections < max(min_connections, 1):
+            raise ValueError("Pool size must satisfy 0 <= min_connections <= max_connections and max_connections >= 1")
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.health_check_interval = health_check_interval
+        self.copy_threshold = copy_threshold
+        
+        # The pool is created lazily on first use
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # ThreadedConnectionPool raises when exhausted, so borrowers wait here instead
+        self._pool_slots = threading.BoundedSemaphore(max_connections)
+        self._last_used: Dict[int, float] = {}
+        # Day ensure_partitions last succeeded on
+        self._partitions_checked_on: Optional[date] = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _get_pool(self) -> "psycopg2.pool.ThreadedConnectionPool":
+        """Create the connection pool on first use and return it"""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    try:
+                        _import_psycopg2()
+                        self._pool = psycopg2.pool.ThreadedConnectionPool(
+                            self.min_connections,
+                            self.max_connections,
+                            host=self.host,
+                            port=self.port,
+                            database=self.database,
+                            user=self.user,
+                            password=self.password
+                        )
+                    except Exception as e:
+                        metrics.inc('db_errors_total', operation='connect')
+                        logger.error("Error connecting to database", extra={'error': str(e)})
+                        raise
+        return self._pool
+    
+    def _is_healthy(self, connection) -> bool:
+        """Check that a pooled connection is still usable before handing it out"""
+        if connection.closed:
+            return False
+        if self.health_check_interval is None:
+            return True
+        idle_for = time.monotonic() - self._last_used.get(id(connection), 0.0)
+        if idle_for < self.health_check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+    
+    @contextmanager
+    def connection(self) -> Iterator["psycopg2.extensions.connection"]:
+        """
+        Borrow a connection from the pool for the duration of a with block
+        
+        Any transaction left open by the caller is rolled back before the
+        connection is returned, and connections that broke are discarded.
+        """
+        started = time.perf_counter()
+        self._pool_slots.acquire()
+        pool = None
+        connection = None
+        try:
+            pool = self._get_pool()
+            connection = pool.getconn()
+            if not self._is_healthy(connection):
+                self._last_used.pop(id(connection), None)
+                pool.putconn(connection, close=True)
+                connection = pool.getconn()
+            metrics.observe('db_connection_acquire_seconds', time.perf_counter() - started)
+            
+            yield connection
+        finally:
+            if connection is not None:
+                discard = bool(connection.closed)
+                if not discard and connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        connection.rollback()
+                    except psycopg2.Error:
+                        discard = True
+                if discard:
+                    self._last_used.pop(id(connection), None)
+                else:
+                    self._last_used[id(connection)] = time.monotonic()
+                pool.putconn(connection, close=discard)
+            self._pool_slots.release()
+    
+    def close(self):
+        """Close every pooled connection"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
+    
+    @staticmethod
+    def _record_success(operation: str, started: float, table: Optional[str] = None, rows: int = 0):
+        """Count a committed database operation and the rows it wrote"""
+        metrics.observe('db_query_seconds', time.perf_counter() - started, operation=operation)
+        if rows:
+            metrics.inc('db_rows_written_total', rows, table=table)
+    
+    @staticmethod
+    def _record_failure(operation: str, started: float, error: Exception):
+        """Count and log a failed database operation"""
+        metrics.observe('db_query_seconds', time.perf_counter() - started, operation=operation)
+        metrics.inc('db_errors_total', operation=operation)
+        logger.error("Database operation failed", extra={'operation': operation, 'error': str(error)})
     
     def get_connection(self):
-        """Create and return a database connection"""
+        """Create and return a new, unpooled database connection (prefer connection())"""
         try:
+            _import_psycopg2()
             connection = psycopg2.connect(
                 host=self.host,
                 port=self.port,
@@ -36,66 +391,128 @@ class SupabaseHandler:
             )
             return connection
         except Exception as e:
-            print(f"Error connecting to database: {e}")
+            metrics.inc('db_errors_total', operation='connect')
+            logger.error("Error connecting to database", extra={'error': str(e)})
             raise
     
-    def read_table(self, table_name: str, columns: str = "*", where_clause: str = None, limit: int = None) -> List[Dict[str, Any]]:
+    @contextmanager
+    def _server_cursor(self, query: str, params: Optional[Sequence[Any]] = None, itersize: int = 2000) -> Iterator["psycopg2.extensions.cursor"]:
+        """Run a query on a named (server-side) cursor so rows are fetched itersize at a time"""
+        with self.connection() as connection:
+            cursor = connection.cursor(name=f"stream_{uuid.uuid4().hex}")
+            cursor.itersize = itersize
+            try:
+                cursor.execute(query, params)
+                yield cursor
+            finally:
+                cursor.close()
+    
+    @staticmethod
+    def _column_converters(description) -> List[Tuple[int, Any]]:
         """
-        Read data from any table in the database
+        Pick a converter for each column that read_table reformats, based on its type OID
+        
+        Timestamps become ISO strings; JSON and array values are serialized back
+        to JSON text (empty ones become None). Other columns are left untouched.
+        """
+        converters = []
+        for i, column in enumerate(description):
+            type_code = column.type_code
+            caster = psycopg2.extensions.string_types.get(type_code)
+            name = caster.name if caster is not None else ''
+            if type_code in DATETIME_TYPE_OIDS:
+                converters.append((i, _isoformat))
+            elif type_code in JSON_TYPE_OIDS or name.endswith('ARRAY'):
+                converters.append((i, _json_text))
+        return converters
+    
+    def iter_table(self, table_name: str, columns: Union[str, Sequence[str]] = "*", where_clause: str = None, limit: int = None, params: Optional[Sequence[Any]] = None, order_by: Optional[str] = None, itersize: int = 2000, row_mode: str = 'dict', convert: bool = True, group_by: Optional[str] = None) -> Iterator[Any]:
+        """
+        Stream rows from any table through a server-side cursor
+        
+        Only itersize rows are held in memory at a time, so exports of any size
+        run in constant memory. The pooled connection is held until the
+        generator is exhausted or closed.
         
         Args:
             table_name: Name of the table to read from
-            columns: Columns to select (default: "*")
+            columns: Columns to select, as a SQL string or a list of column names (default: "*")
             where_clause: Optional WHERE clause (without the WHERE keyword)
             limit: Optional limit on number of rows
+            params: Optional query parameters for %s placeholders in where_clause
+            order_by: Optional ORDER BY clause (without the ORDER BY keywords)
+            itersize: Rows fetched from the server per round trip
+            row_mode: 'dict', 'tuple' or 'namedtuple'
+            convert: Apply read_table's conversions (ISO timestamps, JSON text); False yields raw values
+            group_by: Optional GROUP BY clause (without the GROUP BY keywords) for aggregate queries
             
-        Returns:
-            List of dictionaries containing the table data
+        Yields:
+            One row per result in the requested row mode
         """
-        connection = self.get_connection()
-        cursor = connection.cursor()
+        if row_mode not in ROW_MODES:
+            raise ValueError(f"row_mode must be one of {ROW_MODES}, got {row_mode!r}")
+        if not isinstance(columns, str):
+            columns = ", ".join(columns)
         
-        try:
-            # Build the query
-            query = f"SELECT {columns} FROM {table_name}"
-            params = []
-            
-            if where_clause:
-                query += f" WHERE {where_clause}"
-            
-            if limit:
-                query += f" LIMIT {limit}"
-            
-            cursor.execute(query, params)
-            
-            # Get column names
+        # Build the query
+        query = f"SELECT {columns} FROM {table_name}"
+        
+        if where_clause:
+            query += f" WHERE {where_clause}"
+        
+        if group_by:
+            query += f" GROUP BY {group_by}"
+        
+        if order_by:
+            query += f" ORDER BY {order_by}"
+        
+        if limit:
+            query += f" LIMIT {limit}"
+        
+        with self._server_cursor(query, params, itersize) as cursor:
+            rows = cursor.fetchmany(itersize)
+            # Named cursors only describe their columns after the first fetch
+            if cursor.description is None:
+                return
             column_names = [desc[0] for desc in cursor.description]
+            converters = self._column_converters(cursor.description) if convert else []
+            row_type = namedtuple('Row', column_names, rename=True) if row_mode == 'namedtuple' else None
             
-            # Fetch all rows and convert to list of dictionaries
-            rows = cursor.fetchall()
-            result = []
-            
-            for row in rows:
-                row_dict = {}
-                for i, value in enumerate(row):
-                    # Handle different data types
-                    if isinstance(value, datetime):
-                        row_dict[column_names[i]] = value.isoformat()
-                    elif isinstance(value, (dict, list)):
-                        row_dict[column_names[i]] = json.dumps(value) if value else None
+            while rows:
+                for row in rows:
+                    if converters:
+                        row = list(row)
+                        for i, converter in converters:
+                            row[i] = converter(row[i])
+                    if row_mode == 'dict':
+                        yield dict(zip(column_names, row))
+                    elif row_mode == 'namedtuple':
+                        yield row_type._make(row)
                     else:
-                        row_dict[column_names[i]] = value
-                result.append(row_dict)
+                        yield tuple(row)
+                rows = cursor.fetchmany(itersize)
+    
+    def read_table(self, table_name: str, columns: str = "*", where_clause: str = None, limit: int = None) -> List[Dict[str, Any]]:
+        """
+        Read data from any table in the database
+        
+        Args:
+            table_name: Name of the table to read from
+            columns: Columns to select (default: "*")
+            where_clause: Optional WHERE clause (without the WHERE keyword)
+            limit: Optional limit on number of rows
             
-            print(f"Successfully read {len(result)} rows from table '{table_name}'")
+        Returns:
+            List of dictionaries containing the table data (use iter_table to stream instead)
+        """
+        try:
+            result = list(self.iter_table(table_name, columns, where_clause, limit))
+            logger.info("Read table", extra={'table': table_name, 'rows': len(result)})
             return result
-            
         except Exception as e:
-            print(f"Error reading from table '{table_name}': {e}")
+            metrics.inc('db_errors_total', operation='read_table')
+            logger.error("Error reading table", extra={'table': table_name, 'error': str(e)})
             return []
-        finally:
-            cursor.close()
-            connection.close()
     
     def read_star_wars_test1(self) -> List[Dict[str, Any]]:
         """
@@ -106,54 +523,127 @@ class SupabaseHandler:
         """
         return self.read_table('StarWarsTest1')
     
-    def create_tables_if_not_exist(self):
-        """Create necessary tables if they don't exist"""
-        connection = self.get_connection()
-        cursor = connection.cursor()
+    def migrate(self, target_version: Optional[int] = None) -> List[int]:
+        """
+        Apply the MIGRATIONS this database has not had yet, in order
         
-        try:
-            # Create survey_responses table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS survey_responses (
-                    id SERIAL PRIMARY KEY,
-                    session_id VARCHAR(255) NOT NULL,
-                    question_key VARCHAR(255) NOT NULL,
-                    question_label TEXT NOT NULL,
-                    question_type VARCHAR(50) NOT NULL,
-                    answer TEXT NOT NULL,
-                    options JSONB,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+        Each migration runs in its own transaction under an advisory lock, so
+        workers starting at the same time apply it once and wait for each other.
+        Afterwards the survey_responses partitions for the coming months are
+        created.
+        
+        Args:
+            target_version: Stop after this version (default: apply all)
             
-            # Create survey_sessions table to track complete survey sessions
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS survey_sessions (
-                    id SERIAL PRIMARY KEY,
-                    session_id VARCHAR(255) UNIQUE NOT NULL,
-                    total_questions INTEGER DEFAULT 0,
-                    completed_questions INTEGER DEFAULT 0,
-                    status VARCHAR(50) DEFAULT 'in_progress',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    completed_at TIMESTAMP
-                )
-            """)
+        Returns:
+            List[int]: Versions applied by this call
+        """
+        applied = []
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            started = time.perf_counter()
             
-            connection.commit()
-            print("Database tables created/verified successfully")
+            try:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        name VARCHAR(255) NOT NULL,
+                        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                connection.commit()
+                
+                for version, name, statements in MIGRATIONS:
+                    if target_version is not None and version > target_version:
+                        break
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+                    cursor.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+                    if cursor.fetchone():
+                        connection.commit()
+                        continue
+                    for statement in statements:
+                        cursor.execute(statement)
+                    cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                    connection.commit()
+                    applied.append(version)
+                    logger.info("Applied schema migration", extra={'version': version, 'migration': name})
+                
+                self._record_success('migrate', started)
+                
+            except Exception as e:
+                connection.rollback()
+                self._record_failure('migrate', started, e)
+                raise
+            finally:
+                cursor.close()
+        
+        if self.schema_version() >= 3:
+            self.ensure_partitions()
+        return applied
+    
+    def schema_version(self) -> int:
+        """
+        The latest migration applied to the database
+        
+        Returns:
+            int: Version number, 0 for a database without schema_migrations
+        """
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+                if not cursor.fetchone()[0]:
+                    return 0
+                cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+                return cursor.fetchone()[0]
+            finally:
+                connection.rollback()
+                cursor.close()
+    
+    def ensure_partitions(self, months_ahead: int = PARTITION_MONTHS_AHEAD) -> bool:
+        """
+        Create the survey_responses partitions for this month and the next months_ahead
+        
+        Called by migrate and, once a day, by the write methods, so a session
+        starting in a new month never lands in the default partition.
+        
+        Args:
+            months_ahead: Months after the current one to create partitions for
             
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        started = time.perf_counter()
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+                cursor.execute("""
+                    SELECT survey_responses_ensure_partition((CURRENT_DATE + make_interval(months => offset_months))::date)
+                    FROM generate_series(0, %s) AS offset_months
+                """, (months_ahead,))
+                connection.commit()
+                self._partitions_checked_on = date.today()
+                self._record_success('ensure_partitions', started)
+                return True
+                
         except Exception as e:
-            connection.rollback()
-            print(f"Error creating tables: {e}")
-            raise
-        finally:
-            cursor.close()
-            connection.close()
+            self._record_failure('ensure_partitions', started, e)
+            return False
+    
+    def _ensure_current_partitions(self):
+        """Run ensure_partitions on the first write of each day"""
+        if self._partitions_checked_on != date.today():
+            self.ensure_partitions()
+    
+    def create_tables_if_not_exist(self):
+        """Create or upgrade the tables to the latest schema (see migrate)"""
+        self.migrate()
+        logger.info("Database tables created/verified")
     
     def insert_survey_response(self, session_id: str, question_obj: Dict[str, Any], answer: str) -> bool:
         """
-        Insert a single survey response into the database
+        Insert or replace a single survey response
         
         Args:
             session_id: Unique identifier for the survey session
@@ -163,49 +653,26 @@ class SupabaseHandler:
         Returns:
             bool: True if successful, False otherwise
         """
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        
+        started = time.perf_counter()
         try:
-            # Insert the response
-            cursor.execute("""
-                INSERT INTO survey_responses 
-                (session_id, question_key, question_label, question_type, answer, options)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                session_id,
-                question_obj.get('key'),
-                question_obj.get('label'),
-                question_obj.get('type'),
-                answer,
-                json.dumps(question_obj.get('options', []))
-            ))
-            
-            # Update or create session record
-            cursor.execute("""
-                INSERT INTO survey_sessions (session_id, total_questions, completed_questions, status)
-                VALUES (%s, 1, 1, 'in_progress')
-                ON CONFLICT (session_id) 
-                DO UPDATE SET 
-                    completed_questions = survey_sessions.completed_questions + 1,
-                    updated_at = CURRENT_TIMESTAMP
-            """, (session_id,))
-            
-            connection.commit()
-            print(f"Successfully inserted response for question: {question_obj.get('key')}")
-            return True
-            
+            self._ensure_current_partitions()
+            with self.connection() as connection, connection.cursor() as cursor:
+                self._upsert_sessions(cursor, {session_id: 1})
+                inserted = self._write_response_rows(cursor, [self._response_row(session_id, question_obj, answer)])
+                self._count_completed(cursor, inserted)
+                
+                connection.commit()
+                self._record_success('insert_survey_response', started, 'survey_responses', 1)
+                logger.debug("Inserted response", extra={'session_id': session_id, 'question_key': question_obj.get('key'), 'sample': True})
+                return True
+                
         except Exception as e:
-            connection.rollback()
-            print(f"Error inserting survey response: {e}")
+            self._record_failure('insert_survey_response', started, e)
             return False
-        finally:
-            cursor.close()
-            connection.close()
     
     def insert_multiple_responses(self, session_id: str, responses: List[Dict[str, Any]]) -> bool:
         """
-        Insert multiple survey responses in a single transaction
+        Insert or replace the responses of a completed session in a single transaction
         
         Args:
             session_id: Unique identifier for the survey session
@@ -214,92 +681,376 @@ class SupabaseHandler:
         Returns:
             bool: True if successful, False otherwise
         """
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        
+        started = time.perf_counter()
         try:
-            # Insert all responses
-            for response in responses:
-                question_obj = response['question']
-                answer = response['answer']
-                
+            self._ensure_current_partitions()
+            with self.connection() as connection, connection.cursor() as cursor:
+                self._upsert_sessions(cursor, {session_id: len(responses)})
+                self._write_response_rows(cursor, [
+                    self._response_row(session_id, response['question'], response['answer'])
+                    for response in responses
+                ])
                 cursor.execute("""
-                    INSERT INTO survey_responses 
-                    (session_id, question_key, question_label, question_type, answer, options)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
-                    session_id,
-                    question_obj.get('key'),
-                    question_obj.get('label'),
-                    question_obj.get('type'),
-                    answer,
-                    json.dumps(question_obj.get('options', []))
-                ))
-            
-            # Update session record
-            cursor.execute("""
-                INSERT INTO survey_sessions (session_id, total_questions, completed_questions, status)
-                VALUES (%s, %s, %s, 'completed')
-                ON CONFLICT (session_id) 
-                DO UPDATE SET 
-                    completed_questions = %s,
-                    status = 'completed',
-                    completed_at = CURRENT_TIMESTAMP,
+                    UPDATE survey_sessions
+                    SET completed_questions = %s,
+                        status = 'completed',
+                        completed_at = CURRENT_TIMESTAMP,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE session_id = %s
+                """, (len(responses), session_id))
+                
+                connection.commit()
+                self._record_success('insert_multiple_responses', started, 'survey_responses', len(responses))
+                logger.info("Inserted responses", extra={'session_id': session_id, 'responses': len(responses), 'sample': True})
+                return True
+                
+        except Exception as e:
+            self._record_failure('insert_multiple_responses', started, e)
+            return False
+    
+    @staticmethod
+    def _response_row(session_id: str, question_obj: Dict[str, Any], answer: Any) -> Tuple:
+        """Build a survey_responses row in RESPONSE_COLUMNS order"""
+        return (
+            session_id,
+            question_obj.get('key'),
+            question_obj.get('label'),
+            question_obj.get('type'),
+            answer,
+            json.dumps(question_obj.get('options', []))
+        )
+    
+    @staticmethod
+    def _upsert_sessions(cursor, counts: Dict[str, int]):
+        """
+        Make sure a survey_sessions row exists for every session about to get responses
+        
+        New sessions start with total_questions set to their count. The rows
+        are locked in sorted order, so concurrent writers of the same sessions
+        queue up instead of deadlocking.
+        """
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO survey_sessions (session_id, total_questions, completed_questions, status)
+            VALUES %s
+            ON CONFLICT (session_id)
+            DO UPDATE SET updated_at = CURRENT_TIMESTAMP
+        """, [
+            (session_id, count, 0, 'in_progress')
+            for session_id, count in sorted(counts.items())
+        ], page_size=len(counts))
+    
+    @staticmethod
+    def _count_completed(cursor, inserted: Dict[str, int]):
+        """Add newly inserted responses to the sessions' completed_questions"""
+        if not inserted:
+            return
+        psycopg2.extras.execute_values(cursor, """
+            UPDATE survey_sessions s
+            SET completed_questions = s.completed_questions + v.inserted,
+                updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v (session_id, inserted)
+            WHERE s.session_id = v.session_id
+        """, sorted(inserted.items()), page_size=len(inserted))
+    
+    def _write_response_rows(self, cursor, rows: Sequence[Tuple]) -> Counter:
+        """
+        Upsert survey_responses rows with a single statement on the given cursor
+        
+        Rows go to the partition of their session's start date, so the sessions
+        must already exist (see _upsert_sessions). An answer to a question the
+        session already answered replaces the stored one, as does a later
+        duplicate within rows. Batches below copy_threshold are sent inline by
+        execute_values; larger batches are streamed with COPY FROM STDIN into a
+        temporary table and upserted from there.
+        
+        Returns:
+            Counter: Newly inserted (not replaced) rows per session id
+        """
+        if not rows:
+            return Counter()
+        # Only the last answer to a question within the batch is kept
+        rows = list({(row[0], row[1]): row for row in rows}.values())
+        columns = ", ".join(RESPONSE_COLUMNS)
+        # The INSERT skips answered questions and returns the new rows; the UPDATE
+        # runs on the statement's snapshot, so it only replaces rows stored before.
+        # (RETURNING xmax cannot tell the two apart on a partitioned table.)
+        upsert = f"""
+            WITH v ({columns}) AS ({{source}}),
+            inserted AS (
+                INSERT INTO survey_responses ({columns}, session_date)
+                SELECT {", ".join(f"v.{column}" for column in RESPONSE_COLUMNS[:-1])}, v.options::jsonb, s.created_at::date
+                FROM v JOIN survey_sessions s ON s.session_id = v.session_id
+                ON CONFLICT (session_date, session_id, question_key) DO NOTHING
+                RETURNING session_id
+            ),
+            replaced AS (
+                UPDATE survey_responses r
+                SET question_label = v.question_label,
+                    question_type = v.question_type,
+                    answer = v.answer,
+                    options = v.options::jsonb,
                     updated_at = CURRENT_TIMESTAMP
-            """, (session_id, len(responses), len(responses), len(responses)))
+                FROM v JOIN survey_sessions s ON s.session_id = v.session_id
+                WHERE r.session_date = s.created_at::date
+                    AND r.session_id = v.session_id
+                    AND r.question_key = v.question_key
+            )
+            SELECT session_id FROM inserted
+        """
+        if len(rows) >= self.copy_threshold:
+            cursor.execute("""
+                CREATE TEMPORARY TABLE responses_staging (
+                    session_id VARCHAR(255), question_key VARCHAR(255), question_label TEXT,
+                    question_type VARCHAR(50), answer TEXT, options TEXT
+                ) ON COMMIT DROP
+            """)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerows(rows)
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY responses_staging ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+            cursor.execute(upsert.format(source=f"SELECT {columns} FROM responses_staging"))
+            returned = cursor.fetchall()
+        else:
+            returned = psycopg2.extras.execute_values(
+                cursor,
+                upsert.format(source="VALUES %s"),
+                rows,
+                template="(%s, %s, %s, %s, %s::text, %s)",
+                page_size=len(rows),
+                fetch=True
+            )
+        return Counter(session_id for session_id, in returned)
+    
+    def bulk_insert_responses(self, responses: List[Dict[str, Any]]) -> bool:
+        """
+        Insert responses from any number of sessions in a single transaction
+        
+        All rows are sent in one bulk statement and each session's counters
+        are updated once, however many of its answers are in the batch. The
+        write is idempotent: responses already stored (e.g. a batch replayed
+        after a crash) are replaced and not counted again.
+        
+        Args:
+            responses: List of dictionaries with 'session_id', 'question' and 'answer' keys
             
-            connection.commit()
-            print(f"Successfully inserted {len(responses)} responses for session: {session_id}")
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not responses:
             return True
-            
+        
+        started = time.perf_counter()
+        try:
+            self._ensure_current_partitions()
+            with self.connection() as connection, connection.cursor() as cursor:
+                counts = Counter(response['session_id'] for response in responses)
+                self._upsert_sessions(cursor, counts)
+                inserted = self._write_response_rows(cursor, [
+                    self._response_row(response['session_id'], response['question'], response['answer'])
+                    for response in responses
+                ])
+                self._count_completed(cursor, inserted)
+                
+                connection.commit()
+                self._record_success('bulk_insert_responses', started, 'survey_responses', len(responses))
+                logger.info("Inserted responses", extra={'responses': len(responses), 'sessions': len(counts), 'sample': True})
+                return True
+                
         except Exception as e:
-            connection.rollback()
-            print(f"Error inserting multiple responses: {e}")
+            self._record_failure('bulk_insert_responses', started, e)
             return False
-        finally:
-            cursor.close()
-            connection.close()
     
-    def get_session_responses(self, session_id: str) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _usage_values(usage: TokenUsage) -> Tuple:
+        """A TokenUsage in USAGE_COLUMNS order"""
+        return (usage.requests, usage.prompt_tokens, usage.cached_tokens, usage.completion_tokens, round(usage.cost_usd, 6))
+    
+    def add_session_usage(self, usage: Dict[str, TokenUsage]) -> bool:
         """
-        Retrieve all responses for a specific session
+        Add token counts and cost to the totals of any number of sessions in one statement
         
         Args:
-            session_id: Unique identifier for the survey session
+            usage: Session id -> TokenUsage to add
             
         Returns:
-            List of response dictionaries
+            bool: True if successful, False otherwise
+        """
+        if not usage:
+            return True
+        
+        columns = ", ".join(USAGE_COLUMNS)
+        updates = ", ".join(f"{column} = survey_sessions.{column} + EXCLUDED.{column}" for column in USAGE_COLUMNS)
+        started = time.perf_counter()
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                # Sorted so concurrent writers lock session rows in the same order
+                psycopg2.extras.execute_values(cursor, f"""
+                    INSERT INTO survey_sessions (session_id, {columns})
+                    VALUES %s
+                    ON CONFLICT (session_id)
+                    DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP
+                """, [
+                    (session_id,) + self._usage_values(session_usage)
+                    for session_id, session_usage in sorted(usage.items())
+                ], page_size=len(usage))
+                connection.commit()
+                self._record_success('add_session_usage', started)
+                return True
+                
+        except Exception as e:
+            self._record_failure('add_session_usage', started, e)
+            return False
+    
+    def add_run_usage(self, run_id: str, model: str, usage: TokenUsage) -> bool:
         """
-        connection = self.get_connection()
-        cursor = connection.cursor()
+        Add token counts and cost to the totals of a run in survey_runs
         
+        Args:
+            run_id: Identifier of the run, e.g. a farm run id or a batch id
+            model: OpenAI model the run used
+            usage: TokenUsage to add
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        columns = ", ".join(USAGE_COLUMNS)
+        updates = ", ".join(f"{column} = survey_runs.{column} + EXCLUDED.{column}" for column in USAGE_COLUMNS)
+        started = time.perf_counter()
         try:
-            cursor.execute("""
-                SELECT question_key, question_label, question_type, answer, options, created_at
-                FROM survey_responses 
-                WHERE session_id = %s 
-                ORDER BY created_at
-            """, (session_id,))
+            with self.connection() as connection, connection.cursor() as cursor:
+                cursor.execute(f"""
+                    INSERT INTO survey_runs (run_id, model, {columns})
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (run_id)
+                    DO UPDATE SET {updates}, model = EXCLUDED.model, updated_at = CURRENT_TIMESTAMP
+                """, (run_id, model) + self._usage_values(usage))
+                connection.commit()
+                self._record_success('add_run_usage', started)
+                return True
+                
+        except Exception as e:
+            self._record_failure('add_run_usage', started, e)
+            return False
+    
+    def store_population(self, run_id: str, population, session_ids: Sequence[str]) -> bool:
+        """
+        Store a persona population: its seed and config, and one survey_personas row per session
+        
+        Rows are streamed with COPY into a temporary table and inserted from
+        there, so storing the population of a resumed run again is a no-op.
+        A run that already has a population with another seed, size or config
+        fails instead, since its personas could no longer be reproduced.
+        
+        Args:
+            run_id: Run the population belongs to
+            population: persona_population.PersonaPopulation
+            session_ids: Session id of each persona, in population order
             
-            responses = []
-            for row in cursor.fetchall():
-                responses.append({
-                    'question_key': row[0],
-                    'question_label': row[1],
-                    'question_type': row[2],
-                    'answer': row[3],
-                    'options': json.loads(row[4]) if row[4] else [],
-                    'created_at': row[5].isoformat() if row[5] else None
-                })
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        started = time.perf_counter()
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                config = json.dumps(population.config)
+                cursor.execute("""
+                    INSERT INTO survey_populations (run_id, seed, size, config)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (run_id) DO NOTHING
+                """, (run_id, population.seed, len(population), config))
+                cursor.execute("SELECT seed, size, config::text FROM survey_populations WHERE run_id = %s", (run_id,))
+                if cursor.fetchone() != (population.seed, len(population), config):
+                    raise ValueError(f"Run '{run_id}' already has a population with a different seed, size or config")
+                
+                cursor.execute("""
+                    CREATE TEMPORARY TABLE personas_staging (
+                        session_id VARCHAR(255), persona_index INTEGER, attributes JSONB
+                    ) ON COMMIT DROP
+                """)
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(population.to_rows(session_ids))
+                buffer.seek(0)
+                cursor.copy_expert("COPY personas_staging (session_id, persona_index, attributes) FROM STDIN WITH (FORMAT csv)", buffer)
+                cursor.execute("""
+                    INSERT INTO survey_personas (session_id, run_id, persona_index, attributes)
+                    SELECT session_id, %s, persona_index, attributes FROM personas_staging
+                    ON CONFLICT (session_id) DO NOTHING
+                """, (run_id,))
+                
+                connection.commit()
+                self._record_success('store_population', started, 'survey_personas', len(population))
+                logger.info("Stored population", extra={'run_id': run_id, 'personas': len(population)})
+                return True
+                
+        except Exception as e:
+            self._record_failure('store_population', started, e)
+            return False
+    
+    def iter_session_responses(self, session_id: str, itersize: int = 2000, row_mode: str = 'dict', convert: bool = True) -> Iterator[Any]:
+        """
+        Stream the responses of a session in creation order through a server-side cursor
+        
+        Args:
+            session_id: Unique identifier for the survey session
+            itersize: Rows fetched from the server per round trip
+            row_mode: 'dict', 'tuple' or 'namedtuple'
+            convert: Turn created_at into an ISO string and missing options into []; False yields raw values
             
-            return responses
+        Yields:
+            One response per row with question_key, question_label, question_type, answer, options and created_at
+        """
+        rows = self.iter_table(
+            'survey_responses',
+            SESSION_RESPONSE_COLUMNS,
+            # The session's start date prunes the scan to the partition holding its answers
+            where_clause="session_id = %s AND session_date = (SELECT created_at::date FROM survey_sessions WHERE session_id = %s)",
+            params=(session_id, session_id),
+            order_by="created_at",
+            itersize=itersize,
+            row_mode='tuple' if convert else row_mode,
+            convert=False
+        )
+        if not convert:
+            yield from rows
+            return
+        
+        row_type = namedtuple('Row', SESSION_RESPONSE_COLUMNS) if row_mode == 'namedtuple' else None
+        for question_key, question_label, question_type, answer, options, created_at in rows:
+            # JSONB arrives already decoded; older rows may hold JSON text
+            if isinstance(options, str):
+                options = json.loads(options)
+            row = (
+                question_key,
+                question_label,
+                question_type,
+                answer,
+                options or [],
+                created_at.isoformat() if created_at else None
+            )
+            if row_mode == 'dict':
+                yield dict(zip(SESSION_RESPONSE_COLUMNS, row))
+            elif row_mode == 'namedtuple':
+                yield row_type._make(row)
+            else:
+                yield row
+    
+    def get_session_responses(self, session_id: str) -> List[Dict[str, Any]]:
+        """
+        Retrieve all responses for a specific session
+        
+        Args:
+            session_id: Unique identifier for the survey session
             
+        Returns:
+            List of response dictionaries (use iter_session_responses to stream instead)
+        """
+        try:
+            return list(self.iter_session_responses(session_id))
         except Exception as e:
-            print(f"Error retrieving session responses: {e}")
+            metrics.inc('db_errors_total', operation='get_session_responses')
+            logger.error("Error retrieving session responses", extra={'session_id': session_id, 'error': str(e)})
             return []
-        finally:
-            cursor.close()
-            connection.close()
     
     def get_session_summary(self, session_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -311,34 +1062,38 @@ class SupabaseHandler:
         Returns:
             Dictionary with session summary or None if not found
         """
-        connection = self.get_connection()
-        cursor = connection.cursor()
-        
-        try:
-            cursor.execute("""
-                SELECT total_questions, completed_questions, status, created_at, completed_at
-                FROM survey_sessions 
-                WHERE session_id = %s
-            """, (session_id,))
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            started = time.perf_counter()
             
-            row = cursor.fetchone()
-            if row:
-                return {
-                    'session_id': session_id,
-                    'total_questions': row[0],
-                    'completed_questions': row[1],
-                    'status': row[2],
-                    'created_at': row[3].isoformat() if row[3] else None,
-                    'completed_at': row[4].isoformat() if row[4] else None
-                }
-            return None
-            
-        except Exception as e:
-            print(f"Error retrieving session summary: {e}")
-            return None
-        finally:
-            cursor.close()
-            connection.close()
+            try:
+                cursor.execute(f"""
+                    SELECT total_questions, completed_questions, status, created_at, completed_at, {", ".join(USAGE_COLUMNS)}
+                    FROM survey_sessions 
+                    WHERE session_id = %s
+                """, (session_id,))
+                
+                row = cursor.fetchone()
+                self._record_success('get_session_summary', started)
+                if row:
+                    summary = {
+                        'session_id': session_id,
+                        'total_questions': row[0],
+                        'completed_questions': row[1],
+                        'status': row[2],
+                        'created_at': row[3].isoformat() if row[3] else None,
+                        'completed_at': row[4].isoformat() if row[4] else None
+                    }
+                    summary.update(zip(USAGE_COLUMNS, row[5:]))
+                    summary['cost_usd'] = float(summary['cost_usd'])
+                    return summary
+                return None
+                
+            except Exception as e:
+                self._record_failure('get_session_summary', started, e)
+                return None
+            finally:
+                cursor.close()
 
 
 # Example usage:
@@ -349,7 +1104,7 @@ class SupabaseHandler:
 # 
 # # Initialize database handler
 # db_handler = SupabaseHandler()
-# db_handler.create_tables_if_not_exist()
+# db_handler.migrate()  # creates or upgrades the schema
 # 
 # # Convert YAML to questions
 # questions = convert_yaml_to_json_objects('sample_q.yml')
@@ -0,0 +1,327 @@
+import json
+from typing import Dict, Any, Iterable, List, Optional, Sequence
+from supabase_handler import SupabaseHandler
+
+# numpy is optional; install it with `uv sync --extra analysis`
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Answers that parse as numbers, used by the SQL push-down for slider statistics
+NUMERIC_ANSWER_PATTERN = r'^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$'
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy is required for analytics. Install it with `uv sync --extra analysis`.")
+
+
+def _option_strings(options: Optional[Sequence[Any]]) -> List[str]:
+    """Options as the strings answers are stored as in survey_responses"""
+    return [option if isinstance(option, str) else str(option) for option in (options or [])]
+
+
+class EncodedResponses:
+    """
+    Answers of many sessions encoded as integer option indices.
+
+    codes[i, j] is the index of session i's answer to question keys[j] in
+    options[keys[j]], or -1 when the session has no answer to that question
+    or the answer is not one of the options.
+    """
+
+    def __init__(self, session_ids: "np.ndarray", keys: List[str], options: Dict[str, List[str]], codes: "np.ndarray"):
+        self.session_ids = session_ids
+        self.keys = keys
+        self.options = options
+        self.codes = codes
+        self.column = {key: j for j, key in enumerate(keys)}
+
+    def __len__(self) -> int:
+        return len(self.session_ids)
+
+    def question_codes(self, key: str) -> "np.ndarray":
+        """Option indices of every session for one question (-1 = missing)"""
+        return self.codes[:, self.column[key]]
+
+    @classmethod
+    def from_arrays(cls, session_ids: Sequence[str], question_keys: Sequence[str], answers: Sequence[Any], options: Dict[str, Sequence[Any]]) -> "EncodedResponses":
+        """
+        Encode long-format responses (one entry per answer)
+
+        Args:
+            session_ids: Session of each answer
+            question_keys: Question of each answer
+            answers: Answer text of each answer
+            options: Option list per question key; questions without one are skipped
+        """
+        _require_numpy()
+        session_ids = np.asarray(session_ids, dtype=object).astype(str)
+        question_keys = np.asarray(question_keys, dtype=object).astype(str)
+        answers = np.asarray([a if isinstance(a, str) else str(a) for a in answers], dtype=object).astype(str)
+
+        sessions, row = np.unique(session_ids, return_inverse=True)
+        keys = [key for key in options if options[key]]
+        option_strings = {key: _option_strings(options[key]) for key in keys}
+        codes = np.full((len(sessions), len(keys)), -1, dtype=np.int32)
+
+        for j, key in enumerate(keys):
+            mask = question_keys == key
+            if not mask.any():
+                continue
+            values = answers[mask]
+            choices = np.asarray(option_strings[key], dtype=str)
+            # Binary search over the sorted options maps every answer at once
+            order = np.argsort(choices, kind='stable')
+            sorted_choices = choices[order]
+            position = np.clip(np.searchsorted(sorted_choices, values), 0, len(choices) - 1)
+            matched = sorted_choices[position] == values
+            codes[row[mask], j] = np.where(matched, order[position], -1)
+
+        return cls(sessions, keys, option_strings, codes)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence[Any]], options: Optional[Dict[str, Sequence[Any]]] = None) -> "EncodedResponses":
+        """
+        Encode (session_id, question_key, answer, options) rows, e.g. from SupabaseHandler.iter_table
+
+        Option lists come from the options argument when given (such as a
+        QuestionPlan's questions) and otherwise from the first row of each question.
+        """
+        session_ids, question_keys, answers = [], [], []
+        found_options = dict(options or {})
+        for session_id, question_key, answer, row_options in rows:
+            session_ids.append(session_id)
+            question_keys.append(question_key)
+            answers.append(answer)
+            if question_key not in found_options:
+                if isinstance(row_options, str):
+                    row_options = json.loads(row_options)
+                found_options[question_key] = row_options or []
+        return cls.from_arrays(session_ids, question_keys, answers, found_options)
+
+    @classmethod
+    def from_parquet(cls, path: str) -> "EncodedResponses":
+        """Load a wide dataset written by response_export.export_responses_to_parquet"""
+        _require_numpy()
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        # Files written from different session groups may hold different questions,
+        # so read with the union of their schemas rather than the first file's
+        dataset = ds.dataset(path, partitioning='hive')
+        schema = pa.unify_schemas([dataset.schema] + [fragment.physical_schema for fragment in dataset.get_fragments()])
+        # Unify chunk dictionaries so an index means the same option in every file
+        table = ds.dataset(path, schema=schema, partitioning='hive').to_table().unify_dictionaries()
+        keys, options, columns = [], {}, []
+        for name in table.column_names:
+            column = table.column(name)
+            if not pa.types.is_dictionary(column.type):
+                continue
+            combined = column.combine_chunks()
+            keys.append(name)
+            options[name] = combined.dictionary.to_pylist()
+            columns.append(combined.indices.fill_null(-1).to_numpy(zero_copy_only=False).astype(np.int32))
+        codes = np.column_stack(columns) if columns else np.empty((table.num_rows, 0), dtype=np.int32)
+        session_ids = np.asarray(table.column('session_id').to_pylist(), dtype=str)
+        return cls(session_ids, keys, options, codes)
+
+
+def load_responses(handler: SupabaseHandler, question_keys: Optional[Sequence[str]] = None, options: Optional[Dict[str, Sequence[Any]]] = None, itersize: int = 50_000) -> EncodedResponses:
+    """
+    Stream responses from the database and encode them
+
+    Args:
+        handler: Database handler to read from
+        question_keys: Optional subset of questions to load
+        options: Optional option lists per question key (defaults to the stored options)
+        itersize: Rows fetched per round trip
+    """
+    rows = handler.iter_table(
+        'survey_responses',
+        ['session_id', 'question_key', 'answer', 'options'],
+        where_clause="question_key = ANY(%s)" if question_keys else None,
+        params=(list(question_keys),) if question_keys else None,
+        itersize=itersize,
+        row_mode='tuple',
+        convert=False
+    )
+    return EncodedResponses.from_rows(rows, options)
+
+
+def answer_distribution(encoded: EncodedResponses, key: str, normalize: bool = False) -> Dict[str, float]:
+    """Count (or share) of sessions choosing each option of one question"""
+    codes = encoded.question_codes(key)
+    counts = np.bincount(codes[codes >= 0], minlength=len(encoded.options[key]))
+    if normalize:
+        total = counts.sum()
+        counts = counts / total if total else counts.astype(float)
+    return dict(zip(encoded.options[key], counts.tolist()))
+
+
+def all_distributions(encoded: EncodedResponses, normalize: bool = False) -> Dict[str, Dict[str, float]]:
+    """answer_distribution for every encoded question"""
+    return {key: answer_distribution(encoded, key, normalize) for key in encoded.keys}
+
+
+def numeric_stats(encoded: EncodedResponses, keys: Optional[Sequence[str]] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Mean, sample variance, standard deviation and count of numeric (e.g. slider_numeric) questions
+
+    Computed for all requested questions at once over a NaN-masked value matrix.
+    Questions whose options are not all numeric are skipped.
+    """
+    if keys is None:
+        keys = encoded.keys
+    numeric_keys, lookups = [], []
+    for key in keys:
+        try:
+            lookups.append(np.asarray([float(option) for option in encoded.options[key]] + [np.nan]))
+            numeric_keys.append(key)
+        except ValueError:
+            continue
+    if not numeric_keys:
+        return {}
+
+    # Index -1 (missing) lands on the trailing NaN of each lookup table
+    values = np.column_stack([
+        lookup[encoded.question_codes(key)] for key, lookup in zip(numeric_keys, lookups)
+    ])
+    counts = np.sum(~np.isnan(values), axis=0)
+    sums = np.nansum(values, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        variances = np.nansum((values - means) ** 2, axis=0) / (counts - 1)
+    variances = np.where(counts > 1, variances, np.nan)
+    return {
+        key: {
+            'count': int(counts[j]),
+            'mean': float(means[j]),
+            'variance': float(variances[j]),
+            'std': float(np.sqrt(variances[j]))
+        }
+        for j, key in enumerate(numeric_keys)
+    }
+
+
+def crosstab(encoded: EncodedResponses, key_a: str, key_b: str) -> "np.ndarray":
+    """
+    Joint counts of two questions (e.g. two rows of a matrix) over sessions that answered both
+
+    Returns:
+        Array of shape (len(options[key_a]), len(options[key_b]))
+    """
+    a = encoded.question_codes(key_a)
+    b = encoded.question_codes(key_b)
+    n_a, n_b = len(encoded.options[key_a]), len(encoded.options[key_b])
+    both = (a >= 0) & (b >= 0)
+    return np.bincount(a[both] * n_b + b[both], minlength=n_a * n_b).reshape(n_a, n_b)
+
+
+def matrix_crosstabs(encoded: EncodedResponses, row_keys: Sequence[str]) -> Dict[str, "np.ndarray"]:
+    """Crosstabs between every pair of rows of a matrix question"""
+    return {
+        f"{key_a}|{key_b}": crosstab(encoded, key_a, key_b)
+        for i, key_a in enumerate(row_keys)
+        for key_b in row_keys[i + 1:]
+    }
+
+
+def compare_groups(encoded: EncodedResponses, key: str, group_by_session: Dict[str, str], normalize: bool = True) -> Dict[str, Dict[str, float]]:
+    """
+    Answer distribution of one question per group of sessions, e.g. per model
+
+    Args:
+        encoded: Encoded responses
+        key: Question to compare
+        group_by_session: Group label (such as the model name) for each session id;
+            sessions without a label are ignored
+        normalize: Return shares instead of counts
+    """
+    labels = np.asarray([group_by_session.get(session_id, '') for session_id in encoded.session_ids], dtype=object)
+    groups, group_index = np.unique(labels, return_inverse=True)
+    codes = encoded.question_codes(key)
+    n_options = len(encoded.options[key])
+    keep = (codes >= 0) & (labels != '')
+    table = np.bincount(group_index[keep] * n_options + codes[keep], minlength=len(groups) * n_options).reshape(len(groups), n_options)
+    if normalize:
+        totals = table.sum(axis=1, keepdims=True)
+        table = np.divide(table, totals, out=np.zeros(table.shape), where=totals > 0)
+    return {
+        group: dict(zip(encoded.options[key], table[g].tolist()))
+        for g, group in enumerate(groups) if group != ''
+    }
+
+
+def sql_answer_distribution(handler: SupabaseHandler, question_keys: Optional[Sequence[str]] = None) -> Dict[str, Dict[str, int]]:
+    """
+    Answer counts per question computed by GROUP BY in Postgres
+
+    Only one row per (question, answer) leaves the database, so this scales to
+    populations too large to pull into memory.
+    """
+    rows = handler.iter_table(
+        'survey_responses',
+        ['question_key', 'answer', 'COUNT(*)'],
+        where_clause="question_key = ANY(%s)" if question_keys else None,
+        params=(list(question_keys),) if question_keys else None,
+        group_by="question_key, answer",
+        order_by="question_key, answer",
+        row_mode='tuple',
+        convert=False
+    )
+    result: Dict[str, Dict[str, int]] = {}
+    for question_key, answer, count in rows:
+        result.setdefault(question_key, {})[answer] = count
+    return result
+
+
+def sql_numeric_stats(handler: SupabaseHandler, question_keys: Sequence[str]) -> Dict[str, Dict[str, float]]:
+    """Count, mean and sample variance of numeric answers per question, computed in Postgres"""
+    rows = handler.iter_table(
+        'survey_responses',
+        ['question_key', 'COUNT(*)', 'AVG(answer::float8)', 'VAR_SAMP(answer::float8)'],
+        where_clause="question_key = ANY(%s) AND answer ~ %s",
+        params=(list(question_keys), NUMERIC_ANSWER_PATTERN),
+        group_by="question_key",
+        order_by="question_key",
+        row_mode='tuple',
+        convert=False
+    )
+    return {
+        question_key: {
+            'count': count,
+            'mean': mean,
+            'variance': variance,
+            'std': variance ** 0.5 if variance is not None else None
+        }
+        for question_key, count, mean, variance in rows
+    }
+
+
+def sql_crosstab(handler: SupabaseHandler, key_a: str, key_b: str) -> Dict[str, Dict[str, int]]:
+    """Joint answer counts of two questions per session, computed with a self-join in Postgres"""
+    rows = handler.iter_table(
+        "survey_responses a JOIN survey_responses b ON a.session_id = b.session_id",
+        ['a.answer', 'b.answer', 'COUNT(DISTINCT a.session_id)'],
+        where_clause="a.question_key = %s AND b.question_key = %s",
+        params=(key_a, key_b),
+        group_by="a.answer, b.answer",
+        order_by="1, 2",
+        row_mode='tuple',
+        convert=False
+    )
+    result: Dict[str, Dict[str, int]] = {}
+    for answer_a, answer_b, count in rows:
+        result.setdefault(answer_a, {})[answer_b] = count
+    return result
+
+
+# Example usage:
+# from supabase_handler import SupabaseHandler
+# from survey_analytics import load_responses, all_distributions, numeric_stats, matrix_crosstabs
+#
+# encoded = load_responses(SupabaseHandler())
+# print(all_distributions(encoded, normalize=True))
+# print(numeric_stats(encoded, ['overall_opinion']))
+# print(matrix_crosstabs(encoded, ['rankings_og_tril', 'rankings_preq', 'rankings_seq']))
@@ -0,0 +1,547 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import uuid
+import zlib
+import yaml
+from concurrent.futures import ProcessPoolExecutor, as_completed
+try:
+    import fcntl
+except ImportError:
+    # Windows: journals are not locked
+    fcntl = None
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple, Union
+from instrumentation import configure_logging, metrics
+from llm_question_handler import SYSTEM_PROMPT
+from openai_clients import get_async_openai_client, aclose_openai_clients
+from persona_population import PersonaPopulation
+from question_plan import QuestionPlan, load_question_plan
+from rate_limiter import get_scheduler
+from supabase_handler import SupabaseHandler
+from survey_runner import answer_questions_async
+from token_usage import TokenUsage
+
+# Namespace for session ids derived from (run id, persona position)
+FARM_NAMESPACE = uuid.UUID('6f1d8a52-3c7e-4b8e-9a51-0d2f3e7b9c41')
+MANIFEST_NAME = 'manifest.json'
+
+logger = logging.getLogger(__name__)
+
+# Set in worker processes when the run is interrupted: no new sessions are started
+_stop_event = None
+
+
+def _init_worker(stop_event, log_options: Optional[Dict[str, Any]]):
+    """
+    Workers leave Ctrl-C to the parent, which asks them to wind down through
+    stop_event, and log like the parent (log_options are configure_logging arguments)
+    """
+    global _stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _stop_event = stop_event
+    if log_options is not None:
+        configure_logging(**log_options)
+
+
+def _stopping() -> bool:
+    return _stop_event is not None and _stop_event.is_set()
+
+
+def farm_session_id(run_id: str, index: int) -> str:
+    """Deterministic session id of the index-th persona of a run, stable across restarts"""
+    return str(uuid.uuid5(FARM_NAMESPACE, f"{run_id}/{index}"))
+
+
+def shard_of(session_id: str, shards: int) -> int:
+    return zlib.crc32(session_id.encode('utf-8')) % shards
+
+
+class SessionJournal:
+    """
+    Append-only JSONL checkpoint of the answers of one shard.
+
+    Each answer line is written (and flushed) as soon as the LLM returns it,
+    so a restart never pays for the same (session_id, question_key) twice.
+    A {"stored_through": n} line records that the first n answer lines have
+    reached the database; answers after the last such line are re-sent from
+    the journal on the next run instead of being asked again. The file is
+    locked while open, so two runs cannot append to the same shard.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # (session_id, question_key) -> answer
+        self.answers: Dict[Tuple[str, str], Any] = {}
+        # The same answers in journal order
+        self.entries: List[Tuple[Tuple[str, str], Any]] = []
+        self.stored_through = 0
+        self._file = open(path, 'a', encoding='utf-8')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._file.close()
+                raise RuntimeError(f"Journal '{path}' is in use by another run")
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # A crash can leave a torn last line; drop it so new lines start cleanly
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+        for line in data[:end].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'stored_through' in entry:
+                self.stored_through = max(self.stored_through, entry['stored_through'])
+            else:
+                pair = (entry['session_id'], entry['key'])
+                if pair not in self.answers:
+                    self.answers[pair] = entry['answer']
+                    self.entries.append((pair, entry['answer']))
+
+    def __len__(self) -> int:
+        return len(self.answers)
+
+    def record(self, session_id: str, key: str, answer: Any):
+        pair = (session_id, key)
+        if pair in self.answers:
+            return
+        self.answers[pair] = answer
+        self.entries.append((pair, answer))
+        self._file.write(json.dumps({'session_id': session_id, 'key': key, 'answer': answer}, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def unstored(self) -> List[Tuple[Tuple[str, str], Any]]:
+        """Answers not yet confirmed in the database, oldest first"""
+        return self.entries[self.stored_through:]
+
+    def mark_stored(self, count: int):
+        self.stored_through = count
+        self._file.write(json.dumps({'stored_through': count}) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def iter_personas(personas_path: Optional[str], sessions: Optional[int]) -> Iterator[Dict[str, Any]]:
+    """Personas from a JSONL file (one object per line), or sessions default personas"""
+    if personas_path is not None:
+        with open(personas_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        for _ in range(sessions or 0):
+            yield {}
+
+
+def _read_manifest(journal_dir: str, run_id: str, shards: int) -> int:
+    """Returns the shard count of an existing run, or records a new run"""
+    path = os.path.join(journal_dir, MANIFEST_NAME)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['run_id'] != run_id:
+            raise ValueError(f"Journal directory '{journal_dir}' belongs to run '{manifest['run_id']}', not '{run_id}'")
+        return manifest['shards']
+    os.makedirs(journal_dir, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'run_id': run_id, 'shards': shards}, f)
+    return shards
+
+
+def _store(handler: SupabaseHandler, plan: QuestionPlan, entries: List[Tuple[Tuple[str, str], Any]], usage: Dict[str, TokenUsage]) -> bool:
+    """
+    Writes journaled answers, then the token usage of the sessions answered since the last write
+
+    A handler that raises (e.g. on an unreachable database) counts as a
+    failed write: the answers stay journaled for the next run and the
+    shard carries on with its remaining sessions.
+    """
+    try:
+        stored = handler.bulk_insert_responses([
+            {'session_id': session_id, 'question': plan.questions[plan.index_by_key[key]], 'answer': answer}
+            for (session_id, key), answer in entries
+        ])
+    except Exception:
+        logger.exception("Storing journaled answers raised", extra={'responses': len(entries)})
+        stored = False
+    # Usage is not journaled; a failed write only loses accounting, never answers
+    try:
+        written = not usage or handler.add_session_usage(usage)
+    except Exception:
+        logger.exception("Writing token usage raised", extra={'sessions': len(usage)})
+        written = False
+    if not written:
+        logger.error("Token usage could not be written", extra={'sessions': len(usage)})
+    return stored
+
+
+async def _run_shard_async(config: Dict[str, Any], plan: QuestionPlan, journal: SessionJournal, handler: Optional[SupabaseHandler], sessions: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+    scheduler = get_scheduler(get_async_openai_client(config.get('api_key'), config.get('base_url')))
+    # Every worker process has its own limiter, so each paces itself to its share of the account
+    scheduler.limiter.set_limits(config['requests_per_minute'], config['tokens_per_minute'], share=1 / config['workers'])
+    semaphore = asyncio.Semaphore(config['sessions_in_flight'])
+    loop = asyncio.get_running_loop()
+    summary = {'answered': 0, 'failed': 0, 'unreachable': 0, 'interrupted': 0, 'store_failures': 0}
+    storing: Optional[asyncio.Future] = None
+    # Token usage of finished sessions, written with the next bulk insert
+    session_usage: Dict[str, TokenUsage] = {}
+
+    async def store_pending(force: bool = False):
+        """Writes journaled answers to the database, one bulk insert at a time"""
+        nonlocal storing
+        if storing is not None:
+            if not force and not storing.done():
+                return
+            await storing
+            storing = None
+        nonlocal session_usage
+        pending = journal.unstored()
+        if not (pending or (force and session_usage)) or (not force and len(pending) < config['store_batch_size']):
+            return
+        through = journal.stored_through + len(pending)
+        usage, session_usage = session_usage, {}
+
+        async def write():
+            if await loop.run_in_executor(None, _store, handler, plan, pending, usage):
+                if pending:
+                    journal.mark_stored(through)
+            else:
+                summary['store_failures'] += 1
+
+        storing = asyncio.ensure_future(write())
+        if force:
+            await storing
+            storing = None
+
+    async def run_session(session_id: str, persona: Dict[str, Any]):
+        known = {}
+        remaining = []
+        for index, question in enumerate(plan.questions):
+            pair = (session_id, question['key'])
+            if pair in journal.answers:
+                known[question['key']] = journal.answers[pair]
+            else:
+                remaining.append(index)
+        if not remaining:
+            return
+        async with semaphore:
+            if _stopping():
+                summary['interrupted'] += 1
+                return
+            usage = TokenUsage()
+            results = await answer_questions_async(
+                plan if len(remaining) == len(plan) else plan.subset(remaining),
+                model=config['model'],
+                max_concurrency=config['max_concurrency'],
+                matrix_mode=config['matrix_mode'],
+                scheduler=scheduler,
+                system_prompt=persona.get('system_prompt', SYSTEM_PROMPT),
+                known_answers=known,
+                usage=usage
+            )
+        if usage:
+            session_usage.setdefault(session_id, TokenUsage()).merge(usage)
+        for result in results:
+            if result['status'] == 'ok':
+                journal.record(session_id, result['key'], result['answer'])
+                summary['answered'] += 1
+            elif result['status'] == 'skipped':
+                # Not journaled: re-evaluated for free on the next run
+                summary['unreachable'] += 1
+            else:
+                summary['failed'] += 1
+        if handler is not None:
+            await store_pending()
+
+    try:
+        await asyncio.gather(*(run_session(session_id, persona) for session_id, persona in sessions))
+        if handler is not None:
+            await store_pending(force=True)
+    finally:
+        await aclose_openai_clients()
+    summary.update(scheduler.stats())
+    summary['usage'] = scheduler.usage.as_dict()
+    return summary
+
+
+def run_shard(config: Dict[str, Any], shard: int, sessions: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Answers the sessions of one shard in this process, resuming from its journal
+
+    Args:
+        config: Run settings built by run_farm
+        shard: Shard number, which selects the journal file
+        sessions: (session_id, persona) pairs belonging to the shard
+
+    Returns:
+        Dictionary of counters for the shard
+    """
+    plan = load_question_plan(config['questions_path'], config.get('plan_path'), config.get('conditions'))
+    journal = SessionJournal(os.path.join(config['journal_dir'], f"shard-{shard:05d}.jsonl"))
+    handler = config['handler_factory']() if config['handler_factory'] is not None else None
+    resumed = len(journal)
+    # A worker process hands its shard's metrics to the parent with the summary
+    in_worker = _stop_event is not None
+    if in_worker:
+        metrics.reset()
+    try:
+        summary = asyncio.run(_run_shard_async(config, plan, journal, handler, sessions))
+    finally:
+        journal.close()
+        if handler is not None:
+            handler.close()
+    summary.update(shard=shard, sessions=len(sessions), resumed=resumed, unstored=len(journal.unstored()) if handler is not None else 0)
+    if in_worker:
+        summary['metrics'] = metrics.snapshot()
+    return summary
+
+
+def run_farm(questions_path: str, journal_dir: str, personas: Union[List[Dict[str, Any]], PersonaPopulation], run_id: str = 'farm', workers: int = 4, shards: int = 64, model: str = "gpt-4o-mini", max_concurrency: int = 4, sessions_in_flight: int = 16, matrix_mode: bool = False, store_batch_size: int = 1000, handler_factory: Optional[Callable[[], SupabaseHandler]] = SupabaseHandler, api_key: Optional[str] = None, base_url: Optional[str] = None, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None, conditions: Optional[Dict[str, Any]] = None, metrics_path: Optional[str] = None, log_options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Runs one questionnaire for many personas across a pool of worker processes.
+
+    Sessions are assigned to shards by a hash of their session id and each
+    shard is answered by one worker with its own event loop, OpenAI client
+    and rate limiter. Answers are checkpointed per shard in journal_dir, so
+    rerunning the same run_id skips every (session_id, question_key) pair
+    that was already answered and only stores what had not reached the
+    database yet.
+
+    Args:
+        questions_path: Questionnaire YAML file
+        journal_dir: Directory holding the manifest and one journal per shard
+        personas: One dictionary per session; optional 'session_id' and 'system_prompt'.
+            A PersonaPopulation is stored (seed, config and each session's attributes)
+            before the run and answered with its rendered prompts
+        run_id: Name of the run; session ids without an explicit 'session_id' derive from it
+        workers: Worker processes (1 runs every shard in this process)
+        shards: Number of journal shards (fixed by the first run in journal_dir)
+        model: OpenAI model to use
+        max_concurrency: Simultaneous API calls per session
+        sessions_in_flight: Sessions answered concurrently per worker
+        matrix_mode: Answer matrix rows with one structured-output request
+        store_batch_size: Journaled answers per bulk insert
+        handler_factory: Builds the database handler in each worker (None to only journal)
+        api_key: OpenAI API key (if None, workers use OPENAI_API_KEY)
+        base_url: Optional API base URL for OpenAI-compatible endpoints
+        requests_per_minute: Account request limit shared by all workers (until the
+            response headers report the real one)
+        tokens_per_minute: Account token limit shared by all workers
+        conditions: Display conditions for the questionnaire (see convert_yaml_to_json_objects)
+        metrics_path: File the process metrics are written to after every shard (see
+            instrumentation.Metrics.write); worker metrics are merged into this process
+        log_options: configure_logging arguments for the worker processes
+
+    Token counts and cost are added to each session in survey_sessions and
+    to the run's row in survey_runs.
+
+    Returns:
+        Dictionary with totals (including 'usage', see TokenUsage.as_dict) and the
+        per-shard summaries
+
+    Raises:
+        RuntimeError: If a PersonaPopulation could not be stored, e.g. because
+            run_id already has one with a different seed or config
+    """
+    shards = _read_manifest(journal_dir, run_id, shards)
+    plan_path = os.path.join(journal_dir, 'plan.json')
+    # Compile once here so workers load the JSON artifact instead of parsing YAML
+    load_question_plan(questions_path, plan_path, conditions)
+
+    population = personas if isinstance(personas, PersonaPopulation) else None
+    if population is not None:
+        personas = population.personas()
+
+    by_shard: Dict[int, List[Tuple[str, Dict[str, Any]]]] = {}
+    session_ids = []
+    for index, persona in enumerate(personas):
+        session_id = persona.get('session_id') or farm_session_id(run_id, index)
+        session_ids.append(session_id)
+        by_shard.setdefault(shard_of(session_id, shards), []).append((session_id, persona))
+
+    if population is not None and handler_factory is not None:
+        handler = handler_factory()
+        try:
+            stored = handler.store_population(run_id, population, session_ids)
+        finally:
+            handler.close()
+        # Without the stored seed and config the run's personas cannot be reproduced
+        if not stored:
+            raise RuntimeError(f"The population of run '{run_id}' could not be stored")
+
+    config = {
+        'questions_path': questions_path,
+        'conditions': conditions,
+        'plan_path': plan_path,
+        'journal_dir': journal_dir,
+        'model': model,
+        'max_concurrency': max_concurrency,
+        'sessions_in_flight': sessions_in_flight,
+        'matrix_mode': matrix_mode,
+        'store_batch_size': store_batch_size,
+        'handler_factory': handler_factory,
+        'api_key': api_key,
+        'base_url': base_url,
+        'workers': max(workers, 1),
+        'requests_per_minute': requests_per_minute,
+        'tokens_per_minute': tokens_per_minute
+    }
+
+    started = time.monotonic()
+    summaries = []
+
+    def shard_done(summary: Dict[str, Any]):
+        if 'metrics' in summary:
+            metrics.merge(summary.pop('metrics'))
+        summaries.append(summary)
+        logger.info("Shard finished", extra={field: summary[field] for field in ('shard', 'answered', 'resumed', 'failed')})
+        if metrics_path is not None:
+            metrics.write(metrics_path)
+
+    if workers <= 1:
+        for shard, sessions in sorted(by_shard.items()):
+            shard_done(run_shard(config, shard, sessions))
+    else:
+        # spawn: workers must not inherit the parent's pools, clients or threads
+        context = multiprocessing.get_context('spawn')
+        stop_event = context.Event()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(stop_event, log_options)) as pool:
+            pending = {pool.submit(run_shard, config, shard, sessions) for shard, sessions in sorted(by_shard.items())}
+            while pending:
+                try:
+                    for future in as_completed(pending):
+                        pending.discard(future)
+                        shard_done(future.result())
+                except KeyboardInterrupt:
+                    if stop_event.is_set():
+                        raise
+                    # In-flight sessions finish and are journaled and stored; rerun to continue
+                    logger.warning("Interrupted: finishing in-flight sessions (Ctrl-C again to abort)")
+                    stop_event.set()
+
+    totals = {field: sum(s[field] for s in summaries) for field in ('sessions', 'answered', 'resumed', 'failed', 'unreachable', 'interrupted', 'unstored', 'store_failures', 'requests', 'retries')}
+    usage = TokenUsage()
+    for summary in summaries:
+        usage.merge(TokenUsage.from_dict(summary['usage']))
+    totals['usage'] = usage.as_dict()
+    totals['seconds'] = round(time.monotonic() - started, 3)
+    totals['shards'] = sorted(summaries, key=lambda s: s['shard'])
+    if usage and handler_factory is not None:
+        handler = handler_factory()
+        try:
+            handler.add_run_usage(run_id, model, usage)
+        finally:
+            handler.close()
+    logger.info("Farm run finished", extra=dict({field: totals[field] for field in ('sessions', 'answered', 'resumed', 'failed', 'unreachable', 'interrupted', 'unstored', 'seconds')}, run_id=run_id))
+    logger.info("Token usage", extra=dict(usage.as_dict(), run_id=run_id))
+    if metrics_path is not None:
+        metrics.write(metrics_path)
+    return totals
+
+
+def _read_config(path: Optional[str]) -> Optional[Dict[str, Any]]:
+    if path is None:
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+
+def main(argv: Optional[List[str]] = None, prog: Optional[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog=prog, description="Answer a questionnaire for many personas across worker processes, with checkpoint/resume")
+    parser.add_argument('questions', help="Questionnaire YAML file")
+    parser.add_argument('--journal-dir', required=True, help="Checkpoint directory; rerun with the same directory to resume")
+    parser.add_argument('--personas', help="JSONL file with one persona per line (optional 'session_id', 'system_prompt')")
+    parser.add_argument('--sessions', type=int, help="Number of default personas when --personas is not given, or the size of --population")
+    parser.add_argument('--population', help="YAML/JSON population config to sample --sessions personas from (see persona_population)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the --population sample")
+    parser.add_argument('--run-id', default='farm', help="Run name that generated session ids derive from")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shards', type=int, default=64)
+    parser.add_argument('--model', default="gpt-4o-mini")
+    parser.add_argument('--max-concurrency', type=int, default=4, help="Simultaneous API calls per session")
+    parser.add_argument('--sessions-in-flight', type=int, default=16, help="Concurrent sessions per worker")
+    parser.add_argument('--matrix-mode', action='store_true')
+    parser.add_argument('--conditions', help="YAML/JSON file mapping question keys to display conditions, e.g. sample_q.conditions.yml; without it every question is asked")
+    parser.add_argument('--store-batch-size', type=int, default=1000)
+    parser.add_argument('--no-db', action='store_true', help="Only write the journal, skip SupabaseHandler")
+    parser.add_argument('--base-url', help="API base URL for OpenAI-compatible endpoints")
+    parser.add_argument('--requests-per-minute', type=float, help="Account request limit, split across workers")
+    parser.add_argument('--tokens-per-minute', type=float, help="Account token limit, split across workers")
+    parser.add_argument('--log-level', default='INFO')
+    parser.add_argument('--log-format', choices=['text', 'json'], default='text')
+    parser.add_argument('--log-sample-rate', type=float, default=1.0, help="Share of high-volume log lines (e.g. per-batch inserts) to keep")
+    parser.add_argument('--metrics-file', help="Write metrics after every shard: Prometheus text, or JSON for *.json")
+    parser.add_argument('--metrics-port', type=int, help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics during the run")
+    args = parser.parse_args(argv)
+
+    if args.personas is None and args.sessions is None:
+        parser.error("one of --personas or --sessions is required")
+    if args.population is not None and (args.personas is not None or args.sessions is None):
+        parser.error("--population takes its size from --sessions and cannot be combined with --personas")
+
+    log_options = {'level': args.log_level, 'json_format': args.log_format == 'json', 'sample_rate': args.log_sample_rate}
+    configure_logging(**log_options)
+    metrics_server = metrics.serve(args.metrics_port) if args.metrics_port is not None else None
+
+    if args.population is not None:
+        personas = PersonaPopulation.sample(_read_config(args.population), args.sessions, args.seed)
+    else:
+        personas = list(iter_personas(args.personas, args.sessions))
+
+    try:
+        totals = run_farm(
+            args.questions,
+            args.journal_dir,
+            personas,
+            run_id=args.run_id,
+            workers=args.workers,
+            shards=args.shards,
+            model=args.model,
+            max_concurrency=args.max_concurrency,
+            sessions_in_flight=args.sessions_in_flight,
+            matrix_mode=args.matrix_mode,
+            conditions=_read_config(args.conditions),
+            store_batch_size=args.store_batch_size,
+            handler_factory=None if args.no_db else SupabaseHandler,
+            base_url=args.base_url,
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute,
+            metrics_path=args.metrics_file,
+            log_options=log_options
+        )
+    finally:
+        if metrics_server is not None:
+            metrics_server.shutdown()
+    return 0 if totals['failed'] == totals['interrupted'] == totals['unstored'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+# Example usage:
+# python survey_farm.py sample_q.yml --sessions 100000 --journal-dir runs/sw1 --run-id sw1 --workers 8
+# # After a crash or Ctrl-C, the same command resumes where the journals stopped
+#
+# # 100k personas sampled from a population config; rerun with the same seed to resume
+# python survey_farm.py sample_q.yml --population population.yml --sessions 100000 --seed 7 --journal-dir runs/sw2 --run-id sw2
+#
+# # JSON logs with 1% of per-batch insert lines, and metrics for node_exporter's textfile collector
+# python survey_farm.py sample_q.yml --sessions 100000 --journal-dir runs/sw3 --log-format json --log-sample-rate 0.01 --metrics-file /var/lib/node_exporter/textfile/surveybot.prom
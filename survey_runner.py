@@ -0,0 +1,213 @@
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Union
+from llm_question_handler import SYSTEM_PROMPT, ask_question_result_async, ask_survey_results_async
+from openai_clients import get_async_openai_client, aclose_openai_clients
+from response_writer import ResponseWriter
+from llm_cache import LLMCache
+from question_plan import QuestionPlan
+from convert_to_json import question_shown
+from rate_limiter import LLMResult, LLMScheduler, get_scheduler
+from token_usage import TokenUsage
+
+logger = logging.getLogger(__name__)
+
+
+def _result_entry(question: Dict[str, Any], result: LLMResult) -> Dict[str, Any]:
+    """Per-question entry of the list returned by answer_questions_async"""
+    entry = {'key': question['key'], 'answer': result.answer, 'status': result.status}
+    if not result.ok:
+        logger.warning("Question failed", extra={'question_key': question['key'], 'status': result.status, 'attempts': result.attempts, 'error': result.error})
+        entry['error'] = result.error
+    return entry
+
+
+def _unit_dependencies(questions: List[Dict[str, Any]], units: List[List[int]], index_by_key: Dict[str, int]) -> List[List[int]]:
+    """
+    Units each unit has to wait for, from the questions' display conditions
+
+    Prerequisites outside questions are looked up in the known answers
+    instead. Raises ValueError if the conditions form a cycle.
+    """
+    unit_of = {index: position for position, unit in enumerate(units) for index in unit}
+    dependencies = [
+        sorted({unit_of[index_by_key[key]] for index in unit for key in questions[index].get('show_if') or {} if key in index_by_key})
+        for unit in units
+    ]
+
+    # Kahn's algorithm: whatever cannot be ordered is part of a cycle
+    remaining = [len(unit_dependencies) for unit_dependencies in dependencies]
+    dependents = [[] for _ in units]
+    for position, unit_dependencies in enumerate(dependencies):
+        for dependency in unit_dependencies:
+            dependents[dependency].append(position)
+    ready = [position for position, count in enumerate(remaining) if count == 0]
+    while ready:
+        for dependent in dependents[ready.pop()]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+    cyclic = [questions[units[position][0]]['key'] for position, count in enumerate(remaining) if count > 0]
+    if cyclic:
+        raise ValueError(f"Display conditions form a cycle between: {', '.join(cyclic)}")
+    return dependencies
+
+
+async def answer_questions_async(questions: Union[List[Dict[str, Any]], QuestionPlan], api_key: Optional[str] = None, model: str = "gpt-4o-mini", max_concurrency: int = 5, base_url: Optional[str] = None, writer: Optional[ResponseWriter] = None, session_id: Optional[str] = None, cache: Optional[LLMCache] = None, cache_mode: str = 'use', matrix_mode: bool = False, scheduler: Optional[LLMScheduler] = None, system_prompt: str = SYSTEM_PROMPT, known_answers: Optional[Dict[str, Any]] = None, usage: Optional[TokenUsage] = None) -> List[Dict[str, Any]]:
+    """
+    Answers a list of question objects concurrently, keeping at most
+    max_concurrency requests in flight at once.
+
+    Calls are paced by the rate limiter of the scheduler and transient errors
+    are retried. A question that still fails is returned with answer None and
+    its 'status' and 'error', and is not passed to the writer.
+
+    Questions with a display condition ('show_if') wait until their
+    prerequisites are answered and are skipped, without an API call, if the
+    condition does not hold or a prerequisite failed. Everything else runs
+    concurrently.
+
+    Args:
+        questions: Question objects as returned by convert_yaml_to_json_objects, or a
+            QuestionPlan whose prebuilt prompts are then reused
+        api_key: OpenAI API key (if None, will try to get from OPENAI_API_KEY environment variable)
+        model: OpenAI model to use (default: gpt-4o-mini)
+        max_concurrency: Maximum number of simultaneous API calls
+        base_url: Optional API base URL for OpenAI-compatible endpoints
+        writer: Optional ResponseWriter that receives each answer as soon as it arrives,
+            so database writes overlap with the remaining LLM calls
+        session_id: Session the answers are stored under (required with writer)
+        cache: Optional LLMCache shared by all questions
+        cache_mode: 'use', 'refresh' or 'bypass' (see llm_cache.CACHE_MODES)
+        matrix_mode: Answer all rows of each matrix (questions sharing a 'matrix_key')
+            with one structured-output request instead of one request per row
+        scheduler: Optional LLMScheduler (defaults to the shared one for the client)
+        system_prompt: Persona description (and any survey context) that starts the
+            system message of every request
+        known_answers: Answers given earlier in the session (question key -> answer), used
+            for display conditions on questions that are not in this call
+        usage: Optional TokenUsage the session's token counts and cost are added to; with
+            a writer they are also stored on the session (ResponseWriter.add_usage)
+
+    Returns:
+        List of dictionaries with 'key', 'answer' and 'status' (plus 'error' for
+        failed questions), in the same order as questions. Unreachable questions
+        have status 'skipped' and answer None
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1")
+    if writer is not None and session_id is None:
+        raise ValueError("session_id is required when a writer is given")
+
+    if scheduler is None:
+        scheduler = get_scheduler(get_async_openai_client(api_key, base_url))
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    if isinstance(questions, QuestionPlan):
+        prompts = questions.prompts
+        questions = questions.questions
+    else:
+        prompts = [None] * len(questions)
+
+    index_by_key = {question['key']: index for index, question in enumerate(questions)}
+
+    # Each unit is a list of question indices answered by one request
+    units = []
+    matrix_units = {}
+    for index, question in enumerate(questions):
+        matrix_key = question.get('matrix_key') if matrix_mode else None
+        # A row gated on another row of its own matrix cannot share that row's request
+        if matrix_key is not None and any(questions[index_by_key[key]].get('matrix_key') == matrix_key for key in question.get('show_if') or {} if key in index_by_key):
+            matrix_key = None
+        if matrix_key is None:
+            units.append([index])
+        else:
+            if matrix_key not in matrix_units:
+                matrix_units[matrix_key] = []
+                units.append(matrix_units[matrix_key])
+            matrix_units[matrix_key].append(index)
+
+    unit_dependencies = _unit_dependencies(questions, units, index_by_key)
+    # Answers display conditions are evaluated against, filled in as units finish
+    answered = dict(known_answers or {})
+    finished = [asyncio.Event() for _ in units]
+    llm_results_seen: List[LLMResult] = []
+    # Matrix requests add their usage here; their per-row results carry none
+    session_usage = TokenUsage()
+
+    async def answer(position: int, unit: List[int]) -> List[Dict[str, Any]]:
+        try:
+            for dependency in unit_dependencies[position]:
+                await finished[dependency].wait()
+            shown = [index for index in unit if question_shown(questions[index], answered)]
+            llm_results = {}
+            if shown:
+                shown_questions = [questions[index] for index in shown]
+                async with semaphore:
+                    if len(shown) == 1:
+                        llm_results[shown[0]] = await ask_question_result_async(shown_questions[0], model=model, cache=cache, cache_mode=cache_mode, prompt=prompts[shown[0]], scheduler=scheduler, system_prompt=system_prompt)
+                    else:
+                        by_key = await ask_survey_results_async(shown_questions, model=model, cache=cache, cache_mode=cache_mode, scheduler=scheduler, system_prompt=system_prompt, usage=session_usage)
+                        llm_results.update((index, by_key[questions[index]['key']]) for index in shown)
+            for index, result in llm_results.items():
+                llm_results_seen.append(result)
+                if result.ok:
+                    answered[questions[index]['key']] = result.answer
+        finally:
+            finished[position].set()
+
+        if writer is not None:
+            writer.add_many(session_id, [
+                {'question': questions[index], 'answer': result.answer}
+                for index, result in llm_results.items() if result.ok
+            ])
+        return [
+            _result_entry(questions[index], llm_results[index]) if index in llm_results
+            else {'key': questions[index]['key'], 'answer': None, 'status': 'skipped'}
+            for index in unit
+        ]
+
+    answers: List[Optional[Dict[str, Any]]] = [None] * len(questions)
+    for unit, results in zip(units, await asyncio.gather(*(answer(position, unit) for position, unit in enumerate(units)))):
+        for index, result in zip(unit, results):
+            answers[index] = result
+
+    for result in llm_results_seen:
+        session_usage.add(result.usage)
+    if usage is not None:
+        usage.merge(session_usage)
+    if writer is not None and session_usage:
+        writer.add_usage(session_id, session_usage)
+    return answers
+
+
+def answer_questions(questions: Union[List[Dict[str, Any]], QuestionPlan], api_key: Optional[str] = None, model: str = "gpt-4o-mini", max_concurrency: int = 5, base_url: Optional[str] = None, writer: Optional[ResponseWriter] = None, session_id: Optional[str] = None, cache: Optional[LLMCache] = None, cache_mode: str = 'use', matrix_mode: bool = False, scheduler: Optional[LLMScheduler] = None, system_prompt: str = SYSTEM_PROMPT, known_answers: Optional[Dict[str, Any]] = None, usage: Optional[TokenUsage] = None) -> List[Dict[str, Any]]:
+    """
+    Synchronous wrapper around answer_questions_async.
+
+    Inside a running event loop (e.g. a Jupyter notebook) await
+    answer_questions_async directly instead.
+    """
+    async def run() -> List[Dict[str, Any]]:
+        try:
+            return await answer_questions_async(questions, api_key, model, max_concurrency, base_url, writer, session_id, cache, cache_mode, matrix_mode, scheduler, system_prompt, known_answers, usage)
+        finally:
+            # The loop ends with asyncio.run, so its pooled clients must go too
+            await aclose_openai_clients()
+
+    return asyncio.run(run())
+
+
+# Example usage:
+# from convert_to_json import convert_yaml_to_json_objects
+# from survey_runner import answer_questions
+#
+# questions = convert_yaml_to_json_objects('sample_q.yml')
+# answers = answer_questions(questions, max_concurrency=8)
+#
+# # Stream answers to the database while the survey is still running
+# with ResponseWriter(SupabaseHandler()) as writer:
+#     answers = answer_questions(questions, writer=writer, session_id=str(uuid.uuid4()))
+#
+# # In a notebook cell:
+# # answers = await answer_questions_async(questions, max_concurrency=8)
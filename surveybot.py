@@ -0,0 +1,39 @@
+import argparse
+import importlib
+import sys
+from typing import List, Optional
+
+# Subcommand -> (module whose main(argv, prog) runs it, summary). Modules are
+# imported only once their subcommand is chosen, so `surveybot --help` and
+# argument errors return before openai, psycopg2 or pyarrow are loaded.
+COMMANDS = {
+    'run': ('survey_farm', "Answer a questionnaire for many personas across worker processes, with checkpoint/resume"),
+    'export': ('response_export', "Export stored responses as a Parquet dataset partitioned by session date"),
+    'bench': ('benchmark', "Offline end-to-end throughput benchmark against a fake OpenAI server"),
+}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='surveybot',
+        description="Simulated survey respondents: answer, store and export questionnaires",
+        epilog="commands:\n" + "\n".join(f"  {name:<8}{summary}" for name, (_, summary) in COMMANDS.items())
+        + "\n\nRun `surveybot <command> --help` for the options of a command.",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('command', choices=list(COMMANDS), help="Command to run")
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="Options of the command")
+    args = parser.parse_args(argv)
+
+    module = importlib.import_module(COMMANDS[args.command][0])
+    return module.main(args.args, prog=f"surveybot {args.command}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+# Example usage (after `pip install -e .`, or with `python surveybot.py`):
+# surveybot run sample_q.yml --sessions 1000 --journal-dir runs/sw1 --run-id sw1 --workers 8
+# surveybot export exports/survey_responses --state exports/state.json
+# surveybot bench --sessions 1 100 --latency 0.05
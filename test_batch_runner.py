@@ -0,0 +1,164 @@
+import json
+import pytest
+from types import SimpleNamespace
+from batch_runner import build_batch_requests, run_batch_survey, split_batch_requests
+
+
+class StubBatchClient:
+    """Stands in for openai.OpenAI: stores uploaded files and answers batches locally"""
+
+    def __init__(self, answer_for, fail_keys=(), stuck=()):
+        self.answer_for = answer_for
+        self.fail_keys = set(fail_keys)
+        # Batch ids that never leave 'in_progress'
+        self.stuck = set(stuck)
+        self.uploaded = {}
+        self.contents = {}
+        self.polls = {}
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch)
+
+    def _create_file(self, file, purpose):
+        assert purpose == 'batch'
+        file_id = f"file-{len(self.uploaded)}"
+        self.uploaded[file_id] = file.read().decode('utf-8')
+        return SimpleNamespace(id=file_id)
+
+    def _file_content(self, file_id):
+        return SimpleNamespace(text=self.contents[file_id])
+
+    def _create_batch(self, input_file_id, endpoint, completion_window, metadata=None):
+        assert endpoint == '/v1/chat/completions'
+        outputs, errors = [], []
+        for line in self.uploaded[input_file_id].splitlines():
+            request = json.loads(line)
+            key = request['custom_id'].rsplit('|', 1)[1]
+            if key in self.fail_keys:
+                errors.append({'custom_id': request['custom_id'], 'response': {'status_code': 500, 'body': {'error': {'message': 'boom'}}}, 'error': None})
+                continue
+            content = self.answer_for(request['body'])
+            outputs.append({
+                'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'body': {
+                    'model': request['body']['model'],
+                    'choices': [{'message': {'role': 'assistant', 'content': content}}],
+                    'usage': {'prompt_tokens': 10, 'completion_tokens': 2}
+                }},
+                'error': None
+            })
+        batch_id = f"batch-{len(self.polls) + 1}"
+        self.contents[f"{batch_id}-out"] = '\n'.join(json.dumps(o) for o in outputs)
+        self.contents[f"{batch_id}-err"] = '\n'.join(json.dumps(e) for e in errors)
+        self.polls[batch_id] = 0
+        return SimpleNamespace(id=batch_id)
+
+    def _retrieve_batch(self, batch_id):
+        self.polls[batch_id] += 1
+        if self.polls[batch_id] < 2 or batch_id in self.stuck:
+            return SimpleNamespace(id=batch_id, status='in_progress')
+        return SimpleNamespace(id=batch_id, status='completed', output_file_id=f"{batch_id}-out", error_file_id=f"{batch_id}-err")
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.written = []
+        self.runs = {}
+        self.sessions = {}
+
+    def bulk_insert_responses(self, responses):
+        self.written.extend(responses)
+        return True
+
+    def add_session_usage(self, usage):
+        self.sessions.update(usage)
+        return True
+
+    def add_run_usage(self, run_id, model, usage):
+        self.runs[run_id] = usage
+        return True
+
+
+QUESTIONS = [
+    {'key': 'fav', 'type': 'mc', 'label': 'Favourite?', 'options': ['yes', 'no']},
+    {'key': 'why', 'type': 'textarea', 'label': 'Why?'},
+]
+
+
+def test_build_batch_requests_uses_persona_prompt_and_unique_ids():
+    lines, index = build_batch_requests(QUESTIONS, [{'session_id': 's1', 'system_prompt': 'You are a pirate.'}, {'session_id': 's2'}])
+
+    assert len(lines) == 4
+    assert len({line['custom_id'] for line in lines}) == 4
+    assert lines[0]['body']['messages'][0]['content'].startswith('You are a pirate.')
+    assert index[lines[2]['custom_id']]['session_id'] == 's2'
+
+
+def test_run_batch_survey_validates_and_stores_answers(tmp_path):
+    client = StubBatchClient(lambda body: 'YES' if 'Available options' in body['messages'][-1]['content'] else 'Because.', fail_keys={'why'})
+    handler = RecordingHandler()
+
+    result = run_batch_survey(QUESTIONS, [{'session_id': 's1'}, {'session_id': 's2'}], handler=handler, client=client, workdir=str(tmp_path), poll_interval=0)
+
+    assert result['status'] == 'completed'
+    assert result['stored'] is True
+    # Case-insensitive option matching from ask_question_with_llm applies to batch answers too
+    assert [(r['session_id'], r['question']['key'], r['answer']) for r in handler.written] == [('s1', 'fav', 'yes'), ('s2', 'fav', 'yes')]
+    assert sorted((f['session_id'], f['question']['key']) for f in result['failures']) == [('s1', 'why'), ('s2', 'why')]
+
+
+def test_answers_to_unreachable_questions_are_not_stored(tmp_path):
+    questions = [QUESTIONS[0], dict(QUESTIONS[1], show_if={'fav': ['no']})]
+    client = StubBatchClient(lambda body: 'yes' if 'Available options' in body['messages'][-1]['content'] else 'Because.')
+    handler = RecordingHandler()
+
+    result = run_batch_survey(questions, [{'session_id': 's1'}], handler=handler, client=client, workdir=str(tmp_path), poll_interval=0)
+
+    assert [r['question']['key'] for r in handler.written] == ['fav']
+    assert [r['question']['key'] for r in result['unreachable']] == ['why']
+
+
+def test_split_batch_requests_respects_request_and_size_limits():
+    lines, _ = build_batch_requests(QUESTIONS, [{'session_id': f"s{i}"} for i in range(5)])
+    assert [len(group) for group in split_batch_requests(lines, max_requests=4)] == [4, 4, 2]
+
+    size = max(len(json.dumps(line, ensure_ascii=False).encode('utf-8')) + 1 for line in lines)
+    groups = split_batch_requests(lines, max_bytes=3 * size)
+    assert all(len(group) <= 3 for group in groups) and len(groups) >= 4
+    assert [line for group in groups for line in group] == lines
+
+    with pytest.raises(ValueError):
+        split_batch_requests(lines, max_bytes=size // 2)
+
+
+def test_run_batch_survey_merges_results_of_several_batches(tmp_path):
+    client = StubBatchClient(lambda body: 'no' if 'Available options' in body['messages'][-1]['content'] else 'Because.')
+    handler = RecordingHandler()
+    personas = [{'session_id': f"s{i}"} for i in range(3)]
+
+    result = run_batch_survey(QUESTIONS, personas, handler=handler, client=client, workdir=str(tmp_path), poll_interval=0, max_requests=4)
+
+    assert result['batch_ids'] == ['batch-1', 'batch-2']
+    assert [len(text.splitlines()) for text in client.uploaded.values()] == [4, 2]
+    assert result['status'] == 'completed' and result['failures'] == []
+    assert sorted((r['session_id'], r['question']['key']) for r in handler.written) == sorted(
+        (f"s{i}", key) for i in range(3) for key in ('fav', 'why')
+    )
+    # One survey_runs row per batch, each billed for its own requests
+    assert {run_id: usage.prompt_tokens for run_id, usage in handler.runs.items()} == {'batch-1': 40, 'batch-2': 20}
+    assert result['usage']['prompt_tokens'] == 60
+    # The request files are removed once uploaded
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_finished_batches_are_kept_when_a_later_one_times_out(tmp_path):
+    client = StubBatchClient(lambda body: 'no' if 'Available options' in body['messages'][-1]['content'] else 'Because.', stuck={'batch-2'})
+    handler = RecordingHandler()
+    personas = [{'session_id': f"s{i}"} for i in range(3)]
+
+    result = run_batch_survey(QUESTIONS, personas, handler=handler, client=client, workdir=str(tmp_path), poll_interval=0.01, timeout=0.3, max_requests=4)
+
+    assert result['status'] == 'timed_out'
+    assert result['batch_ids'] == ['batch-1', 'batch-2'] and result['unfinished_batch_ids'] == ['batch-2']
+    assert result['stored'] is True and result['failures'] == []
+    assert sorted((r['session_id'], r['question']['key']) for r in handler.written) == [(f"s{i}", key) for i in range(2) for key in ('fav', 'why')]
+    assert list(handler.runs) == ['batch-1']
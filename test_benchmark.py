@@ -0,0 +1,74 @@
+import copy
+import pytest
+import llm_question_handler
+from benchmark import STAGES, compare_to_baseline, percentile, run_benchmark
+from fake_supabase_handler import FakeSupabaseHandler
+
+
+def test_benchmark_times_every_stage_offline(monkeypatch):
+    handlers = []
+    # The prompt stage builds each prompt instead of reading the plan's prebuilt ones
+    built = []
+    create_prompt = llm_question_handler.create_prompt
+    monkeypatch.setattr(llm_question_handler, 'create_prompt', lambda *args: built.append(args) or create_prompt(*args))
+
+    def handler_factory():
+        handlers.append(FakeSupabaseHandler())
+        return handlers[-1]
+
+    results = run_benchmark(session_counts=(2,), handler_factory=handler_factory, yaml_repeats=2, error_rate=0.1, seed=3)
+    scenario = results['scenarios']['2']
+
+    assert scenario['questions'] == 18 and scenario['failed'] == 0 and scenario['stored'] == 18
+    assert scenario['llm']['retries'] > 0
+    assert set(scenario['stages']) == set(STAGES)
+    assert scenario['stages']['yaml_parse']['count'] == 2
+    assert scenario['stages']['prompt']['count'] == scenario['stages']['llm']['count'] == scenario['stages']['validate']['count'] == 18
+    assert scenario['stages']['db_write']['count'] >= 1
+    assert len(built) == 18
+    assert scenario['invalid_answers'] == 0
+
+    # The stand-in keeps the rows and session counters SupabaseHandler would write
+    handler = handlers[0]
+    assert len(handler.responses) == 18
+    assert sorted(session['completed_questions'] for session in handler.sessions.values()) == [9, 9]
+    assert all(session['usage'].requests == 9 for session in handler.sessions.values())
+
+
+def test_benchmark_applies_display_conditions_only_when_given():
+    # 'future' gets a random option per session, so some follow-ups are skipped
+    results = run_benchmark(session_counts=(16,), yaml_repeats=1, seed=1, conditions_path='sample_q.conditions.yml')
+    scenario = results['scenarios']['16']
+    assert results['settings']['conditions_path'] == 'sample_q.conditions.yml'
+    assert 0 < scenario['skipped'] < 16 and scenario['questions'] + scenario['skipped'] == 16 * 9
+
+    assert run_benchmark(session_counts=(1,), yaml_repeats=1, seed=1)['scenarios']['1']['skipped'] == 0
+
+
+def test_compare_to_baseline_flags_regressions_beyond_tolerance():
+    stages = {stage: {'count': 10, 'mean_ms': 5.0, 'p50_ms': 4.0, 'p95_ms': 10.0, 'p99_ms': 20.0} for stage in STAGES}
+    baseline = {
+        'settings': {'questions_path': 'sample_q.yml', 'latency': 0.05},
+        'scenarios': {'100': {'questions_per_second': 200.0, 'stages': stages, 'peak_rss_mb': 100.0, 'traced_peak_mb': None}}
+    }
+    results = copy.deepcopy(baseline)
+    results['scenarios']['100']['questions_per_second'] = 180.0
+    results['scenarios']['100']['stages']['llm']['p95_ms'] = 12.0
+    assert compare_to_baseline(results, baseline) == []
+
+    results['scenarios']['100']['questions_per_second'] = 100.0
+    results['scenarios']['100']['stages']['db_write']['p99_ms'] = 40.0
+    assert compare_to_baseline(results, baseline) == [
+        "100 sessions: throughput 100.0 questions/s, baseline 200.0",
+        "100 sessions: db_write p99_ms 40.0, baseline 20.0"
+    ]
+
+    results['settings']['latency'] = 0.0
+    with pytest.raises(ValueError):
+        compare_to_baseline(results, baseline)
+
+
+def test_percentile_interpolates():
+    assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5
+    assert percentile([5.0], 99) == 5.0
+    assert percentile([], 95) == 0.0
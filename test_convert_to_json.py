@@ -0,0 +1,46 @@
+from convert_to_json import convert_yaml_to_json_objects, dedupe_questions
+
+
+def test_matrix_rows_and_standalone_entries_are_merged():
+    questions = convert_yaml_to_json_objects('sample_q.yml')
+    keys = [question['key'] for question in questions]
+
+    assert len(keys) == len(set(keys))
+    assert keys[2:7] == ['rankings_og_tril', 'rankings_preq', 'rankings_seq', 'rankings_mando', 'rankings_andor']
+    assert questions[2]['matrix_key'] == 'rankings'
+    assert questions[2]['label'].endswith('OG Trilogy (1977-1983)')
+
+
+def test_dedupe_reports_merges_and_fills_missing_fields():
+    questions, merges = dedupe_questions([
+        {'key': 'a', 'type': 'mc', 'label': 'A', 'options': []},
+        {'key': 'b', 'type': 'textarea', 'label': 'B'},
+        {'key': 'a', 'type': 'mc', 'label': 'A again', 'options': ['x', 'y']},
+    ])
+
+    assert [question['key'] for question in questions] == ['a', 'b']
+    assert questions[0]['options'] == ['x', 'y']
+    assert merges == [{'key': 'a', 'kept_index': 0, 'dropped_index': 2, 'conflicts': ['label']}]
+
+
+def test_dedupe_can_be_disabled():
+    assert len(convert_yaml_to_json_objects('sample_q.yml', dedupe=False)) == 14
+
+
+def test_display_conditions_accept_option_labels():
+    questions = convert_yaml_to_json_objects('sample_q.yml', conditions={'continuance': {'future': 'No'}, 'rankings': {'inital_wars': ['Yes']}})
+    by_key = {question['key']: question for question in questions}
+
+    assert by_key['continuance']['show_if'] == {'future': ['no']}
+    # A matrix condition applies to every row
+    assert by_key['rankings_andor']['show_if'] == {'inital_wars': ['yes']}
+    assert 'show_if' not in by_key['future']
+
+
+def test_display_condition_on_unknown_question_is_rejected():
+    try:
+        convert_yaml_to_json_objects('sample_q.yml', conditions={'continuance': {'past': 'No'}})
+    except ValueError as e:
+        assert "unknown question 'past'" in str(e)
+    else:
+        raise AssertionError("expected ValueError")
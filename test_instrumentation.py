@@ -0,0 +1,67 @@
+import io
+import json
+import logging
+import openai
+from fake_openai_server import FakeOpenAIServer
+from instrumentation import JsonFormatter, Metrics, SamplingFilter, metrics
+from llm_question_handler import ask_question_result
+from rate_limiter import LLMScheduler, RateLimiter
+
+QUESTION = {'key': 'fav', 'type': 'mc', 'label': 'Favourite?', 'options': ['yes', 'no']}
+
+
+def test_render_and_merge():
+    registry = Metrics(buckets=(0.1, 1.0))
+    registry.inc('db_rows_written_total', 5, table='survey_responses')
+    registry.observe('db_query_seconds', 0.05, operation='bulk_insert_responses')
+    registry.observe('db_query_seconds', 0.5, operation='bulk_insert_responses')
+
+    text = registry.render()
+    assert '# TYPE surveybot_db_query_seconds histogram' in text
+    assert 'surveybot_db_rows_written_total{table="survey_responses"} 5.0' in text
+    assert 'surveybot_db_query_seconds_bucket{operation="bulk_insert_responses",le="0.1"} 1' in text
+    assert 'surveybot_db_query_seconds_bucket{operation="bulk_insert_responses",le="+Inf"} 2' in text
+    assert 'surveybot_db_query_seconds_count{operation="bulk_insert_responses"} 2' in text
+
+    # Worker snapshots survive a JSON round trip and add up in the parent
+    parent = Metrics(buckets=(0.1, 1.0))
+    parent.merge(json.loads(json.dumps(registry.snapshot())))
+    parent.merge(registry.snapshot())
+    assert parent.value('db_rows_written_total', table='survey_responses') == 10
+    assert parent.value('db_query_seconds', operation='bulk_insert_responses') == 4
+
+
+def test_scheduler_records_attempts_tokens_and_validations():
+    metrics.reset()
+    with FakeOpenAIServer(statuses=[500]) as server:
+        client = openai.OpenAI(api_key='test', base_url=server.base_url)
+        result = ask_question_result(QUESTION, scheduler=LLMScheduler(client, RateLimiter(), base_delay=0.01))
+
+    assert result.ok
+    assert metrics.value('llm_attempt_seconds', status='server_error') == 1
+    assert metrics.value('llm_attempt_seconds', status='ok') == 1
+    assert metrics.value('llm_retries_total', status='server_error') == 1
+    assert metrics.value('llm_requests_total', status='ok') == 1
+    assert metrics.value('llm_tokens_total', kind='output') > 0
+    assert metrics.value('answer_validations_total', method='exact', valid=True) == 1
+
+
+def test_structured_logs_are_sampled():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(SamplingFilter(0.25))
+    logger = logging.getLogger('test_instrumentation')
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        for _ in range(8):
+            logger.info("Inserted responses", extra={'responses': 10, 'sample': True})
+        logger.error("Database operation failed", extra={'operation': 'add_run_usage'})
+    finally:
+        logger.removeHandler(handler)
+
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [entry['message'] for entry in entries] == ["Inserted responses"] * 2 + ["Database operation failed"]
+    assert entries[0]['responses'] == 10 and entries[0]['sampled_1_in'] == 4
+    assert entries[-1]['level'] == 'error' and entries[-1]['operation'] == 'add_run_usage'
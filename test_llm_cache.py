@@ -0,0 +1,97 @@
+import pytest
+import llm_cache
+from llm_cache import LLMCache
+
+
+class Clock:
+    """Stands in for time.time() so TTLs can be crossed without sleeping"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_cache.time, 'time', clock)
+    return clock
+
+
+def _request(text):
+    return {'model': 'gpt-4o-mini', 'messages': [{'role': 'user', 'content': text}], 'temperature': 0.7}
+
+
+def test_memory_tier_evicts_least_recently_used(clock):
+    cache = LLMCache(max_memory_entries=2)
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    assert cache.get('a') == 'A'  # 'b' is now the least recently used
+    cache.set('c', 'C')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A' and cache.get('c') == 'C'
+    assert cache.stats()['memory_entries'] == 2
+
+
+def test_entries_expire_in_both_tiers(clock, tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    with LLMCache(path, ttl=60) as cache:
+        cache.set('k', 'answer')
+        clock.now += 59
+        assert cache.get('k') == 'answer'
+        clock.now += 2
+        assert cache.get('k') is None
+        assert cache.stats()['memory_entries'] == 0
+        assert cache.stats()['disk_entries'] == 0
+
+    # An entry only on disk (fresh process) is served, then expires there too
+    with LLMCache(path, ttl=60) as cache:
+        cache.set('k', 'answer')
+    with LLMCache(path, ttl=60) as cache:
+        assert cache.get('k') == 'answer'
+        assert cache.stats()['disk_hits'] == 1
+    clock.now += 61
+    with LLMCache(path, ttl=60) as cache:
+        assert cache.get('k') is None
+        assert cache.stats()['disk_entries'] == 0
+
+
+def test_disk_tier_evicts_least_recently_accessed(clock, tmp_path):
+    with LLMCache(str(tmp_path / 'cache.sqlite3'), max_memory_entries=1, max_disk_entries=10, ttl=None) as cache:
+        for i in range(10):
+            clock.now += 1
+            cache.set(f"k{i}", str(i))
+        clock.now += 1
+        assert cache.get('k0') == '0'  # touched, so it survives eviction
+        clock.now += 1
+        cache.set('k10', '10')
+        assert cache.stats()['disk_entries'] == 9
+        assert cache.get('k0') == '0'
+        assert cache.get('k1') is None and cache.get('k2') is None
+        assert cache.get('k10') == '10'
+
+
+def test_modes_control_reads_and_writes(clock):
+    cache = LLMCache()
+    request = _request('Favourite film?')
+    assert cache.lookup(request) is None
+    cache.store(request, 'A New Hope')
+    assert cache.lookup(request) == 'A New Hope'
+    # Requests differing only in fields that do not affect the answer share a key
+    assert cache.lookup({**request, 'user': 'someone'}) == 'A New Hope'
+    assert cache.lookup({**request, 'temperature': 0.0}) is None
+
+    assert cache.lookup(request, mode='refresh') is None
+    cache.store(request, 'Empire', mode='refresh')
+    assert cache.lookup(request) == 'Empire'
+
+    assert cache.lookup(request, mode='bypass') is None
+    cache.store(request, 'Jedi', mode='bypass')
+    assert cache.lookup(request) == 'Empire'
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['refreshes']) == (4, 2, 1)
+    with pytest.raises(ValueError):
+        cache.lookup(request, mode='sometimes')
@@ -0,0 +1,50 @@
+import asyncio
+import json
+import openai
+from fake_openai_server import FakeOpenAIServer
+from llm_question_handler import ask_survey_results, ask_survey_results_async
+from rate_limiter import LLMScheduler
+from token_usage import TokenUsage
+
+QUESTIONS = [
+    {'key': 'fav', 'type': 'mc', 'label': 'Favourite?', 'options': ['yes', 'no']},
+    {'key': 'why', 'type': 'textarea', 'label': 'Why?'},
+]
+
+
+def survey_answer(survey_content):
+    """Answers the survey call with survey_content and single questions sensibly"""
+    def answer(body):
+        if 'response_format' in body:
+            return survey_content
+        return 'No' if 'Available options' in body['messages'][-1]['content'] else 'Because.'
+    return answer
+
+
+def test_malformed_survey_response_falls_back_to_single_questions():
+    usage = TokenUsage()
+    with FakeOpenAIServer(answer=survey_answer('Sure! fav: yes')) as server:
+        client = openai.OpenAI(api_key='test', base_url=server.base_url)
+        results = ask_survey_results(QUESTIONS, scheduler=LLMScheduler(client), usage=usage)
+        received = server.received
+
+    assert len(received) == 3 and 'response_format' in received[0]
+    assert {key: result.answer for key, result in results.items()} == {'fav': 'no', 'why': 'Because.'}
+    # The survey call is billed once even though none of its answers were used
+    assert usage.requests == 1
+    assert all(result.usage is not None for result in results.values())
+
+
+def test_partial_survey_response_reasks_only_the_missing_keys():
+    usage = TokenUsage()
+    with FakeOpenAIServer(answer=survey_answer(json.dumps({'fav': 'YES'}))) as server:
+        async def main():
+            client = openai.AsyncOpenAI(api_key='test', base_url=server.base_url)
+            return await ask_survey_results_async(QUESTIONS, scheduler=LLMScheduler(client), usage=usage)
+        results = asyncio.run(main())
+        received = server.received
+
+    assert len(received) == 2 and 'Why?' in received[1]['messages'][-1]['content']
+    assert results['fav'].answer == 'yes' and results['fav'].usage is None
+    assert results['why'].answer == 'Because.' and results['why'].usage is not None
+    assert usage.requests == 1
@@ -0,0 +1,38 @@
+import asyncio
+import openai_clients
+from openai_clients import aclose_openai_clients, close_openai_clients, get_async_openai_client, get_openai_client
+
+
+def test_sync_client_is_shared_per_key_and_closed():
+    client = get_openai_client('key-a', 'http://127.0.0.1:1/v1')
+    assert get_openai_client('key-a', 'http://127.0.0.1:1/v1') is client
+    assert get_openai_client('key-b', 'http://127.0.0.1:1/v1') is not client
+
+    close_openai_clients()
+    assert client.is_closed()
+    assert openai_clients._clients == {}
+    # A closed client is replaced on the next call
+    replacement = get_openai_client('key-a', 'http://127.0.0.1:1/v1')
+    assert replacement is not client and not replacement.is_closed()
+    close_openai_clients()
+
+
+def test_async_clients_are_kept_per_event_loop():
+    async def clients():
+        first = get_async_openai_client('key-a', 'http://127.0.0.1:1/v1')
+        second = get_async_openai_client('key-a', 'http://127.0.0.1:1/v1')
+        return first, second
+
+    async def closed_after_aclose():
+        client = get_async_openai_client('key-a', 'http://127.0.0.1:1/v1')
+        await aclose_openai_clients()
+        return client, asyncio.get_running_loop()
+
+    first, second = asyncio.run(clients())
+    assert first is second
+    other_loop, _ = asyncio.run(clients())
+    assert other_loop is not first
+
+    client, loop = asyncio.run(closed_after_aclose())
+    assert client.is_closed()
+    assert loop not in openai_clients._async_clients
@@ -0,0 +1,51 @@
+import openai
+from convert_to_json import convert_yaml_to_json_objects
+from fake_openai_server import FakeOpenAIServer
+from llm_question_handler import ask_question_result
+from option_matcher import OptionMatcher
+from rate_limiter import LLMScheduler
+
+QUESTIONS = {question['key']: question for question in convert_yaml_to_json_objects('sample_q.yml')}
+
+
+def test_labels_values_and_near_misses():
+    matcher = OptionMatcher(QUESTIONS['rankings_preq'])
+
+    assert matcher.match('Neutral').value == 'neutral'
+    assert matcher.match(' "good." ').method == 'normalized'
+    assert matcher.match('Good, mostly').value == 'good'
+    near = matcher.match('goood')
+    assert near.valid and near.value == 'good' and near.method == 'fuzzy' and near.confidence < 1
+    assert not matcher.match('Bad and good').valid
+    assert not matcher.match(None).valid
+
+
+def test_slider_answers_are_parsed_as_numbers():
+    matcher = OptionMatcher(QUESTIONS['overall_opinion'])
+
+    assert [m.value for m in matcher.match_many(['7', 7, 'I would say 7/10', '7.0'])] == [7.0] * 4
+    # Numbers that restate the scale do not win over the answer
+    assert matcher.match("On a scale of 0 to 10 I'd say 7").value == 7.0
+    assert matcher.match("7 out of 10").value == 7.0
+    assert matcher.match("Somewhere between 7.5 and 8, so 8").value == 8.0
+    assert not matcher.match('-3').valid
+    assert not matcher.match('7.5').valid
+    assert not matcher.match('eleven').valid
+
+
+def test_slider_question_is_asked_with_its_options():
+    with FakeOpenAIServer(answer=lambda body: 'I would give it an 8.') as server:
+        scheduler = LLMScheduler(openai.OpenAI(api_key='test', base_url=server.base_url))
+        result = ask_question_result(QUESTIONS['overall_opinion'], scheduler=scheduler)
+
+    assert result.ok and result.answer == 8.0
+    assert 'Available options: 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10' in server.received[0]['messages'][-1]['content']
+
+
+def test_unmatched_answers_are_reported():
+    with FakeOpenAIServer(answer=lambda body: 'Maybe') as server:
+        scheduler = LLMScheduler(openai.OpenAI(api_key='test', base_url=server.base_url))
+        result = ask_question_result(QUESTIONS['inital_wars'], scheduler=scheduler)
+
+    assert result.status == 'invalid_answer' and result.answer is None
+    assert result.content == 'Maybe' and 'inital_wars' in result.error
@@ -0,0 +1,68 @@
+import json
+import pytest
+from persona_population import PersonaPopulation
+
+CONFIG = {
+    'template': "You are a {age_group} respondent who is {fandom} Star Wars fan.",
+    'attributes': {
+        'age_group': {'18-29': 0.2, '30-44': 0.3, '45-64': 0.3, '65+': 0.2},
+        'fandom': ['a lifelong', 'a casual', 'not a'],
+    }
+}
+
+
+def test_same_seed_gives_the_same_population():
+    first = PersonaPopulation.sample(CONFIG, 1000, seed=7)
+    again = PersonaPopulation.sample(CONFIG, 1000, seed=7)
+
+    assert (first.codes == again.codes).all()
+    assert first.personas() == again.personas()
+    assert not (PersonaPopulation.sample(CONFIG, 1000, seed=8).codes == first.codes).all()
+
+
+def test_prompts_are_rendered_once_per_combination():
+    population = PersonaPopulation.sample(CONFIG, 20_000, seed=1)
+    personas = population.personas()
+
+    assert len(population.prompts) == 12
+    assert len({id(persona['system_prompt']) for persona in personas}) == 12
+    assert personas[0]['system_prompt'] == CONFIG['template'].format(**personas[0]['attributes'])
+    # Sampled shares follow the configured marginals
+    assert abs(population.frequencies()['age_group']['30-44'] - 0.3) < 0.02
+
+
+def test_session_ids_and_rows():
+    population = PersonaPopulation.sample(CONFIG, 3, seed=0)
+    personas = population.personas(['a', 'b', 'c'])
+
+    assert [persona['session_id'] for persona in personas] == ['a', 'b', 'c']
+    assert [row[:2] for row in population.to_rows(['a', 'b', 'c'])] == [('a', 0), ('b', 1), ('c', 2)]
+
+
+def test_template_must_use_known_attributes():
+    with pytest.raises(ValueError, match="unknown attributes: region"):
+        PersonaPopulation.sample(dict(CONFIG, template="From {region}"), 10)
+
+
+def test_store_population_round_trips_and_rejects_a_different_sample(pg_handler):
+    population = PersonaPopulation.sample(CONFIG, 50, seed=3)
+    session_ids = [f"s{i}" for i in range(50)]
+    assert pg_handler.store_population('run-a', population, session_ids)
+    # Storing it again (a resumed run) changes nothing
+    assert pg_handler.store_population('run-a', population, session_ids)
+
+    with pg_handler.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT seed, size, config::text FROM survey_populations")
+            [(seed, size, config)] = cursor.fetchall()
+            cursor.execute("SELECT session_id, persona_index, attributes FROM survey_personas WHERE run_id = 'run-a' ORDER BY persona_index")
+            rows = cursor.fetchall()
+    assert (seed, size) == (3, 50) and len(rows) == 50
+
+    # The stored seed and config reproduce the personas
+    again = PersonaPopulation.sample(json.loads(config), size, seed=seed)
+    assert [(session_id, attributes) for session_id, _, attributes in rows] == [
+        (persona['session_id'], persona['attributes']) for persona in again.personas(session_ids)
+    ]
+
+    assert not pg_handler.store_population('run-a', PersonaPopulation.sample(CONFIG, 50, seed=4), session_ids)
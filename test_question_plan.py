@@ -0,0 +1,86 @@
+import json
+import os
+import pytest
+import question_plan
+from question_plan import QuestionPlan, load_question_plan
+
+QUESTIONNAIRE = """
+future:
+  type: mc
+  label: Is the franchise heading in the right direction?
+  options:
+    'Yes': 'yes'
+    'No': 'no'
+continuance:
+  type: textarea
+  label: Why not?
+"""
+
+
+@pytest.fixture
+def questionnaire(tmp_path, monkeypatch):
+    monkeypatch.setattr(question_plan, '_plan_cache', {})
+    path = tmp_path / 'survey.yml'
+    path.write_text(QUESTIONNAIRE, encoding='utf-8')
+    return path
+
+
+def _touch(path, mtime_ns):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_cached_plan_is_reused_until_mtime_or_conditions_change(questionnaire, monkeypatch):
+    compiled = []
+    compile_plan = QuestionPlan.compile.__func__
+    monkeypatch.setattr(QuestionPlan, 'compile', classmethod(lambda cls, *args: compiled.append(args) or compile_plan(cls, *args)))
+
+    plan = load_question_plan(str(questionnaire))
+    assert load_question_plan(str(questionnaire)) is plan
+    assert len(compiled) == 1
+
+    _touch(questionnaire, plan.source_mtime_ns + 1_000_000_000)
+    touched = load_question_plan(str(questionnaire))
+    assert touched is not plan and len(compiled) == 2
+
+    conditions = {'continuance': {'future': 'No'}}
+    gated = load_question_plan(str(questionnaire), conditions=conditions)
+    assert gated is not touched and len(compiled) == 3
+    assert gated.questions[gated.index_by_key['continuance']]['show_if'] == {'future': ['no']}
+    assert load_question_plan(str(questionnaire), conditions=conditions) is gated
+    assert len(compiled) == 3
+
+
+def test_artifact_round_trips_and_stale_versions_are_recompiled(questionnaire, tmp_path, monkeypatch):
+    artifact = tmp_path / 'survey.plan.json'
+    plan = load_question_plan(str(questionnaire), artifact_path=str(artifact))
+    loaded = QuestionPlan.load(str(artifact))
+    assert loaded.to_dict() == plan.to_dict()
+    assert loaded.prompts == plan.prompts
+    assert loaded.validate(0, 'YES') == (True, 'yes')
+
+    # A fresh process (empty memory cache) uses the artifact without parsing YAML
+    monkeypatch.setattr(question_plan, '_plan_cache', {})
+    monkeypatch.setattr(QuestionPlan, 'compile', classmethod(lambda cls, *args: pytest.fail("recompiled")))
+    assert load_question_plan(str(questionnaire), artifact_path=str(artifact)).to_dict() == plan.to_dict()
+
+    data = json.loads(artifact.read_text(encoding='utf-8'))
+    data['format_version'] = QuestionPlan.FORMAT_VERSION - 1
+    artifact.write_text(json.dumps(data), encoding='utf-8')
+    with pytest.raises(ValueError, match='format version'):
+        QuestionPlan.load(str(artifact))
+
+    # load_question_plan ignores the stale artifact, recompiles and rewrites it
+    monkeypatch.undo()
+    monkeypatch.setattr(question_plan, '_plan_cache', {})
+    assert load_question_plan(str(questionnaire), artifact_path=str(artifact)).to_dict() == plan.to_dict()
+    assert json.loads(artifact.read_text(encoding='utf-8'))['format_version'] == QuestionPlan.FORMAT_VERSION
+
+
+def test_subset_reuses_prebuilt_prompts_and_matchers(questionnaire):
+    plan = load_question_plan(str(questionnaire))
+    subset = plan.subset([1])
+    assert subset.keys == ['continuance'] and subset.index_by_key == {'continuance': 0}
+    assert subset.prompts[0] is plan.prompts[1] and subset.matchers[0] is plan.matchers[1]
+    assert subset.prepare_request(0) == plan.prepare_request(1)
+    # The cached plan itself is left untouched
+    assert plan.keys == ['future', 'continuance']
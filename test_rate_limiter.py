@@ -0,0 +1,102 @@
+import asyncio
+from types import SimpleNamespace
+import openai
+from fake_openai_server import FakeOpenAIServer
+from instrumentation import metrics
+from llm_question_handler import ask_question_result
+from rate_limiter import LLMScheduler, RateLimiter, TokenBucket, parse_reset_duration
+from survey_runner import answer_questions_async
+
+QUESTION = {'key': 'fav', 'type': 'mc', 'label': 'Favourite?', 'options': ['yes', 'no']}
+
+
+def test_parse_reset_duration():
+    assert parse_reset_duration('20ms') == 0.02
+    assert parse_reset_duration('6m0s') == 360.0
+    assert parse_reset_duration('1.5s') == 1.5
+    assert parse_reset_duration(None) is None
+
+
+def test_exhausted_budget_waits_for_the_reported_reset():
+    limiter = RateLimiter(requests_per_minute=600)
+    limiter.update_from_headers({'x-ratelimit-remaining-requests': '5', 'x-ratelimit-reset-requests': '30s'})
+    assert limiter.reserve(1) == 0
+
+    limiter.update_from_headers({'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '6m0s'})
+    assert 359 < limiter.reserve(1) <= 360
+
+    # The fake server reports its minute window the same way
+    with FakeOpenAIServer(requests_per_minute=2) as server:
+        scheduler = LLMScheduler(openai.OpenAI(api_key='test', base_url=server.base_url), RateLimiter())
+        assert ask_question_result(QUESTION, scheduler=scheduler).ok
+        assert ask_question_result(QUESTION, scheduler=scheduler).ok
+    assert 50 < scheduler.limiter.reserve(0) <= 60
+
+
+def test_token_bucket_queues_reservations_past_capacity():
+    bucket = TokenBucket(60, per_seconds=60)
+    assert bucket.reserve(60) == 0
+    # One token per second refill: the next two reservations wait in line
+    assert 0.9 < bucket.reserve(1) <= 1.0
+    assert 1.9 < bucket.reserve(1) <= 2.0
+
+
+def test_429s_are_retried_and_limits_adopted_from_headers():
+    with FakeOpenAIServer(statuses=[429, 429], requests_per_minute=1000, retry_after=0.01) as server:
+        client = openai.OpenAI(api_key='test', base_url=server.base_url)
+        scheduler = LLMScheduler(client, RateLimiter(), base_delay=0.01)
+        result = ask_question_result(QUESTION, scheduler=scheduler)
+
+    assert result.ok and result.answer == 'yes'
+    assert result.attempts == 3
+    # The client's own retries are off: every attempt went through the scheduler
+    assert server.responses == [429, 429, 200]
+    assert scheduler.limiter.requests.capacity == 1000
+    assert scheduler.stats() == {'requests': 3, 'retries': 2, 'rate_limited': 2, 'failures': 0}
+
+
+def test_persistent_failures_are_not_written_as_answers():
+    class RecordingWriter:
+        def __init__(self):
+            self.rows = []
+
+        def add_many(self, session_id, responses):
+            self.rows.extend(responses)
+
+        def add_usage(self, session_id, usage):
+            pass
+
+    why = {'key': 'why', 'type': 'textarea', 'label': 'Why?'}
+    with FakeOpenAIServer(statuses=[400]) as server:
+        async def run():
+            client = openai.AsyncOpenAI(api_key='test', base_url=server.base_url)
+            scheduler = LLMScheduler(client, max_attempts=2, base_delay=0.01)
+            # max_concurrency=1 sends the questions in order, so 'fav' gets the 400
+            return await answer_questions_async([QUESTION, why], max_concurrency=1, writer=writer, session_id='s1', scheduler=scheduler)
+
+        writer = RecordingWriter()
+        answers = asyncio.run(run())
+
+    assert answers[0]['status'] == 'invalid_request' and answers[0]['answer'] is None
+    assert answers[1] == {'key': 'why', 'answer': 'No strong opinion.', 'status': 'ok'}
+    assert [row['question']['key'] for row in writer.rows] == ['why']
+
+
+def test_unparseable_responses_fail_without_counting_as_ok():
+    class BrokenRaw:
+        headers = {}
+
+        def parse(self):
+            raise ValueError("unexpected response body")
+
+    completions = SimpleNamespace(with_raw_response=SimpleNamespace(create=lambda **request: BrokenRaw()))
+    client = SimpleNamespace(with_options=lambda **options: SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    scheduler = LLMScheduler(client, RateLimiter())
+    metrics.reset()
+
+    result = scheduler.complete({'model': 'gpt-4o-mini', 'messages': [{'role': 'user', 'content': 'Hi'}]})
+
+    assert result.status == 'error' and 'unexpected response body' in result.error
+    assert metrics.value('llm_requests_total', status='ok') == 0
+    assert metrics.value('llm_requests_total', status='error') == 1
+    assert scheduler.stats()['failures'] == 1 and not scheduler.usage
@@ -0,0 +1,98 @@
+import json
+from datetime import date, datetime, timedelta
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+import response_export
+from response_export import _long_schema, export_responses_to_parquet, iter_session_groups, pivot_responses
+
+OPTIONS = json.dumps(['yes', 'no'])
+T0 = datetime(2026, 5, 1, 12, 0)
+
+
+def _long(rows):
+    """Long-format table from (session_id, question_key, answer, options, minutes after T0, session day)"""
+    columns = list(zip(*[
+        (session_id, key, answer, options, T0 + timedelta(minutes=minutes), date(2026, 5, day))
+        for session_id, key, answer, options, minutes, day in rows
+    ]))
+    return pa.table([pa.array(column, type=field.type) for column, field in zip(columns, _long_schema())], schema=_long_schema())
+
+
+def test_pivot_encodes_options_keeps_unknown_answers_and_latest_wins():
+    wide = pivot_responses(_long([
+        ('s1', 'fav', 'no', OPTIONS, 0, 1),
+        ('s1', 'why', 'Because.', None, 1, 1),
+        ('s2', 'fav', 'maybe', OPTIONS, 2, 1),
+        # s1 changed its answer later; the row order of the stream does not matter
+        ('s1', 'fav', 'yes', OPTIONS, 5, 1),
+    ]))
+
+    assert wide.column_names == ['session_id', 'session_date', 'fav', 'why']
+    fav = wide.column('fav').combine_chunks()
+    assert pa.types.is_dictionary(fav.type)
+    assert fav.dictionary.to_pylist() == ['yes', 'no', 'maybe']
+    assert dict(zip(wide.column('session_id').to_pylist(), fav.to_pylist())) == {'s1': 'yes', 's2': 'maybe'}
+    assert wide.column('why').type == pa.string()
+    assert wide.column('why').to_pylist() == ['Because.', None]
+
+
+def test_session_groups_cut_on_dates_and_session_boundaries():
+    long_table = _long([
+        ('a', 'q1', 'x', None, 0, 1), ('a', 'q2', 'x', None, 0, 1), ('a', 'q3', 'x', None, 0, 1),
+        ('b', 'q1', 'x', None, 0, 1), ('b', 'q2', 'x', None, 0, 1),
+        ('c', 'q1', 'x', None, 0, 1),
+        ('d', 'q1', 'x', None, 0, 2), ('d', 'q2', 'x', None, 0, 2),
+    ])
+    # Record batches of two rows split sessions a and d across batches
+    batches = long_table.to_batches(max_chunksize=2)
+
+    groups = list(iter_session_groups(iter(batches), group_rows=4))
+    assert [sorted(set(group.column('session_id').to_pylist())) for group in groups] == [['a', 'b'], ['c'], ['d']]
+    assert sum(group.num_rows for group in groups) == long_table.num_rows
+    assert [group.num_rows for group in iter_session_groups(iter(batches), group_rows=100)] == [6, 2]
+
+
+def test_watermark_advances_and_is_reused(tmp_path, monkeypatch):
+    cut_offs = iter([T0, T0 + timedelta(hours=1)])
+    reads = []
+
+    def fake_batches(handler, since, until, batch_size):
+        reads.append((since, until))
+        return _long([('s1', 'fav', 'yes', OPTIONS, 0, 1)]).to_batches()
+    monkeypatch.setattr(response_export, '_export_upper_bound', lambda handler, settle_seconds: next(cut_offs))
+    monkeypatch.setattr(response_export, 'iter_response_batches', fake_batches)
+    state_path = str(tmp_path / 'state.json')
+
+    first = export_responses_to_parquet(None, str(tmp_path / 'out'), state_path)
+    second = export_responses_to_parquet(None, str(tmp_path / 'out'), state_path)
+
+    assert reads == [(None, T0), (T0, T0 + timedelta(hours=1))]
+    assert (first['watermark'], second['watermark']) == (T0.isoformat(), (T0 + timedelta(hours=1)).isoformat())
+    assert json.loads((tmp_path / 'state.json').read_text())['watermark'] == second['watermark']
+    assert len(first['files']) == 1 and first['files'][0].split('/')[-2] == 'session_date=2026-05-01'
+
+
+def test_incremental_export_from_postgres(pg_handler, tmp_path):
+    question = {'key': 'fav', 'type': 'mc', 'label': 'Favourite?', 'options': ['yes', 'no']}
+    state_path = str(tmp_path / 'state.json')
+    out = str(tmp_path / 'out')
+
+    assert pg_handler.bulk_insert_responses([{'session_id': f"s{i}", 'question': question, 'answer': 'yes'} for i in range(3)])
+    first = export_responses_to_parquet(pg_handler, out, state_path, settle_seconds=0, group_rows=2)
+    assert (first['rows'], first['sessions'], len(first['files'])) == (3, 3, 2)
+
+    assert export_responses_to_parquet(pg_handler, out, state_path, settle_seconds=0)['rows'] == 0
+    assert pg_handler.bulk_insert_responses([{'session_id': 's9', 'question': question, 'answer': 'no'}])
+    third = export_responses_to_parquet(pg_handler, out, state_path, settle_seconds=0)
+    assert (third['rows'], third['sessions']) == (1, 1)
+    table = pq.read_table(third['files'][0])
+    assert table.column('session_id').to_pylist() == ['s9'] and table.column('fav').to_pylist() == ['no']
+
+    # A replaced answer keeps its created_at but is exported again
+    assert pg_handler.bulk_insert_responses([{'session_id': 's0', 'question': question, 'answer': 'no'}])
+    fourth = export_responses_to_parquet(pg_handler, out, state_path, settle_seconds=0)
+    assert (fourth['rows'], fourth['sessions']) == (1, 1)
+    table = pq.read_table(fourth['files'][0])
+    assert table.column('session_id').to_pylist() == ['s0'] and table.column('fav').to_pylist() == ['no']
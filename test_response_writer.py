@@ -0,0 +1,146 @@
+import threading
+import time
+import pytest
+from response_writer import ResponseWriter
+from token_usage import TokenUsage
+
+QUESTION = {'key': 'fav', 'type': 'mc', 'label': 'Favourite?', 'options': ['yes', 'no']}
+
+
+class RecordingHandler:
+    """Records bulk writes with their time; delays and failures are scripted per call"""
+
+    def __init__(self, delays=(), fail=False, usage_delay=0.0, usage_fails=False, raises=0):
+        self.batches = []
+        self.usage = []
+        self.delays = list(delays)
+        self.fail = fail
+        self.usage_delay = usage_delay
+        self.usage_fails = usage_fails
+        # Number of calls (of either method) that raise, as an unreachable database would
+        self.raises = raises
+        self.release = threading.Event()
+        self.release.set()
+
+    def _maybe_raise(self):
+        if self.raises:
+            self.raises -= 1
+            raise ConnectionError("database unreachable")
+
+    def bulk_insert_responses(self, responses):
+        self.release.wait()
+        self._maybe_raise()
+        if self.delays:
+            time.sleep(self.delays.pop(0))
+        self.batches.append((time.monotonic(), [response['answer'] for response in responses]))
+        return not self.fail
+
+    def add_session_usage(self, usage):
+        time.sleep(self.usage_delay)
+        self._maybe_raise()
+        self.usage.append(usage)
+        return not self.usage_fails
+
+
+def test_batches_are_written_when_full_or_when_the_interval_passes():
+    handler = RecordingHandler()
+    with ResponseWriter(handler, max_batch_size=3, flush_interval=60.0) as writer:
+        writer.add_many('s1', [{'question': QUESTION, 'answer': answer} for answer in 'abc'])
+        time.sleep(0.2)
+        assert [answers for _, answers in handler.batches] == [['a', 'b', 'c']]
+
+    handler = RecordingHandler()
+    with ResponseWriter(handler, max_batch_size=100, flush_interval=0.1) as writer:
+        started = time.monotonic()
+        writer.add('s1', QUESTION, 'a')
+        time.sleep(0.4)
+        assert [answers for _, answers in handler.batches] == [['a']]
+        assert 0.08 <= handler.batches[0][0] - started < 0.35
+
+
+def test_leftovers_of_a_partial_batch_keep_their_age():
+    # The first write is slow, so three answers pile up behind it; the one
+    # left over after the next full batch is due flush_interval after it was
+    # added, not flush_interval after that batch was taken
+    handler = RecordingHandler(delays=[0.4])
+    with ResponseWriter(handler, max_batch_size=2, flush_interval=1.0) as writer:
+        started = time.monotonic()
+        writer.add_many('s1', [{'question': QUESTION, 'answer': answer} for answer in 'xy'])
+        time.sleep(0.05)
+        writer.add_many('s2', [{'question': QUESTION, 'answer': answer} for answer in 'abc'])
+        time.sleep(1.3)
+        assert [answers for _, answers in handler.batches] == [['x', 'y'], ['a', 'b'], ['c']]
+        assert handler.batches[2][0] - started < 1.25
+
+
+def test_add_blocks_while_max_buffered_responses_wait():
+    handler = RecordingHandler()
+    handler.release.clear()
+    writer = ResponseWriter(handler, max_batch_size=1, flush_interval=0.0, max_buffered=2)
+    writer.add('s1', QUESTION, 'a')
+    time.sleep(0.1)
+    # 'a' is being written; two more fill the buffer and the next add waits
+    writer.add('s1', QUESTION, 'b')
+    writer.add('s1', QUESTION, 'c')
+    blocked = threading.Thread(target=writer.add, args=('s1', QUESTION, 'd'))
+    blocked.start()
+    time.sleep(0.2)
+    assert blocked.is_alive()
+    handler.release.set()
+    blocked.join(1.0)
+    assert not blocked.is_alive()
+    assert writer.close()
+    assert [answers for _, answers in handler.batches] == [['a'], ['b'], ['c'], ['d']]
+
+
+def test_flush_waits_for_responses_and_usage():
+    handler = RecordingHandler(usage_delay=0.2)
+    writer = ResponseWriter(handler, max_batch_size=100, flush_interval=60.0)
+    writer.add('s1', QUESTION, 'a')
+    usage = TokenUsage()
+    usage.prompt_tokens = 10
+    writer.add_usage('s1', usage)
+    assert writer.flush()
+    assert writer.written_count == 1
+    assert [u['s1'].prompt_tokens for u in handler.usage] == [10]
+
+    # Usage alone is flushed too
+    writer.add_usage('s1', usage)
+    assert writer.flush()
+    assert len(handler.usage) == 2
+    assert writer.close()
+    with pytest.raises(RuntimeError):
+        writer.add('s1', QUESTION, 'b')
+
+
+def test_failed_writes_are_reported_by_flush_and_close():
+    handler = RecordingHandler(fail=True)
+    writer = ResponseWriter(handler, flush_interval=60.0)
+    writer.add('s1', QUESTION, 'a')
+    assert not writer.flush()
+    assert [[response['answer'] for response in batch] for batch in writer.failed_batches] == [['a']]
+    assert not writer.close()
+
+    handler = RecordingHandler(usage_fails=True)
+    writer = ResponseWriter(handler, flush_interval=60.0)
+    writer.add_usage('s1', TokenUsage())
+    assert not writer.close()
+    assert list(writer.failed_usage) == ['s1']
+
+
+def test_a_raising_handler_fails_the_batch_and_the_writer_keeps_going():
+    handler = RecordingHandler(raises=2)
+    writer = ResponseWriter(handler, max_batch_size=1, flush_interval=60.0, max_buffered=1)
+    writer.add('s1', QUESTION, 'a')
+    writer.add_usage('s1', TokenUsage())
+    # Neither raise kills the thread, so flush returns instead of waiting forever
+    assert not writer.flush(timeout=2)
+    assert [[response['answer'] for response in batch] for batch in writer.failed_batches] == [['a']]
+    assert list(writer.failed_usage) == ['s1']
+
+    # Producers held back by max_buffered are still served
+    for answer in 'bcd':
+        writer.add('s1', QUESTION, answer)
+    assert not writer.flush(timeout=2)
+    assert writer.written_count == 3
+    assert not writer.close()
@@ -0,0 +1,305 @@
+import inspect
+import re
+import threading
+import time
+from datetime import datetime
+import pytest
+import supabase_handler
+from fake_supabase_handler import FakeSupabaseHandler
+from supabase_handler import MIGRATIONS, SupabaseHandler
+from token_usage import TokenUsage
+
+QUESTION = {'key': 'fav', 'type': 'mc', 'label': 'Favourite?', 'options': ['yes', 'no']}
+
+
+def _query(handler, sql, params=None):
+    with handler.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+def test_migrations_are_numbered_in_order():
+    versions = [version for version, _, _ in MIGRATIONS]
+    assert versions == list(range(1, len(MIGRATIONS) + 1))
+    assert len({name for _, name, _ in MIGRATIONS}) == len(MIGRATIONS)
+    assert all(statements for _, _, statements in MIGRATIONS)
+
+
+def test_replayed_answers_replace_and_are_not_counted_twice():
+    handler = FakeSupabaseHandler()
+    batch = [{'session_id': 's1', 'question': QUESTION, 'answer': 'yes'}]
+    assert handler.bulk_insert_responses(batch)
+    assert handler.bulk_insert_responses(batch)
+    assert handler.bulk_insert_responses([dict(batch[0], answer='no')])
+
+    assert [row[4] for row in handler.responses] == ['no']
+    assert handler.sessions['s1']['completed_questions'] == 1
+    assert handler.response_count == 1
+
+
+class StubCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, query, params=None):
+        if self.connection.ping_fails:
+            raise supabase_handler.psycopg2.OperationalError("server closed the connection")
+
+
+class StubConnection:
+    def __init__(self, closed: int = 0, ping_fails: bool = False, rollback_fails: bool = False):
+        self.closed = closed
+        self.ping_fails = ping_fails
+        self.rollback_fails = rollback_fails
+        self.in_transaction = False
+
+    def cursor(self):
+        return StubCursor(self)
+
+    def get_transaction_status(self):
+        extensions = supabase_handler.psycopg2.extensions
+        return extensions.TRANSACTION_STATUS_INTRANS if self.in_transaction else extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        if self.rollback_fails:
+            raise supabase_handler.psycopg2.OperationalError("connection lost")
+        self.in_transaction = False
+
+
+class StubPool:
+    """Hands out the given connections in order and records every putconn"""
+
+    def __init__(self, connections):
+        self.available = list(connections)
+        self.returned = []
+
+    def getconn(self):
+        return self.available.pop(0)
+
+    def putconn(self, connection, close=False):
+        self.returned.append((connection, close))
+        if not close:
+            self.available.append(connection)
+
+
+@pytest.fixture
+def stub_handler(monkeypatch):
+    """Returns a factory of SupabaseHandlers whose pool is a StubPool"""
+    for name, value in (('SUPABASE_HOST', 'stub'), ('SUPABASE_USER', 'stub'), ('SUPABASE_PASSWORD', 'stub')):
+        monkeypatch.setenv(name, value)
+    supabase_handler._import_psycopg2()
+
+    def make(connections, **kwargs):
+        handler = SupabaseHandler(**kwargs)
+        handler._pool = StubPool(connections)
+        return handler
+    return make
+
+
+def test_exhausted_pool_blocks_until_a_connection_is_returned(stub_handler):
+    handler = stub_handler([StubConnection()], max_connections=1)
+    borrowed, release, waited = threading.Event(), threading.Event(), []
+
+    def hold():
+        with handler.connection():
+            borrowed.set()
+            release.wait()
+
+    def wait_for_connection():
+        started = time.monotonic()
+        with handler.connection():
+            waited.append(time.monotonic() - started)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    borrowed.wait()
+    waiter = threading.Thread(target=wait_for_connection)
+    waiter.start()
+    time.sleep(0.2)
+    assert waited == []
+    release.set()
+    holder.join()
+    waiter.join()
+    assert len(waited) == 1 and waited[0] >= 0.15
+
+
+def test_unhealthy_connections_are_replaced_on_checkout(stub_handler):
+    closed, healthy = StubConnection(closed=1), StubConnection()
+    handler = stub_handler([closed, healthy])
+    with handler.connection() as connection:
+        assert connection is healthy
+    assert handler._pool.returned == [(closed, True), (healthy, False)]
+
+    # With a zero interval every checkout pings; a failed ping discards the connection
+    unreachable, healthy = StubConnection(ping_fails=True), StubConnection()
+    handler = stub_handler([unreachable, healthy], health_check_interval=0.0)
+    with handler.connection() as connection:
+        assert connection is healthy
+    assert handler._pool.returned == [(unreachable, True), (healthy, False)]
+
+
+def test_connection_is_rolled_back_and_returned_after_an_exception(stub_handler):
+    connection = StubConnection()
+    handler = stub_handler([connection], max_connections=1)
+    with pytest.raises(RuntimeError):
+        with handler.connection() as borrowed:
+            borrowed.in_transaction = True
+            raise RuntimeError("query failed")
+    assert not connection.in_transaction
+    assert handler._pool.returned == [(connection, False)]
+
+    # A connection that cannot even roll back is closed instead of pooled,
+    # and the slot is released either way
+    connection.rollback_fails = True
+    with pytest.raises(RuntimeError):
+        with handler.connection() as borrowed:
+            borrowed.in_transaction = True
+            raise RuntimeError("query failed")
+    assert handler._pool.returned[-1] == (connection, True)
+    handler._pool = StubPool([StubConnection()])
+    with handler.connection():
+        pass
+
+
+def test_writes_to_an_unreachable_database_return_false(monkeypatch, tmp_path):
+    supabase_handler._import_psycopg2()
+    for name, value in (('SUPABASE_HOST', str(tmp_path / 'nonexistent')), ('SUPABASE_USER', 'surveybot'), ('SUPABASE_PASSWORD', 'x')):
+        monkeypatch.setenv(name, value)
+    handler = SupabaseHandler()
+    assert handler.bulk_insert_responses([{'session_id': 's1', 'question': QUESTION, 'answer': 'yes'}]) is False
+    assert handler.insert_survey_response('s1', QUESTION, 'yes') is False
+    assert handler.add_session_usage({'s1': TokenUsage()}) is False
+    assert handler.ensure_partitions() is False
+
+
+def test_copy_and_values_paths_write_the_same_rows(pg_handler, monkeypatch):
+    execute_values = supabase_handler.psycopg2.extras.execute_values
+    response_statements = []
+
+    def counting_execute_values(cursor, sql, *args, **kwargs):
+        if 'survey_responses' in sql:
+            response_statements.append(sql)
+        return execute_values(cursor, sql, *args, **kwargs)
+    monkeypatch.setattr(supabase_handler.psycopg2.extras, 'execute_values', counting_execute_values)
+
+    answers = ['yes', 'a,b', 'say "hi"', 'line\nbreak', 'ünïcödé', 7]
+    questions = [dict(QUESTION, key=f"q{i}") for i in range(len(answers))]
+
+    def batch(prefix):
+        return [
+            {'session_id': f"{prefix}{s}", 'question': question, 'answer': answer}
+            for s in range(2) for question, answer in zip(questions, answers)
+        ]
+
+    pg_handler.copy_threshold = 5
+    assert pg_handler.bulk_insert_responses(batch('copy-'))
+    assert response_statements == []
+    pg_handler.copy_threshold = 5000
+    assert pg_handler.bulk_insert_responses(batch('values-'))
+    assert len(response_statements) == 1
+
+    def stored(prefix):
+        return _query(pg_handler, """
+            SELECT substr(session_id, length(%s) + 1), question_key, question_label, question_type, answer, options
+            FROM survey_responses WHERE session_id LIKE %s ORDER BY 1, 2
+        """, (prefix, prefix + '%'))
+    assert stored('copy-') == stored('values-')
+    assert len(stored('copy-')) == 12
+    assert sorted(row[4] for row in stored('copy-'))[:3] == ['7', '7', 'a,b']
+    assert _query(pg_handler, "SELECT DISTINCT completed_questions FROM survey_sessions") == [(6,)]
+
+
+def test_iter_table_row_modes_and_conversions(pg_handler):
+    assert pg_handler.bulk_insert_responses([
+        {'session_id': 's1', 'question': dict(QUESTION, key=f"q{i}"), 'answer': 'yes'} for i in range(3)
+    ])
+    columns = ['question_key', 'options', 'created_at']
+
+    rows = list(pg_handler.iter_table('survey_responses', columns, order_by='question_key'))
+    assert [row['question_key'] for row in rows] == ['q0', 'q1', 'q2']
+    assert rows[0]['options'] == '["yes", "no"]'
+    assert isinstance(rows[0]['created_at'], str) and 'T' in rows[0]['created_at']
+
+    raw = next(pg_handler.iter_table('survey_responses', columns, order_by='question_key', row_mode='tuple', convert=False))
+    assert raw[:2] == ('q0', ['yes', 'no']) and isinstance(raw[2], datetime)
+    named = next(pg_handler.iter_table('survey_responses', columns, order_by='question_key', row_mode='namedtuple'))
+    assert (named.question_key, named.options) == ('q0', '["yes", "no"]')
+    assert list(pg_handler.iter_table('survey_responses', where_clause="session_id = %s", params=('none',))) == []
+    with pytest.raises(ValueError):
+        next(pg_handler.iter_table('survey_responses', row_mode='list'))
+
+    responses = list(pg_handler.iter_session_responses('s1'))
+    # Rows written together share created_at, so their order among themselves is arbitrary
+    assert sorted((row['question_key'], row['options']) for row in responses) == [('q0', ['yes', 'no']), ('q1', ['yes', 'no']), ('q2', ['yes', 'no'])]
+    assert isinstance(responses[0]['created_at'], str)
+    raw = next(pg_handler.iter_session_responses('s1', row_mode='namedtuple', convert=False))
+    assert raw.question_key in ('q0', 'q1', 'q2') and isinstance(raw.created_at, datetime)
+
+
+def test_iter_table_fetches_itersize_rows_through_a_named_cursor(pg_handler):
+    assert pg_handler.bulk_insert_responses([
+        {'session_id': 's1', 'question': dict(QUESTION, key=f"q{i}"), 'answer': 'yes'} for i in range(5)
+    ])
+    rows = pg_handler.iter_table('survey_responses', ['question_key'], order_by='question_key', itersize=2)
+    assert next(rows)['question_key'] == 'q0'
+    # The streaming connection's last statement, seen from another connection
+    statements = _query(pg_handler, "SELECT query FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid() AND query LIKE 'FETCH%%'")
+    assert len(statements) == 1 and statements[0][0].startswith('FETCH FORWARD 2 FROM "stream_')
+    assert [row['question_key'] for row in rows] == ['q1', 'q2', 'q3', 'q4']
+
+
+def test_migrations_apply_once_and_upgrade_an_older_schema(pg_handler):
+    assert pg_handler.schema_version() == len(MIGRATIONS)
+    assert _query(pg_handler, "SELECT version FROM schema_migrations ORDER BY version") == [(version,) for version, _, _ in MIGRATIONS]
+    assert pg_handler.migrate() == []
+
+    def response_indexes():
+        return {name for (name,) in _query(pg_handler, "SELECT indexname FROM pg_indexes WHERE tablename = 'survey_responses'")}
+    assert 'survey_responses_updated_idx' in response_indexes()
+    assert 'survey_responses_created_idx' not in response_indexes()
+
+    # A database left at version 3 gets the updated_at index in place of the created_at one
+    with pg_handler.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("DROP INDEX survey_responses_updated_idx")
+            cursor.execute("CREATE INDEX survey_responses_created_idx ON survey_responses (created_at, id)")
+            cursor.execute("DELETE FROM schema_migrations WHERE version = 4")
+        connection.commit()
+    assert pg_handler.migrate() == [4]
+    assert 'survey_responses_updated_idx' in response_indexes()
+    assert 'survey_responses_created_idx' not in response_indexes()
+
+
+def test_on_conflict_targets_are_unique_keys_of_their_tables(pg_handler):
+    source = inspect.getsource(supabase_handler)
+    targets = re.findall(r"INSERT INTO (\w+)(?:(?!INSERT INTO).)*?ON CONFLICT \(([^)]*)\)", source, re.DOTALL)
+    assert ('survey_responses', 'session_date, session_id, question_key') in targets
+
+    for table, columns in targets:
+        unique_keys = _query(pg_handler, """
+            SELECT array_agg(a.attname::text ORDER BY k.position)
+            FROM pg_index i
+            CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k (attnum, position)
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+            WHERE i.indrelid = %s::regclass AND i.indisunique
+            GROUP BY i.indexrelid
+        """, (table,))
+        assert {frozenset(key) for (key,) in unique_keys} >= {frozenset(columns.split(', '))}, table
+
+
+def test_replacing_an_answer_keeps_created_at_and_bumps_updated_at(pg_handler):
+    assert pg_handler.bulk_insert_responses([{'session_id': 's1', 'question': QUESTION, 'answer': 'yes'}])
+    [(created_at, updated_at)] = _query(pg_handler, "SELECT created_at, updated_at FROM survey_responses")
+    assert created_at == updated_at
+
+    assert pg_handler.bulk_insert_responses([{'session_id': 's1', 'question': QUESTION, 'answer': 'no'}])
+    [(answer, replaced_created_at, replaced_updated_at)] = _query(pg_handler, "SELECT answer, created_at, updated_at FROM survey_responses")
+    assert answer == 'no' and replaced_created_at == created_at and replaced_updated_at > updated_at
+    assert _query(pg_handler, "SELECT completed_questions FROM survey_sessions") == [(1,)]
@@ -0,0 +1,83 @@
+import json
+from datetime import date, datetime
+import pytest
+
+np = pytest.importorskip('numpy')
+from survey_analytics import EncodedResponses, all_distributions, answer_distribution, compare_groups, crosstab, numeric_stats
+
+FAV_OPTIONS = ['yes', 'no']
+# (session_id, question_key, answer, options) as iter_table yields them; 'maybe'
+# is not an option and s4 never answered 'score'
+ROWS = [
+    ('s1', 'fav', 'yes', FAV_OPTIONS),
+    ('s1', 'score', '3', [1, 2, 3]),
+    ('s1', 'why', 'Because.', None),
+    ('s2', 'fav', 'no', FAV_OPTIONS),
+    ('s2', 'score', '1', [1, 2, 3]),
+    ('s3', 'score', '2', json.dumps([1, 2, 3])),
+    ('s3', 'fav', 'yes', json.dumps(FAV_OPTIONS)),
+    ('s4', 'fav', 'maybe', FAV_OPTIONS),
+]
+
+
+@pytest.fixture
+def encoded():
+    return EncodedResponses.from_rows(ROWS)
+
+
+def test_from_rows_encodes_option_indices(encoded):
+    assert encoded.session_ids.tolist() == ['s1', 's2', 's3', 's4']
+    # Free-text questions have no options and are left out
+    assert encoded.keys == ['fav', 'score']
+    assert encoded.options == {'fav': ['yes', 'no'], 'score': ['1', '2', '3']}
+    assert encoded.question_codes('fav').tolist() == [0, 1, 0, -1]
+    assert encoded.question_codes('score').tolist() == [2, 0, 1, -1]
+
+    # Explicit option lists take precedence over the stored ones
+    reordered = EncodedResponses.from_rows(ROWS, options={'fav': ['no', 'yes', 'maybe']})
+    assert reordered.question_codes('fav').tolist() == [1, 0, 1, 2]
+
+
+def test_distributions_and_numeric_stats(encoded):
+    assert answer_distribution(encoded, 'fav') == {'yes': 2, 'no': 1}
+    assert answer_distribution(encoded, 'fav', normalize=True) == pytest.approx({'yes': 2 / 3, 'no': 1 / 3})
+    assert all_distributions(encoded)['score'] == {'1': 1, '2': 1, '3': 1}
+
+    stats = numeric_stats(encoded)
+    assert list(stats) == ['score']
+    assert stats['score'] == pytest.approx({'count': 3, 'mean': 2.0, 'variance': 1.0, 'std': 1.0})
+
+
+def test_crosstab_and_compare_groups(encoded):
+    assert crosstab(encoded, 'fav', 'score').tolist() == [[0, 1, 1], [1, 0, 0]]
+
+    groups = compare_groups(encoded, 'fav', {'s1': 'model-a', 's2': 'model-a', 's3': 'model-b'})
+    assert groups == {'model-a': {'yes': 0.5, 'no': 0.5}, 'model-b': {'yes': 1.0, 'no': 0.0}}
+    assert compare_groups(encoded, 'fav', {'s1': 'model-a', 's3': 'model-a'}, normalize=False) == {'model-a': {'yes': 2, 'no': 0}}
+
+
+def test_from_parquet_reads_an_exported_dataset(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+    from response_export import _long_schema, pivot_responses
+
+    def write(rows):
+        columns = list(zip(*[
+            (session_id, key, answer, options if isinstance(options, str) else json.dumps(options) if options else None, datetime(2026, 5, 1), date(2026, 5, 1))
+            for session_id, key, answer, options in rows
+        ]))
+        long_table = pa.table([pa.array(column, type=field.type) for column, field in zip(columns, _long_schema())], schema=_long_schema())
+        pq.write_to_dataset(pivot_responses(long_table), root_path=str(tmp_path), partition_cols=['session_date'])
+
+    # Two files whose 'fav' dictionaries differ (the second appended 'maybe')
+    # and of which only the second has a 'score' column
+    write([row for row in ROWS if row[0] in ('s1', 's2') and row[1] != 'score'])
+    write([row for row in ROWS if row[0] in ('s3', 's4')])
+
+    loaded = EncodedResponses.from_parquet(str(tmp_path))
+    assert sorted(loaded.keys) == ['fav', 'score']
+    assert loaded.options['fav'] == ['yes', 'no', 'maybe']
+    codes = {key: dict(zip(loaded.session_ids.tolist(), loaded.question_codes(key).tolist())) for key in loaded.keys}
+    assert codes['fav'] == {'s1': 0, 's2': 1, 's3': 0, 's4': 2}
+    assert codes['score'] == {'s1': -1, 's2': -1, 's3': 1, 's4': -1}
+    assert answer_distribution(loaded, 'fav') == {'yes': 2, 'no': 1, 'maybe': 1}
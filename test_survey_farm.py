@@ -0,0 +1,124 @@
+import pytest
+import yaml
+from fake_openai_server import FakeOpenAIServer
+from persona_population import PersonaPopulation
+from survey_farm import SessionJournal, run_farm
+
+
+class RecordingHandler:
+    written = []
+    session_tokens = {}
+    runs = []
+
+    def bulk_insert_responses(self, responses):
+        RecordingHandler.written.extend((r['session_id'], r['question']['key']) for r in responses)
+        return True
+
+    def add_session_usage(self, usage):
+        for session_id, session_usage in usage.items():
+            RecordingHandler.session_tokens[session_id] = RecordingHandler.session_tokens.get(session_id, 0) + session_usage.prompt_tokens
+        return True
+
+    def add_run_usage(self, run_id, model, usage):
+        RecordingHandler.runs.append((run_id, model, usage.requests))
+        return True
+
+    def close(self):
+        pass
+
+
+def test_rerun_only_asks_what_is_missing(tmp_path):
+    RecordingHandler.written = []
+    RecordingHandler.session_tokens = {}
+    RecordingHandler.runs = []
+    journal_dir = str(tmp_path / 'journal')
+    personas = [{}, {}, {'session_id': 'fixed', 'system_prompt': 'You are a pirate.'}]
+    settings = dict(workers=1, shards=2, handler_factory=RecordingHandler, store_batch_size=5, api_key='test')
+
+    # The first three requests fail without retries, leaving three pairs unanswered
+    with FakeOpenAIServer(statuses=[400, 400, 400]) as server:
+        first = run_farm('sample_q.yml', journal_dir, personas, base_url=server.base_url, **settings)
+    assert first['failed'] == 3
+    assert first['answered'] == 3 * 9 - 3
+    assert any(body['messages'][0]['content'].startswith('You are a pirate.') for body in server.received)
+
+    with FakeOpenAIServer() as server:
+        second = run_farm('sample_q.yml', journal_dir, personas, base_url=server.base_url, **settings)
+    assert len(server.received) == 3
+    assert second['answered'] == 3 and second['resumed'] == 24 and second['failed'] == 0
+
+    # Every pair reached the database exactly once
+    assert len(RecordingHandler.written) == len(set(RecordingHandler.written)) == 27
+    assert sum(session_id == 'fixed' for session_id, _ in RecordingHandler.written) == 9
+
+    # Token usage of both runs was added to every session and to the run
+    assert len(RecordingHandler.session_tokens) == 3
+    assert sum(RecordingHandler.session_tokens.values()) == first['usage']['prompt_tokens'] + second['usage']['prompt_tokens']
+    assert RecordingHandler.runs == [('farm', 'gpt-4o-mini', 24), ('farm', 'gpt-4o-mini', 3)]
+
+
+class UnreachableHandler(RecordingHandler):
+    def bulk_insert_responses(self, responses):
+        raise ConnectionError("database unreachable")
+
+    def add_session_usage(self, usage):
+        raise ConnectionError("database unreachable")
+
+
+def test_a_raising_handler_leaves_answers_journaled_and_the_shard_running(tmp_path):
+    RecordingHandler.runs = []
+    journal_dir = str(tmp_path / 'journal')
+    with FakeOpenAIServer() as server:
+        totals = run_farm('sample_q.yml', journal_dir, [{}, {}, {}], workers=1, shards=1, handler_factory=UnreachableHandler, store_batch_size=5, api_key='test', base_url=server.base_url)
+    # Every session was answered despite the failed writes, and nothing was marked stored
+    assert totals['answered'] == 3 * 9 and totals['unstored'] == 3 * 9
+    assert totals['store_failures'] >= 1
+
+    RecordingHandler.written = []
+    with FakeOpenAIServer() as server:
+        totals = run_farm('sample_q.yml', journal_dir, [{}, {}, {}], workers=1, shards=1, handler_factory=RecordingHandler, api_key='test', base_url=server.base_url)
+    assert len(server.received) == 0 and totals['unstored'] == 0
+    assert len(RecordingHandler.written) == 3 * 9
+
+
+class PopulationRejectingHandler(RecordingHandler):
+    def store_population(self, run_id, population, session_ids):
+        return False
+
+
+def test_run_stops_when_its_population_cannot_be_stored(tmp_path):
+    population = PersonaPopulation.sample({'template': "You are {mood}.", 'attributes': {'mood': ['calm', 'tense']}}, 2, seed=0)
+    with FakeOpenAIServer() as server:
+        with pytest.raises(RuntimeError, match='population'):
+            run_farm('sample_q.yml', str(tmp_path / 'journal'), population, workers=1, shards=1, handler_factory=PopulationRejectingHandler, api_key='test', base_url=server.base_url)
+    assert server.received == []
+
+
+def test_sample_conditions_gate_the_follow_up_question(tmp_path):
+    with open('sample_q.conditions.yml', 'r', encoding='utf-8') as f:
+        conditions = yaml.safe_load(f)
+
+    # The fake server picks the first option, so 'future' is answered "Yes"
+    with FakeOpenAIServer() as server:
+        totals = run_farm('sample_q.yml', str(tmp_path / 'journal'), [{}, {}], workers=1, shards=1, handler_factory=None, api_key='test', base_url=server.base_url, conditions=conditions)
+    assert totals['answered'] == 2 * 8 and totals['unreachable'] == 2
+    assert not any('previous question' in body['messages'][-1]['content'] for body in server.received)
+
+
+def test_journal_drops_torn_last_line(tmp_path):
+    path = str(tmp_path / 'shard.jsonl')
+    journal = SessionJournal(path)
+    journal.record('s1', 'a', 'yes')
+    journal.mark_stored(1)
+    journal.record('s1', 'b', 'no')
+    journal.close()
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"session_id": "s1", "ke')
+
+    journal = SessionJournal(path)
+    journal.record('s1', 'c', 'maybe')
+    journal.close()
+
+    journal = SessionJournal(path)
+    assert journal.unstored() == [(('s1', 'b'), 'no'), (('s1', 'c'), 'maybe')]
+    journal.close()
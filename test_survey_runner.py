@@ -0,0 +1,103 @@
+import asyncio
+import json
+import threading
+import time
+import openai
+from fake_openai_server import FakeOpenAIServer
+from rate_limiter import LLMScheduler
+from survey_runner import answer_questions_async
+
+FUTURE = {'key': 'future', 'type': 'mc', 'label': 'Right direction?', 'options': ['yes', 'no']}
+CONTINUANCE = {'key': 'continuance', 'type': 'textarea', 'label': 'Why not?', 'show_if': {'future': ['no']}}
+OPINION = {'key': 'opinion', 'type': 'textarea', 'label': 'Opinion?'}
+
+
+def run(questions, answer, **kwargs):
+    with FakeOpenAIServer(answer=answer) as server:
+        async def main():
+            client = openai.AsyncOpenAI(api_key='test', base_url=server.base_url)
+            return await answer_questions_async(questions, scheduler=LLMScheduler(client), **kwargs)
+        return asyncio.run(main()), server.received
+
+
+def test_unreachable_questions_are_skipped_without_a_call():
+    answers, received = run([CONTINUANCE, FUTURE, OPINION], lambda body: 'yes' if 'Available options' in body['messages'][-1]['content'] else 'Fine.')
+
+    assert [(a['key'], a['status']) for a in answers] == [('continuance', 'skipped'), ('future', 'ok'), ('opinion', 'ok')]
+    assert len(received) == 2
+
+
+def test_gated_question_runs_after_its_prerequisite():
+    answers, received = run([CONTINUANCE, FUTURE], lambda body: 'No' if 'Available options' in body['messages'][-1]['content'] else 'It lost its way.')
+
+    assert answers == [
+        {'key': 'continuance', 'answer': 'It lost its way.', 'status': 'ok'},
+        {'key': 'future', 'answer': 'no', 'status': 'ok'}
+    ]
+    assert 'Right direction?' in received[0]['messages'][-1]['content']
+
+
+def test_known_answers_satisfy_conditions_and_cycles_are_rejected():
+    answers, received = run([CONTINUANCE], lambda body: 'Too many sequels.', known_answers={'future': 'no'})
+    assert answers[0]['status'] == 'ok' and len(received) == 1
+
+    cyclic = [dict(FUTURE, show_if={'continuance': ['x']}), CONTINUANCE]
+    try:
+        run(cyclic, lambda body: 'x')
+    except ValueError as e:
+        assert 'cycle' in str(e)
+    else:
+        raise AssertionError("expected ValueError")
+
+
+def test_matrix_rows_share_one_structured_request_and_invalid_rows_are_reasked():
+    rows = [
+        {'key': f"rating_{row}", 'type': 'mc', 'label': f"How do you rate {row}?", 'options': ['good', 'bad'], 'matrix_key': 'rating'}
+        for row in ('luke', 'leia', 'han')
+    ]
+
+    def answer(body):
+        if 'response_format' in body:
+            # 'leia' is not one of the options and 'han' is missing
+            return json.dumps({'rating_luke': 'GOOD', 'rating_leia': 'terrible'})
+        return 'bad' if 'Available options' in body['messages'][-1]['content'] else 'Fine.'
+
+    answers, received = run(rows + [OPINION], answer, matrix_mode=True)
+
+    structured = [body for body in received if 'response_format' in body]
+    assert len(structured) == 1
+    assert list(structured[0]['response_format']['json_schema']['schema']['properties']) == ['rating_luke', 'rating_leia', 'rating_han']
+    single_prompts = [body['messages'][-1]['content'] for body in received if 'response_format' not in body]
+    assert sorted(prompt.splitlines()[-1] for prompt in single_prompts) == ['Question: How do you rate han?', 'Question: How do you rate leia?', 'Question: Opinion?']
+    assert [(a['key'], a['answer'], a['status']) for a in answers] == [
+        ('rating_luke', 'good', 'ok'), ('rating_leia', 'bad', 'ok'), ('rating_han', 'bad', 'ok'), ('opinion', 'Fine.', 'ok')
+    ]
+
+    # Without matrix_mode every row is its own request
+    _, received = run(rows, answer)
+    assert len(received) == 3 and not any('response_format' in body for body in received)
+
+
+def test_concurrency_is_capped_and_results_keep_question_order():
+    questions = [{'key': f"q{i}", 'type': 'textarea', 'label': f"Question {i}?"} for i in range(8)]
+    lock = threading.Lock()
+    in_flight, peak, finished = [0], [0], []
+
+    def answer(body):
+        index = int(body['messages'][-1]['content'].split()[-1].rstrip('?'))
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        # Earlier questions take longer, so calls finish out of order
+        time.sleep(0.02 * (8 - index))
+        with lock:
+            in_flight[0] -= 1
+            finished.append(index)
+        return f"Answer {index}."
+
+    answers, received = run(questions, answer, max_concurrency=3)
+
+    assert 1 < peak[0] <= 3
+    assert finished != sorted(finished)
+    assert [(a['key'], a['answer'], a['status']) for a in answers] == [(f"q{i}", f"Answer {i}.", 'ok') for i in range(8)]
+    assert len(received) == 8
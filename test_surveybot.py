@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+import pytest
+import surveybot
+
+# Libraries only the code doing the work may import; openai alone takes ~0.5 s
+DEFERRED_MODULES = ('openai', 'httpx', 'pydantic', 'psycopg2', 'dotenv', 'numpy', 'pyarrow')
+
+
+def _import_fresh(module: str):
+    """Import module in a new interpreter; returns the deferred modules it loaded"""
+    code = f"import sys, {module}; print(' '.join(name for name in {DEFERRED_MODULES!r} if name in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    return result.stdout.split()
+
+
+def test_entry_modules_defer_heavy_imports():
+    # Which modules are loaded, not how long loading takes, so the check does not depend on the machine
+    for module in ('surveybot', 'survey_farm', 'batch_runner', 'supabase_handler'):
+        loaded = _import_fresh(module)
+        assert loaded == [], f"importing {module} loaded {loaded}"
+
+
+def test_cli_dispatches_to_the_command(capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        surveybot.main(['--help'])
+    assert exit_info.value.code == 0
+    assert 'bench' in capsys.readouterr().out
+
+    assert surveybot.main(['bench', '--sessions', '1', '--seed', '1']) == 0
+    assert "1 sessions: 9 answers" in capsys.readouterr().out
+
+    with pytest.raises(SystemExit) as exit_info:
+        surveybot.main(['bench', '--help'])
+    assert exit_info.value.code == 0
+    assert capsys.readouterr().out.startswith("usage: surveybot bench")
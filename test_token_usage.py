@@ -0,0 +1,61 @@
+import asyncio
+import openai
+from fake_openai_server import FakeOpenAIServer
+from llm_question_handler import _prepare_request
+from rate_limiter import LLMScheduler
+from survey_runner import answer_questions_async
+from token_usage import TokenUsage, usage_from_response
+
+QUESTIONS = [
+    {'key': 'fav', 'type': 'mc', 'label': 'Favourite?', 'options': ['yes', 'no']},
+    {'key': 'why', 'type': 'textarea', 'label': 'Why?'},
+]
+# Long enough for the fake server to cache (1024 tokens at ~4 characters each)
+PERSONA = "You are a retired astronomer from Lyon. " * 110
+
+
+def test_prompts_share_a_stable_prefix_and_end_with_the_question():
+    requests = [_prepare_request(question, 'gpt-4o-mini', PERSONA)[0] for question in QUESTIONS]
+
+    assert requests[0]['messages'][0] == requests[1]['messages'][0]
+    assert requests[0]['messages'][0]['content'].startswith(PERSONA.strip())
+    assert requests[0]['messages'][1]['content'] == "Available options: yes, no\n\nQuestion: Favourite?"
+    assert requests[1]['messages'][1]['content'] == "Question: Why?"
+
+
+def test_usage_is_priced_by_model_prefix():
+    usage = usage_from_response({'prompt_tokens': 2000, 'completion_tokens': 100, 'prompt_tokens_details': {'cached_tokens': 1024}}, 'gpt-4o-mini-2024-07-18')
+
+    assert usage['cached_tokens'] == 1024
+    assert abs(usage['cost_usd'] - (976 * 0.15 + 1024 * 0.075 + 100 * 0.60) / 1_000_000) < 1e-12
+    assert usage_from_response({'prompt_tokens': 10, 'completion_tokens': 1}, 'some-local-model')['cost_usd'] is None
+
+
+def test_session_usage_reaches_the_writer_and_counts_cached_tokens():
+    class RecordingWriter:
+        def __init__(self):
+            self.usage = {}
+
+        def add_many(self, session_id, responses):
+            pass
+
+        def add_usage(self, session_id, usage):
+            self.usage[session_id] = usage
+
+    with FakeOpenAIServer() as server:
+        async def run():
+            client = openai.AsyncOpenAI(api_key='test', base_url=server.base_url)
+            scheduler = LLMScheduler(client)
+            totals = TokenUsage()
+            # One at a time, so the second request finds the first one's prefix cached
+            await answer_questions_async(QUESTIONS, max_concurrency=1, writer=writer, session_id='s1', scheduler=scheduler, system_prompt=PERSONA, usage=totals)
+            return scheduler, totals
+
+        writer = RecordingWriter()
+        scheduler, totals = asyncio.run(run())
+
+    session = writer.usage['s1']
+    assert session.requests == 2 and totals.as_dict() == session.as_dict() == scheduler.usage.as_dict()
+    assert session.cached_tokens >= 1024 and session.cached_tokens % 128 == 0
+    assert session.prompt_tokens == sum(sum(len(m['content']) for m in body['messages']) // 4 for body in server.received)
+    assert session.cost_usd > 0
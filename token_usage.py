@@ -0,0 +1,143 @@
+from typing import Dict, Any, Optional, Tuple
+from instrumentation import metrics
+
+# USD per million tokens: (input, cached input, output). Dated snapshots such
+# as 'gpt-4o-mini-2024-07-18' are priced by their longest matching prefix.
+MODEL_PRICES: Dict[str, Tuple[float, float, float]] = {
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4.1-nano': (0.10, 0.025, 0.40),
+    'gpt-4.1-mini': (0.40, 0.10, 1.60),
+    'gpt-4.1': (2.00, 0.50, 8.00),
+}
+
+# Batch API requests are billed at half the synchronous price
+BATCH_DISCOUNT = 0.5
+
+USAGE_FIELDS = ('requests', 'prompt_tokens', 'cached_tokens', 'completion_tokens')
+
+
+def model_prices(model: Optional[str]) -> Optional[Tuple[float, float, float]]:
+    """Prices for a model name, or None if it is not in MODEL_PRICES"""
+    if not model:
+        return None
+    if model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    matches = [name for name in MODEL_PRICES if model.startswith(f"{name}-")]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def _field(value: Any, name: str) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+
+def usage_from_response(usage: Any, model: Optional[str] = None, discount: float = 1.0) -> Optional[Dict[str, Any]]:
+    """
+    Token counts and cost of one chat completion
+
+    Args:
+        usage: The response's usage, as a CompletionUsage object or a dictionary
+        model: Model the request was billed for, used to price it
+        discount: Price multiplier, e.g. BATCH_DISCOUNT
+
+    Returns:
+        Dictionary with 'prompt_tokens', 'cached_tokens', 'completion_tokens' and
+        'cost_usd' (None for unknown models), or None if the response had no usage
+    """
+    if usage is None:
+        return None
+    prompt_tokens = _field(usage, 'prompt_tokens') or 0
+    cached_tokens = _field(_field(usage, 'prompt_tokens_details'), 'cached_tokens') or 0
+    completion_tokens = _field(usage, 'completion_tokens') or 0
+    prices = model_prices(model)
+    cost = None
+    if prices is not None:
+        input_price, cached_price, output_price = prices
+        cost = ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price + completion_tokens * output_price) * discount / 1_000_000
+    return {
+        'prompt_tokens': prompt_tokens,
+        'cached_tokens': cached_tokens,
+        'completion_tokens': completion_tokens,
+        'cost_usd': cost
+    }
+
+
+def count_usage(usage: Optional[Dict[str, Any]]):
+    """Add one completion's usage (as returned by usage_from_response) to the process metrics"""
+    if usage is None:
+        return
+    metrics.inc('llm_tokens_total', usage['prompt_tokens'] - usage['cached_tokens'], kind='input')
+    metrics.inc('llm_tokens_total', usage['cached_tokens'], kind='cached_input')
+    metrics.inc('llm_tokens_total', usage['completion_tokens'], kind='output')
+    if usage['cost_usd'] is not None:
+        metrics.inc('llm_cost_usd_total', usage['cost_usd'])
+
+
+class TokenUsage:
+    """
+    Running token and cost totals, e.g. for one session or one run.
+
+    Requests priced at None (unknown models) are counted in unpriced and
+    left out of cost_usd.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.unpriced = 0
+
+    def add(self, usage: Optional[Dict[str, Any]]):
+        """Count one completion's usage as returned by usage_from_response"""
+        if usage is None:
+            return
+        self.requests += 1
+        self.prompt_tokens += usage['prompt_tokens']
+        self.cached_tokens += usage['cached_tokens']
+        self.completion_tokens += usage['completion_tokens']
+        if usage['cost_usd'] is None:
+            self.unpriced += 1
+        else:
+            self.cost_usd += usage['cost_usd']
+
+    def merge(self, other: "TokenUsage"):
+        """Add another total to this one"""
+        for field in USAGE_FIELDS + ('unpriced',):
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        self.cost_usd += other.cost_usd
+
+    def __bool__(self) -> bool:
+        return self.requests > 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'prompt_tokens': self.prompt_tokens,
+            'cached_tokens': self.cached_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cost_usd': round(self.cost_usd, 6),
+            'unpriced': self.unpriced
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TokenUsage":
+        usage = cls()
+        for field in USAGE_FIELDS + ('unpriced',):
+            setattr(usage, field, data.get(field, 0))
+        usage.cost_usd = data.get('cost_usd', 0.0)
+        return usage
+
+
+# Example usage:
+# from token_usage import TokenUsage, usage_from_response
+#
+# session = TokenUsage()
+# response = client.chat.completions.create(**request)
+# session.add(usage_from_response(response.usage, request['model']))
+# print(session.as_dict())